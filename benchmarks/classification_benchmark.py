@@ -0,0 +1,103 @@
+"""
+Rows/second of the clean_data classification layer against the previous per-row implementation.
+
+Usage:
+    python benchmarks/classification_benchmark.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT / "src" / "clean_data"), str(ROOT / "src" / "layers" / "common")]
+
+import app as clean_data  # noqa: E402
+
+SEARCH_TERMS = ["Vitamin D3", "Vitamin D3 K2", "Vitamin D3 Coconut Oil", "Collagen Peptides"]
+
+
+def get_play_level(play_count):
+    if play_count < 10_000:
+        return "low"
+    elif play_count < 50_000:
+        return "medium"
+    else:
+        return "high"
+
+
+def get_influencer_type(profile_followers):
+    if profile_followers > 1_000_000:
+        return "celebrity"
+    elif profile_followers > 100_000:
+        return "major"
+    elif profile_followers > 10_000:
+        return "micro"
+    else:
+        return "nano"
+
+
+def fix_biography(biography):
+    if pd.isna(biography):
+        return ""
+    return biography.replace("\n", " ").replace("\r", " ")
+
+
+def legacy_add_new_columns(df):
+    df['play_count'] = pd.to_numeric(df['play_count'].str.replace(',', ''), errors='coerce').fillna(0).astype(int)
+    df['plays'] = df['play_count'].map(get_play_level).astype('string')
+    df['influencer_type'] = df['profile_followers'].map(get_influencer_type).astype('string')
+    df['profile_biography'] = df['profile_biography'].map(fix_biography).astype('string')
+    df['search_term'] = df['discovery_input'].map(lambda d: d.get("search_keyword", "")).astype('string')
+    df['product_promo'] = False
+    for col, replace_with in (('hashtags', list), ('music', dict)):
+        replacement = replace_with()
+        df[col] = df[col].apply(lambda x: str(x) if isinstance(x, replace_with) else str(replacement)).astype('string')
+    return df
+
+
+def vectorized_add_new_columns(df):
+    # to_dataframe derives the search term from discovery_input when the frame is built
+    df['search_term'] = clean_data.get_search_terms(df.pop('discovery_input'))
+    df = clean_data.add_new_columns(df)
+    df = clean_data.restructure_records(df, ['hashtags'], replace_with=list)
+    df = clean_data.restructure_records(df, ['music'], replace_with=dict)
+    return df
+
+
+def make_frame(size, seed=7):
+    rng = random.Random(seed)
+    return pd.DataFrame({
+        "play_count": [f"{rng.randint(0, 200_000):,}" for _ in range(size)],
+        "profile_followers": [rng.randint(0, 3_000_000) for _ in range(size)],
+        "profile_biography": [rng.choice([None, "Mom of 2\nNurse", "Fitness\r\ncoach", ""]) for _ in range(size)],
+        "discovery_input": [{"search_keyword": rng.choice(SEARCH_TERMS)} for _ in range(size)],
+        "hashtags": [rng.choice([["movie", "fyp"], None]) for _ in range(size)],
+        "music": [rng.choice([{"id": "1", "title": "original sound"}, None]) for _ in range(size)],
+    }).astype({"play_count": "string"})
+
+
+def measure(fn, df):
+    start = time.perf_counter()
+    fn(df.copy())
+    return len(df) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'legacy rows/s':>15} {'vectorized rows/s':>18} {'speedup':>8}")
+    for size in args.sizes:
+        df = make_frame(size)
+        legacy = measure(legacy_add_new_columns, df)
+        vectorized = measure(vectorized_add_new_columns, df)
+        print(f"{size:>10,} {legacy:>15,.0f} {vectorized:>18,.0f} {vectorized / legacy:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Cold-start budget of the Lambda handlers: module import time (-X importtime) and first-invocation latency.
+
+Usage:
+    python benchmarks/cold_start.py [--runs 5] [--save-baseline cold_start.json]
+    python benchmarks/cold_start.py --baseline cold_start.json [--tolerance 0.25]
+
+With --baseline the script exits with status 1 when a handler got slower than the baseline by more than the
+tolerance, so it can gate changes that pull heavy imports back onto the cold start path.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+COMMON_LAYER = ROOT / "src" / "layers" / "common"
+
+# Events exercising a validation failure, which should not pay for pandas, openai or a parser.
+# Handlers without such a path are only measured for their import time.
+HANDLERS = {
+    "brightdata_callback": {"input": {"search_terms": "not a list"}},
+    "clean_data": {"status": "fail"},
+    "collection": None,
+    "extract_keywords": None,
+    "ingest_data": [],
+    "notification": {"queryStringParameters": {}},
+    "notify_slack": {},
+    "scrape_product_page": {},
+    "summarize_product_details": None,
+}
+
+FIRST_INVOCATION = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+
+class Context:
+    invoked_function_arn = "arn:aws:lambda:us-east-2:000000000000:function:cold-start"
+
+    def get_remaining_time_in_millis(self):
+        return 90_000
+
+event = json.loads(sys.argv[1])
+if event is not None:
+    try:
+        app.lambda_handler(event, Context())
+    except Exception:
+        pass
+print(json.dumps({"import_ms": (imported - start) * 1000, "first_invocation_ms": (time.perf_counter() - start) * 1000}))
+"""
+
+
+def get_env(handler):
+    env = {key: value for key, value in os.environ.items()
+           if key not in ("API_BASE_URL", "SLACK_WEBHOOK_URL", "PYTHONPATH")}
+    env["PYTHONPATH"] = os.pathsep.join([str(ROOT / "src" / handler), str(COMMON_LAYER)])
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+    return env
+
+
+def measure_importtime(handler):
+    """
+    Cumulative import time of the handler module in milliseconds, as reported by -X importtime
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                            env=get_env(handler), capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == "app":
+            return int(parts[1].strip()) / 1000
+    raise RuntimeError(f"No import time reported for {handler}")
+
+
+def measure_first_invocation(handler, event):
+    result = subprocess.run([sys.executable, "-c", FIRST_INVOCATION, json.dumps(event)],
+                            env=get_env(handler), capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])["first_invocation_ms"]
+
+
+def measure(runs):
+    results = {}
+    for handler, event in HANDLERS.items():
+        import_ms = statistics.median(measure_importtime(handler) for _ in range(runs))
+        invocation_ms = None
+        if event is not None:
+            invocation_ms = statistics.median(measure_first_invocation(handler, event) for _ in range(runs))
+        results[handler] = {"import_ms": round(import_ms, 1), "first_invocation_ms": invocation_ms and round(invocation_ms, 1)}
+    return results
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for handler, result in results.items():
+        for metric, value in result.items():
+            expected = baseline.get(handler, {}).get(metric)
+            if value is not None and expected and value > expected * (1 + tolerance):
+                regressions.append(f"{handler} {metric}: {value} ms, baseline {expected} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per measurement, the median is kept")
+    parser.add_argument("--baseline", type=Path, help="Fail on regressions against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline")
+    parser.add_argument("--save-baseline", type=Path, help="Write the measurements as the new baseline")
+    args = parser.parse_args()
+
+    results = measure(args.runs)
+
+    print(f"{'handler':<28} {'import ms':>10} {'first invocation ms':>20}")
+    for handler, result in results.items():
+        invocation = result["first_invocation_ms"]
+        print(f"{handler:<28} {result['import_ms']:>10.1f} {invocation if invocation is not None else '-':>20}")
+
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(results, indent=2) + "\n")
+
+    if args.baseline:
+        regressions = find_regressions(results, json.loads(args.baseline.read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Tokens sent to the summarizer with and without the scrape_product_page distillation, and the time it takes.
+
+Without a corpus the benchmark builds a synthetic product page: a long navigation menu, a cookie banner, the product
+description, a "customers also bought" carousel, repeated badges and a footer full of links. With a directory of saved
+pages it reports every page of it. Token counts use tiktoken when its encoding can be loaded, the approximation of
+common.tokens otherwise; the first line of the output tells which.
+
+Usage:
+    python benchmarks/distill_benchmark.py [path/to/saved/pages] [--budget 2000] [--runs 20] [--show]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT / "src" / "scrape_product_page"), str(ROOT / "src" / "layers" / "common")]
+# distill is instrumented, its metric documents would be printed between the report lines
+os.environ.setdefault("METRICS_ENABLED", "false")
+
+import app as scraper  # noqa: E402
+from common import tokens  # noqa: E402
+
+
+def make_page():
+    menu = "".join(f"<li><a href='/c/{index}'>Category {index}</a></li>" for index in range(120))
+    details = "".join(
+        f"<p>Vitamin D3 10000 IU with K2 supports bone and immune health. Each softgel has 250 mcg of D3, "
+        f"serving size {index % 3 + 1} softgel, made with organic olive oil and free of gluten. Benefit {index}: "
+        f"helps calcium absorption for adults over 40.</p>" for index in range(40)
+    )
+    badge = "<div class='badge'><p>Climate Pledge Friendly products are certified by trusted partners</p></div>"
+    carousel = "".join(
+        f"<li><a href='/p/{index}'>Vitamin C 1000 mg Gummies, {index} count, orange flavour, by Brand {index}</a> "
+        f"<span>$ {index}.99</span></li>" for index in range(60)
+    )
+    reviews = "".join(
+        f"<div class='review'><p>Great product! Review {index}, the softgels are small and easy to swallow.</p></div>"
+        for index in range(30)
+    )
+    footer = "".join(f"<a href='/f/{index}'>Footer link {index}</a> " for index in range(80))
+    return (
+        "<html><head><title>Vitamin D3 10000 IU Plus K2 Softgels</title><script>var tracking = 1;</script></head>"
+        f"<body><header><nav><ul>{menu}</ul></nav></header>"
+        "<div id='cookie-banner'><p>We use cookies to improve your experience, accept all cookies?</p></div>"
+        f"<main><h1>Vitamin D3 10000 IU Plus K2 Softgels</h1>{badge}<section>{details}</section>{badge}"
+        f"<h2>Customers who bought this item also bought</h2><ul class='a-carousel'>{carousel}</ul>"
+        f"<h2>Top reviews</h2>{reviews}{badge}</main>"
+        f"<footer><p>Conditions of Use Privacy Notice Interest-Based Ads</p>{footer}</footer></body></html>"
+    ).encode("utf-8")
+
+
+def measure(content, budget, runs):
+    extract = scraper.get_extractor()
+    body_content, _, _, blocks = extract(content)
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        distilled = scraper.distill(blocks, body_content, budget)
+        durations.append((time.perf_counter() - start) * 1000)
+    return body_content, distilled, statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", nargs="?", help="Directory of saved .html pages, a synthetic page otherwise")
+    parser.add_argument("--budget", type=int, default=scraper.DISTILL_TOKEN_BUDGET, help="Distillation token budget")
+    parser.add_argument("--runs", type=int, default=20, help="Runs per page, the median is kept")
+    parser.add_argument("--show", action="store_true", help="Print the distilled text")
+    args = parser.parse_args()
+
+    if args.corpus:
+        pages = {path.name: path.read_bytes() for path in sorted(Path(args.corpus).glob("*.htm*"))}
+        if not pages:
+            raise SystemExit(f"No .html pages found in {args.corpus}")
+    else:
+        pages = {"synthetic": make_page()}
+
+    tokenizer = tokens.TOKENIZER_ENCODING if tokens.get_encoding() is not None else "approximate"
+    print(f"tokenizer: {tokenizer}, extractor: {scraper.get_extractor().__name__}, budget: {args.budget}")
+    print(f"  {'page':<24} {'tokens in':>10} {'tokens out':>11} {'kept':>6} {'distill ms':>11}")
+    for name, content in pages.items():
+        body_content, distilled, duration = measure(content, args.budget, args.runs)
+        tokens_in, tokens_out = tokens.count_tokens(body_content), tokens.count_tokens(distilled)
+        print(f"  {name[:24]:<24} {tokens_in:>10,} {tokens_out:>11,} {tokens_out / max(tokens_in, 1):>6.1%} "
+              f"{duration:>11.2f}")
+        if args.show:
+            print(distilled)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Per-request latency of the outbound HTTP calls made with a new connection each time, as requests.request did
+before common.http_client, against the pooled keep-alive sessions of http_client.
+
+The target is the Slack route of the local runner stub server. With --tls it serves HTTPS behind a throwaway
+self-signed certificate (openssl must be on the PATH), which is where connection reuse matters most: every
+unpooled call pays the TCP and the TLS handshakes. --latency adds server time to every request, to see how the
+saving compares with a realistic response time.
+
+Usage:
+    python benchmarks/http_client_benchmark.py [--requests 200] [--tls] [--latency 0]
+"""
+import argparse
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT), str(ROOT / "src" / "layers" / "common")]
+
+from common import http_client  # noqa: E402
+from local_runner.stubs import ServiceConfig, StubServer  # noqa: E402
+
+
+def make_certificate(directory):
+    cert, key = Path(directory) / "cert.pem", Path(directory) / "key.pem"
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                    "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", str(key), "-out", str(cert)],
+                   check=True, capture_output=True)
+    return cert, key
+
+
+def start_stub(latency, cert=None, key=None):
+    stub = StubServer({"slack": ServiceConfig(latency=latency)})
+    url = stub.url
+    if cert is not None:
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(cert, key)
+        stub.server.socket = context.wrap_socket(stub.server.socket, server_side=True)
+        url = url.replace("http://", "https://")
+    return stub.start(), url
+
+
+def measure(send, count):
+    durations = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = send()
+        response.raise_for_status()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per measurement")
+    parser.add_argument("--tls", action="store_true", help="Serve HTTPS with a self-signed certificate")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added by the server to every request")
+    args = parser.parse_args()
+
+    message = {"text": "Benchmark message"}
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(directory) if args.tls else (None, None)
+        stub, url = start_stub(args.latency, cert, key)
+        url = f"{url}/slack"
+        verify = str(cert) if cert else True
+
+        results = {
+            "new connection": measure(
+                lambda: requests.request("POST", url, json=message, timeout=http_client.get_timeout(), verify=verify),
+                args.requests
+            ),
+            # First call of a fresh session, as in a cold invocation
+            "pooled, cold": measure(lambda: http_client.request("POST", url, json=message, verify=verify), 1),
+            "pooled, warm": measure(
+                lambda: http_client.request("POST", url, json=message, verify=verify), args.requests
+            ),
+        }
+        stub.stop()
+
+    baseline = statistics.median(results["new connection"])
+    print(f"{args.requests} POST requests to {url} ({'HTTPS' if args.tls else 'HTTP'}, {args.latency}s latency)")
+    print(f"  {'client':<15} {'p50 ms':>8} {'p95 ms':>8} {'vs new':>7}")
+    for name, durations in results.items():
+        p50 = statistics.median(durations)
+        p95 = statistics.quantiles(durations, n=20)[-1] if len(durations) > 1 else durations[0]
+        print(f"  {name:<15} {p50:>8.2f} {p95:>8.2f} {p50 / baseline:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
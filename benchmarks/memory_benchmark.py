@@ -0,0 +1,204 @@
+"""
+Peak memory of clean_data per 100k posts: the previous loader, which kept every raw Brightdata field as objects until
+the final projection, against the projected, categorical and downcast frame.
+
+Every run happens in a fresh process, reading the same newline-delimited JSON snapshot from disk, and reports the
+growth of its peak RSS over the RSS it had once the snapshot bytes were loaded. The synthetic records carry the large
+fields of a real snapshot: signed video, cover and music URLs, the full discovery_input and the top comments.
+
+Usage:
+    python benchmarks/memory_benchmark.py [--sizes 10000 100000] [--seed 7]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT / "src" / "clean_data"), str(ROOT / "src" / "layers" / "common")]
+# The cleaning stages are instrumented, their metric documents would be printed between the report lines
+os.environ.setdefault("METRICS_ENABLED", "false")
+
+import pandas as pd  # noqa: E402
+
+import app as clean_data  # noqa: E402
+
+SEARCH_TERMS = ["Vitamin D3", "Vitamin D3 K2", "Vitamin D3 Coconut Oil", "Collagen Peptides"]
+REGIONS = ["US", "US", "US", "CA", "GB", "DE"]
+
+
+def signed_url(rng, host, path):
+    signature = "".join(rng.choice("abcdef0123456789") for _ in range(64))
+    return (f"https://{host}/{path}/{rng.getrandbits(64):x}?x-expires={rng.randint(1_700_000_000, 1_800_000_000)}"
+            f"&x-signature={signature}&ps=13740610&shp=81f88b70&shcp=43f4a2f9&idc=useast5&biz_tag=tt_video")
+
+
+def make_record(rng, index):
+    search_term = rng.choice(SEARCH_TERMS)
+    return {
+        "url": f"https://www.tiktok.com/@creator{index % 5000}/video/{7_300_000_000_000_000_000 + index}",
+        "post_id": str(7_300_000_000_000_000_000 + index),
+        "description": f"My {search_term} routine day {index % 90} #health #vitamins #fyp " * rng.randint(1, 4),
+        "create_time": f"2024-{rng.randint(6, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00.000Z",
+        "digg_count": rng.randint(0, 500_000),
+        "share_count": rng.randint(0, 20_000),
+        "collect_count": rng.randint(0, 50_000),
+        "comment_count": rng.randint(0, 5_000),
+        "play_count": f"{rng.randint(0, 2_000_000):,}",
+        "video_duration": rng.randint(5, 180),
+        "hashtags": ["health", "vitamins", "fyp"][:rng.randint(0, 3)] or None,
+        "original_sound": rng.random() < 0.5,
+        "profile_id": str(6_800_000_000_000_000_000 + index % 5000),
+        "profile_username": f"creator{index % 5000}",
+        "profile_url": f"https://www.tiktok.com/@creator{index % 5000}",
+        "profile_avatar": signed_url(rng, "p16-sign-va.tiktokcdn.com", "tos-maliva-avt-0068"),
+        "profile_biography": rng.choice([None, "Mom of 2\nNurse", "Fitness\r\ncoach | DM for collabs", ""]),
+        "preview_image": signed_url(rng, "p16-sign-va.tiktokcdn.com", "obj/tos-maliva-p-0068"),
+        "offical_item": False,
+        "secu_id": "MS4wLjABAAAA" + "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(64)),
+        "is_verified": rng.random() < 0.05,
+        "profile_followers": rng.randint(0, 3_000_000),
+        "region": rng.choice(REGIONS),
+        "commerce_info": json.dumps({"ad_source": 0, "adv_promotable": False, "branded_content_type": 0}),
+        "music": {
+            "authorname": f"creator{index % 5000}",
+            "covermedium": signed_url(rng, "p16-sign-va.tiktokcdn.com", "tos-maliva-avt-0068"),
+            "id": str(7_100_000_000_000_000_000 + index),
+            "original": True,
+            "playurl": signed_url(rng, "v16m.tiktokcdn.com", "video/tos/useast2a/tos-useast2a-ve-2774"),
+            "title": f"original sound - creator{index % 5000}"
+        },
+        "video_url": signed_url(rng, "v16-webapp-prime.tiktok.com", "video/tos/useast2a/tos-useast2a-pve-0068"),
+        "subtitle_url": signed_url(rng, "v16-webapp-prime.tiktok.com", "video/tos/alisg/tos-alisg-pv-0037"),
+        "top_comments": [{"text": f"Which brand is this? comment {comment}", "commenter_user_name": f"user{comment}",
+                          "num_likes": rng.randint(0, 500)} for comment in range(rng.randint(0, 5))],
+        "discovery_input": {
+            "search_keyword": search_term,
+            "country": "US",
+            "num_of_posts": 1000,
+            "posts_to_not_include": "",
+            "what_to_collect": "Posts",
+            "start_date": "06-01-2024",
+            "end_date": ""
+        }
+    }
+
+
+def write_snapshot(path, size, seed):
+    rng = random.Random(seed)
+    with open(path, "w") as file:
+        for index in range(size):
+            file.write(json.dumps(make_record(rng, index)) + "\n")
+
+
+def legacy_clean(records):
+    """The clean_records stages as they were, with the raw fields kept until the final projection"""
+    df = pd.DataFrame(records)
+    df = df.astype({'post_id': 'string', 'profile_id': 'string', 'create_time': 'string', 'play_count': 'string'})
+    df = clean_data.fix_create_time(df)
+    df = df[df["region"].isin(clean_data.filters["region"])]
+    df = df[df["create_time"] > pd.to_datetime(clean_data.filters["create_time"], utc=True)]
+
+    df[clean_data.string_columns] = df[clean_data.string_columns].astype('string')
+    df[clean_data.numeric_columns] = df[clean_data.numeric_columns].apply(pd.to_numeric, errors='coerce') \
+        .fillna(0).astype(int)
+    df['play_count'] = pd.to_numeric(df['play_count'].str.replace(',', ''), errors='coerce').fillna(0).astype(int)
+    df['plays'] = clean_data.get_levels(df['play_count'], clean_data.play_levels).astype('string')
+    df['influencer_type'] = clean_data.get_levels(df['profile_followers'], clean_data.influencer_types) \
+        .astype('string')
+    df['profile_biography'] = clean_data.fix_biography(df['profile_biography'])
+    normalized = pd.json_normalize(df['discovery_input'].tolist())
+    df['search_term'] = normalized["search_keyword"].fillna("").astype('string').set_axis(df.index)
+    df['product_promo'] = False
+    df = clean_data.restructure_records(df, clean_data.array_columns, replace_with=list)
+    df = clean_data.restructure_records(df, clean_data.object_columns, replace_with=dict)
+
+    df = df[clean_data.string_columns + clean_data.numeric_columns + clean_data.array_columns +
+            clean_data.object_columns + clean_data.new_columns]
+    return clean_data.apply_filters_on_restructured_data(df)
+
+
+def get_rss_kib():
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def get_peak_rss_kib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB on Linux
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def parse(body, project=False):
+    # Line by line like iter_lines, the body is not copied into a list of lines
+    lines = (line for line in io.BytesIO(body) if line.strip())
+    if project:
+        # As get_response does, every record is projected as soon as it is parsed
+        return [clean_data.project_record(json.loads(line)) for line in lines]
+    return [json.loads(line) for line in lines]
+
+
+def run(mode, path):
+    body = Path(path).read_bytes()
+    baseline = get_rss_kib()
+    start = time.perf_counter()
+    if mode == "before":
+        # The previous clean_data held the parsed records until it returned
+        records = parse(body)
+        df = legacy_clean(records)
+    else:
+        df = clean_data.clean_records(clean_data.to_dataframe(parse(body, project=True)))
+    duration = time.perf_counter() - start
+    peak = get_peak_rss_kib()
+    return {
+        "posts": body.count(b"\n"),
+        "cleaned": len(df),
+        "peak_kib": peak - baseline,
+        "frame_kib": int(df.memory_usage(deep=True).sum() // 1024),
+        "duration_ms": round(duration * 1000)
+    }
+
+
+def measure(mode, path):
+    output = subprocess.run([sys.executable, __file__, "--run", mode, path], check=True, capture_output=True,
+                            text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--run", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run(*args.run)))
+        return
+
+    print(f"{'posts':>9} {'mode':>7} {'cleaned':>8} {'peak MiB':>9} {'MiB/100k':>9} {'frame MiB':>10} {'ms':>7}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "snapshot.jsonl")
+            write_snapshot(path, size, args.seed)
+            results = {mode: measure(mode, path) for mode in ("before", "after")}
+        for mode, result in results.items():
+            print(f"{size:>9,} {mode:>7} {result['cleaned']:>8,} {result['peak_kib'] / 1024:>9.1f} "
+                  f"{result['peak_kib'] / 1024 * 100_000 / size:>9.1f} {result['frame_kib'] / 1024:>10.1f} "
+                  f"{result['duration_ms']:>7,}")
+        print(f"{'':>9} peak RSS {results['after']['peak_kib'] / max(results['before']['peak_kib'], 1):.0%} "
+              f"of before")
+
+
+if __name__ == "__main__":
+    main()
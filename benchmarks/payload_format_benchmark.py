@@ -0,0 +1,96 @@
+"""
+Size and serialization time of the cleaned posts payload: the JSON list returned by clean_data, the gzip NDJSON
+claim check, and the typed Parquet and Arrow IPC outputs with zstd.
+
+The sample is events/ingest-data.json, whose hashtags and music columns hold Python-repr strings; they are parsed
+back into lists and dicts to rebuild the typed frame clean_data produces with OUTPUT_FORMAT=parquet or arrow.
+Larger payloads repeat the sample with unique post IDs; the other columns repeat as they are, which flatters the
+dictionary encoding of the columnar formats, so treat the repeated sizes as a lower bound.
+
+Usage:
+    python benchmarks/payload_format_benchmark.py [--repeat 1 100] [--runs 20]
+"""
+import argparse
+import ast
+import gzip
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT / "src" / "clean_data"), str(ROOT / "src" / "layers" / "common")]
+
+import app as clean_data  # noqa: E402
+from common import claim_check  # noqa: E402
+
+SAMPLE = ROOT / "events" / "ingest-data.json"
+
+
+def load_sample(repeat):
+    sample = json.loads(SAMPLE.read_text())
+    records = [{**record, "post_id": f"{record['post_id']}{copy:04d}"} for copy in range(repeat) for record in sample]
+    json_df = pd.DataFrame(records)
+
+    typed_df = json_df.copy()
+    typed_df["hashtags"] = [ast.literal_eval(value) if value else [] for value in typed_df["hashtags"]]
+    typed_df["music"] = [ast.literal_eval(value) if value else {} for value in typed_df["music"]]
+    typed_df["search_terms"] = [[term] for term in typed_df["search_term"]]
+    return json_df, typed_df
+
+
+def timed(fn, runs):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+    return result, statistics.median(durations) * 1000
+
+
+def measure(json_df, typed_df, runs):
+    results = {}
+
+    body, write_ms = timed(lambda: json.dumps(json_df.to_dict(orient="records")).encode("utf-8"), runs)
+    _, read_ms = timed(lambda: json.loads(body), runs)
+    results["json list"] = (len(body), write_ms, read_ms)
+
+    body, write_ms = timed(
+        lambda: gzip.compress(json_df.to_json(orient="records", lines=True).encode("utf-8")), runs
+    )
+    _, read_ms = timed(lambda: [json.loads(line) for line in gzip.decompress(body).splitlines()], runs)
+    results["ndjson.gz"] = (len(body), write_ms, read_ms)
+
+    for payload_format in clean_data.COLUMNAR_FORMATS:
+        body, write_ms = timed(
+            lambda: claim_check.serialize_table(clean_data.to_arrow(typed_df), payload_format), runs
+        )
+        _, read_ms = timed(lambda: list(claim_check.iter_table_records(body, payload_format)), runs)
+        results[f"{payload_format} zstd"] = (len(body), write_ms, read_ms)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, nargs="+", default=[1, 100],
+                        help="Copies of the sample per measurement, to see how each format scales")
+    parser.add_argument("--runs", type=int, default=20, help="Runs per measurement, the median is kept")
+    args = parser.parse_args()
+
+    for repeat in args.repeat:
+        json_df, typed_df = load_sample(repeat)
+        results = measure(json_df, typed_df, args.runs)
+        baseline = results["json list"][0]
+
+        print(f"{len(json_df):,} records")
+        print(f"  {'format':<14} {'bytes':>11} {'vs json':>8} {'write ms':>9} {'read ms':>9}")
+        for name, (size, write_ms, read_ms) in results.items():
+            print(f"  {name:<14} {size:>11,} {size / baseline:>7.1%} {write_ms:>9.2f} {read_ms:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Posts/second of clean_data on several snapshots as the cleaning processes go from 1 to 6, the vCPUs of the largest
+Lambda memory sizes.
+
+The snapshots are synthetic JSON lines files written to a temporary directory, the download is left out. Every run
+partitions them, cleans the partitions in CLEAN_WORKERS processes and merges and deduplicates the result in the
+parent, like the handler does for an event with snapshot_ids. The speedup is bounded by the cores of the machine,
+printed on the first line.
+
+Usage:
+    python benchmarks/scaling_benchmark.py [--snapshots 6] [--posts 20000] [--workers 1 2 4 6] [--runs 3]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT / "src" / "clean_data"), str(ROOT / "src" / "layers" / "common")]
+# The cleaning stages are instrumented, their metric documents would be printed between the report lines
+os.environ.setdefault("METRICS_ENABLED", "false")
+
+import app as clean_data  # noqa: E402
+from memory_benchmark import make_record  # noqa: E402
+
+
+def write_snapshots(directory, snapshots, posts, seed):
+    rng = random.Random(seed)
+    paths = []
+    for snapshot in range(snapshots):
+        path = os.path.join(directory, f"{snapshot}.ndjson")
+        with open(path, "w") as file:
+            for _ in range(posts):
+                # Post IDs overlap across snapshots, like retried or sharded triggers
+                file.write(json.dumps(make_record(rng, rng.randint(0, snapshots * posts))) + "\n")
+        paths.append(path)
+    return paths
+
+
+def run(paths, workers):
+    start = time.perf_counter()
+    partitions = clean_data.get_partitions(paths, workers * 2)
+    results = clean_data.clean_partitions(partitions, workers=workers)
+    df = clean_data.merge_frames(result["df"] for result in results)
+    df, _ = clean_data.dedupe_posts(df)
+    return time.perf_counter() - start, len(partitions), len(df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--snapshots", type=int, default=6)
+    parser.add_argument("--posts", type=int, default=20_000, help="Posts per snapshot")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 6])
+    parser.add_argument("--runs", type=int, default=3, help="Runs per worker count, the median is kept")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"cores: {os.cpu_count()}, snapshots: {args.snapshots} x {args.posts:,} posts")
+    print(f"{'workers':>8} {'partitions':>11} {'seconds':>8} {'posts/s':>9} {'speedup':>8} {'efficiency':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_snapshots(directory, args.snapshots, args.posts, args.seed)
+        total = args.snapshots * args.posts
+        baseline = None
+        for workers in args.workers:
+            runs = [run(paths, workers) for _ in range(args.runs)]
+            duration = statistics.median(duration for duration, _, _ in runs)
+            partitions = runs[0][1]
+            # Relative to the first worker count, 1 by default
+            baseline = baseline or duration
+            speedup = baseline / duration
+            print(f"{workers:>8} {partitions:>11} {duration:>8.2f} {total / duration:>9,.0f} {speedup:>7.2f}x "
+                  f"{speedup * args.workers[0] / workers:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
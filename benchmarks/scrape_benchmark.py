@@ -0,0 +1,95 @@
+"""
+Pages/second and peak memory of the scrape_product_page extraction engines over a corpus of saved pages.
+
+Usage:
+    python benchmarks/scrape_benchmark.py path/to/saved/pages [--repeat 3]
+
+Every engine runs in its own process so the peak RSS of one does not hide the other.
+"""
+import argparse
+import json
+import re
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT / "src" / "scrape_product_page"), str(ROOT / "src" / "layers" / "common")]
+
+ENGINES = ["legacy", "bs4", "lxml"]
+
+
+def legacy_extract(content):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, 'html.parser')
+    body_content = soup.body.get_text(separator=' ', strip=True)
+    image_urls = [img['src'] for img in soup.find_all('img') if 'src' in img.attrs]
+    reviews = [sentence.strip() for text in soup.find_all(string=True)
+               for sentence in re.split('[?.!:]', text)
+               if any(word in sentence.lower() for word in ['great', 'good', 'excellent'])]
+    return body_content, image_urls, reviews
+
+
+def get_extractor(engine):
+    if engine == "legacy":
+        return legacy_extract
+
+    import app as scraper
+    if engine == "lxml":
+        if scraper.get_extractor() is not scraper.extract_with_lxml:
+            raise SystemExit("lxml is not installed")
+        return scraper.extract_with_lxml
+    return scraper.extract_with_bs4
+
+
+def run_engine(engine, corpus, repeat):
+    pages = [path.read_bytes() for path in sorted(Path(corpus).glob("*.htm*"))]
+    if not pages:
+        raise SystemExit(f"No .html pages found in {corpus}")
+
+    extract = get_extractor(engine)
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            extract(page)
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(json.dumps({
+        "engine": engine,
+        "pages": len(pages) * repeat,
+        "pages_per_second": len(pages) * repeat / elapsed,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mib": peak_rss / 1024,
+        "extraction_rss_mib": (peak_rss - baseline_rss) / 1024
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("corpus", help="Directory of saved product pages")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--engine", choices=ENGINES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.engine:
+        run_engine(args.engine, args.corpus, args.repeat)
+        return
+
+    print(f"{'engine':>8} {'pages/s':>10} {'peak RSS MiB':>13} {'extraction MiB':>15}")
+    for engine in ENGINES:
+        output = subprocess.run(
+            [sys.executable, __file__, args.corpus, "--repeat", str(args.repeat), "--engine", engine],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{engine:>8} {result['pages_per_second']:>10.1f} {result['peak_rss_mib']:>13.1f} "
+              f"{result['extraction_rss_mib']:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
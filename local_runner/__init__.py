@@ -0,0 +1,7 @@
+"""
+In-process runner for the collection state machine, for end-to-end throughput benchmarks without deploying.
+
+    python -m local_runner --executions 20 --concurrency 4 --mode collect
+
+See `python -m local_runner --help` for latency and error injection options.
+"""
@@ -0,0 +1,250 @@
+import argparse
+import io
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from local_runner import handlers
+from local_runner.asl import Interpreter
+from local_runner.metrics import Metrics, format_report
+from local_runner.stubs import SERVICES, ServiceConfig, StubServer
+
+
+class ClientError(Exception):
+    """
+    Error shaped like botocore's ClientError, with the error code under response
+    """
+
+    def __init__(self, code, message):
+        super().__init__(f"An error occurred ({code}): {message}")
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+
+class LocalStepFunctions:
+    """
+    Stand-in for the boto3 Step Functions client: starts executions on a bounded pool and resolves task tokens.
+    With start_rate, StartExecution is a token bucket of start_rate calls refilled at start_rate per second and
+    throttles like the service does when it is empty.
+    """
+
+    def __init__(self, interpreter, concurrency, start_rate=0):
+        self.interpreter = interpreter
+        interpreter.step_functions = self
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="execution")
+        self.futures = []
+        self.executions = {}
+        self.lock = threading.Lock()
+        self.start_rate = start_rate
+        self.start_tokens = start_rate
+        self.refilled_at = time.monotonic()
+        self.throttled = 0
+
+    def take_start_token(self):
+        now = time.monotonic()
+        self.start_tokens = min(self.start_rate, self.start_tokens + (now - self.refilled_at) * self.start_rate)
+        self.refilled_at = now
+        if self.start_tokens < 1:
+            self.throttled += 1
+            raise ClientError("ThrottlingException", "Rate exceeded")
+        self.start_tokens -= 1
+
+    def start_execution(self, stateMachineArn, input, name=None):
+        name = name or str(uuid.uuid4())
+        arn = f"{stateMachineArn.replace(':stateMachine:', ':execution:')}:{name}"
+        with self.lock:
+            if self.start_rate:
+                self.take_start_token()
+            if name in self.executions:
+                # Same name and input is the running execution, another input is an error
+                if self.executions[name]["input"] != input:
+                    raise ClientError("ExecutionAlreadyExists", f"Execution already exists: '{arn}'")
+                return self.executions[name]["response"]
+            response = {
+                "executionArn": arn,
+                "startDate": datetime.now(timezone.utc).isoformat(),
+                "ResponseMetadata": {"HTTPStatusCode": 200, "RequestId": str(uuid.uuid4())}
+            }
+            self.executions[name] = {"input": input, "response": response}
+            self.futures.append(self.pool.submit(self.interpreter.execute, json.loads(input), name))
+        return response
+
+    def send_task_success(self, taskToken, output):
+        return self.interpreter.send_task_success(taskToken, output)
+
+    def send_task_failure(self, taskToken, error="", cause=""):
+        return self.interpreter.send_task_failure(taskToken, error, cause)
+
+    def wait(self):
+        # Executions can start other executions, wait until no new one shows up
+        results = []
+        while True:
+            with self.lock:
+                futures = self.futures[len(results):]
+            if not futures:
+                return results
+            results.extend(future.result() for future in futures)
+
+
+class LocalS3:
+    """
+    In-memory stand-in for the boto3 S3 client, enough for the claim checks of the payload bucket
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        with self.lock:
+            self.objects[(Bucket, Key)] = bytes(Body)
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    def get_object(self, Bucket, Key):
+        with self.lock:
+            body = self.objects[(Bucket, Key)]
+        return {"Body": io.BytesIO(body), "ContentLength": len(body)}
+
+
+def parse_service_options(values, cast):
+    options = {}
+    for value in values or []:
+        service, _, setting = value.partition("=")
+        if service not in SERVICES:
+            raise argparse.ArgumentTypeError(f"Unknown service {service}, expected one of {', '.join(SERVICES)}")
+        options[service] = cast(setting)
+    return options
+
+
+def make_request_body(mode, index, terms, stub_url, fan_out=None, shared_terms=False):
+    if mode == "scrape":
+        body = {"url": f"{stub_url}/product/{index}"}
+    else:
+        prefix = "Vitamin D3" if shared_terms else f"Vitamin D3 {index}-"
+        body = {"search_terms": [f"{prefix}{term}" for term in range(terms)]}
+    if fan_out is not None:
+        body["fan_out"] = fan_out
+    return body
+
+
+def make_intake_batch(bodies):
+    # SQS records of EventBridge collection-request events, as the intake queue delivers them
+    return {"Records": [{
+        "messageId": str(uuid.uuid4()),
+        "body": json.dumps({"version": "0", "id": str(uuid.uuid4()), "detail-type": "collection-request",
+                            "source": "tapestry.collection_service", "detail": body}),
+        "attributes": {"ApproximateReceiveCount": "1"},
+        "eventSource": "aws:sqs"
+    } for body in bodies]}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m local_runner",
+                                     description="Run the collection state machine locally against stub services")
+    parser.add_argument("--definition", default=str(handlers.ROOT / "state_machine" / "workflow.asl.json"))
+    parser.add_argument("--executions", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4, help="Executions running at the same time")
+    parser.add_argument("--mode", choices=["collect", "scrape"], default="collect")
+    parser.add_argument("--terms", type=int, default=3, help="Search terms per collect request, features per scrape")
+    parser.add_argument("--records-per-term", type=int, default=100)
+    parser.add_argument("--snapshot-delay", type=float, default=1.0, help="Seconds before Brightdata notifies")
+    parser.add_argument("--latency", action="append", metavar="SERVICE=SECONDS",
+                        help=f"Added latency per request, services: {', '.join(SERVICES)}")
+    parser.add_argument("--error-rate", action="append", metavar="SERVICE=RATE", help="Fraction of failed requests")
+    parser.add_argument("--error-status", action="append", metavar="SERVICE=STATUS",
+                        help="Status of injected errors, 500 by default")
+    parser.add_argument("--fan-out", action="store_true", help="Collect through the Map state, one branch per shard")
+    parser.add_argument("--shard-size", type=int, default=1, help="Search terms per fan-out shard")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Fan-out branches running at the same time")
+    parser.add_argument("--coalesce-window", type=float, default=0,
+                        help="Seconds over which Brightdata triggers of concurrent executions are merged, 0 to disable")
+    parser.add_argument("--shared-terms", action="store_true",
+                        help="Send the same search terms in every collect request, as when products overlap")
+    parser.add_argument("--bulk", choices=["executions", "map"],
+                        help="Send every execution in one bulk /collect request, started by the API or by a Map state")
+    parser.add_argument("--intake", type=int, default=0, metavar="BATCH_SIZE",
+                        help="Send the collect requests as events through the intake queue, BATCH_SIZE per batch")
+    parser.add_argument("--start-rate", type=float, default=0,
+                        help="StartExecution calls per second before throttling, 0 for no limit")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Factor applied to Retry intervals")
+    parser.add_argument("--callback-timeout", type=float, default=300)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--emf-output", help="Write the EMF metric documents of the handlers to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    if args.intake and (args.mode != "collect" or args.bulk):
+        parser.error("--intake sends collect requests one event each, without --bulk")
+
+    latency = parse_service_options(args.latency, float)
+    error_rate = parse_service_options(args.error_rate, float)
+    error_status = parse_service_options(args.error_status, int)
+    configs = {service: ServiceConfig(latency=latency.get(service, 0.0), error_rate=error_rate.get(service, 0.0),
+                                      error_status=error_status.get(service, 500)) for service in SERVICES}
+
+    stub = StubServer(configs, records_per_term=args.records_per_term, snapshot_delay=args.snapshot_delay,
+                      features=args.terms).start()
+    if args.coalesce_window:
+        os.environ["COALESCE_WINDOW_SECONDS"] = str(args.coalesce_window)
+    handlers.configure_environment(stub.url)
+
+    with open(args.definition) as file:
+        definition = json.load(file)
+    metrics = Metrics()
+
+    # The handlers are loaded after the environment is set, they read it at import time
+    functions = {}
+    interpreter = Interpreter(definition, functions, metrics, time_scale=args.time_scale,
+                              callback_timeout=args.callback_timeout)
+    step_functions = LocalStepFunctions(interpreter, args.concurrency, args.start_rate)
+    state_functions, collection, notification, intake = handlers.load_functions(step_functions)
+    from common import claim_check, instrumentation
+    claim_check._s3_client = LocalS3()
+    functions.update(state_functions)
+    stub.notification_handler = notification
+    # Handlers set the root logger to INFO when they are imported
+    logging.getLogger().setLevel(args.log_level)
+
+    fan_out = None
+    if args.fan_out:
+        fan_out = {"enabled": True, "shard_size": args.shard_size, "max_concurrency": args.max_concurrency}
+
+    # Handler metrics are captured rather than printed between the report lines
+    with instrumentation.collect() as documents:
+        start = time.perf_counter()
+        bodies = [make_request_body(args.mode, index, args.terms, stub.url, fan_out, args.shared_terms)
+                  for index in range(args.executions)]
+        if args.bulk:
+            bodies = [{"items": bodies, "mode": args.bulk}]
+        for offset in range(0, len(bodies), args.intake) if args.intake else []:
+            response = intake(make_intake_batch(bodies[offset:offset + args.intake]))
+            if response["batchItemFailures"]:
+                raise SystemExit(f"Collection intake failed: {response}")
+        for body in bodies if not args.intake else []:
+            response = collection({"body": json.dumps(body)})
+            if response["statusCode"] != 200:
+                raise SystemExit(f"Collection API failed: {response['body']}")
+        step_functions.wait()
+        report = metrics.report(time.perf_counter() - start)
+    stub.stop()
+    report["brightdata_triggers"] = stub.triggers
+    report["throttled_starts"] = step_functions.throttled
+
+    if args.emf_output:
+        with open(args.emf_output, "w") as file:
+            file.writelines(json.dumps(document) + "\n" for document in documents)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+        print(f"brightdata triggers: {stub.triggers}")
+        if args.start_rate:
+            print(f"throttled starts: {step_functions.throttled}")
+
+
+if __name__ == "__main__":
+    main()
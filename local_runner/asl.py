@@ -0,0 +1,407 @@
+"""
+Interpreter for the subset of the Amazon States Language used by state_machine/workflow.asl.json.
+"""
+import copy
+import json
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+WAIT_FOR_TASK_TOKEN = "arn:aws:states:::lambda:invoke.waitForTaskToken"
+LAMBDA_INVOKE = "arn:aws:states:::lambda:invoke"
+START_EXECUTION = "arn:aws:states:::states:startExecution"
+
+PATH_PATTERN = re.compile(r"\.([^.\[]+)|\[(\d+)\]")
+
+
+class StatesError(Exception):
+    def __init__(self, error, cause=""):
+        super().__init__(f"{error}: {cause}")
+        self.error = error
+        self.cause = cause
+
+
+def get_path(data, path, context=None):
+    """
+    Resolve a reference path such as $.a.b[0] or $$.Task.Token
+    """
+    if path.startswith("$$"):
+        value, rest = context, path[2:]
+    elif path.startswith("$"):
+        value, rest = data, path[1:]
+    else:
+        raise StatesError("States.Runtime", f"Invalid path {path}")
+
+    for key, index in PATH_PATTERN.findall(rest):
+        try:
+            value = value[int(index)] if index else value[key]
+        except (KeyError, IndexError, TypeError):
+            raise StatesError("States.Runtime", f"Path {path} not found in the input")
+    return value
+
+
+def set_path(data, path, value):
+    """
+    Return a copy of data with value stored at a ResultPath
+    """
+    if path == "$":
+        return value
+    tokens = [key for key, _ in PATH_PATTERN.findall(path[1:])]
+    data = copy.deepcopy(data) if isinstance(data, dict) else {}
+    node = data
+    for key in tokens[:-1]:
+        if not isinstance(node.get(key), dict):
+            node[key] = {}
+        node = node[key]
+    node[tokens[-1]] = value
+    return data
+
+
+def resolve_parameters(template, data, context):
+    if isinstance(template, dict):
+        resolved = {}
+        for key, value in template.items():
+            if key.endswith(".$"):
+                if not value.startswith("$"):
+                    raise StatesError("States.Runtime", f"Intrinsic functions are not supported: {value}")
+                resolved[key[:-2]] = get_path(data, value, context)
+            else:
+                resolved[key] = resolve_parameters(value, data, context)
+        return resolved
+    if isinstance(template, list):
+        return [resolve_parameters(value, data, context) for value in template]
+    return template
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+COMPARATORS = {
+    "StringEquals": lambda a, b: isinstance(a, str) and a == b,
+    "BooleanEquals": lambda a, b: isinstance(a, bool) and a == b,
+    "NumericEquals": lambda a, b: is_number(a) and a == b,
+    "NumericLessThan": lambda a, b: is_number(a) and a < b,
+    "NumericLessThanEquals": lambda a, b: is_number(a) and a <= b,
+    "NumericGreaterThan": lambda a, b: is_number(a) and a > b,
+    "NumericGreaterThanEquals": lambda a, b: is_number(a) and a >= b,
+    "IsNull": lambda a, b: (a is None) == b,
+    "IsString": lambda a, b: isinstance(a, str) == b,
+    "IsBoolean": lambda a, b: isinstance(a, bool) == b,
+    "IsNumeric": lambda a, b: is_number(a) == b,
+}
+
+
+def evaluate_rule(rule, data, context):
+    if "And" in rule:
+        return all(evaluate_rule(item, data, context) for item in rule["And"])
+    if "Or" in rule:
+        return any(evaluate_rule(item, data, context) for item in rule["Or"])
+    if "Not" in rule:
+        return not evaluate_rule(rule["Not"], data, context)
+
+    variable = rule["Variable"]
+    if "IsPresent" in rule:
+        try:
+            get_path(data, variable, context)
+            present = True
+        except StatesError:
+            present = False
+        return present == rule["IsPresent"]
+
+    value = get_path(data, variable, context)
+    for operator, compare in COMPARATORS.items():
+        if operator in rule:
+            return compare(value, rule[operator])
+        if f"{operator}Path" in rule:
+            return compare(value, get_path(data, rule[f"{operator}Path"], context))
+    raise StatesError("States.Runtime", f"Unsupported choice rule: {json.dumps(rule)}")
+
+
+def matches(error_equals, error):
+    if "States.ALL" in error_equals:
+        return True
+    if "States.TaskFailed" in error_equals and error != "States.Timeout":
+        return True
+    return error in error_equals
+
+
+class TaskTokens:
+    """
+    Pending waitForTaskToken callbacks, resolved through send_task_success/send_task_failure
+    """
+
+    def __init__(self):
+        self.waiters = {}
+        self.lock = threading.Lock()
+
+    def register(self, token):
+        waiter = {"event": threading.Event(), "output": None, "error": None}
+        with self.lock:
+            self.waiters[token] = waiter
+        return waiter
+
+    def wait(self, token, timeout):
+        with self.lock:
+            waiter = self.waiters[token]
+        try:
+            if not waiter["event"].wait(timeout):
+                raise StatesError("States.Timeout", "Task token was not returned in time")
+            if waiter["error"] is not None:
+                raise StatesError(*waiter["error"])
+            return waiter["output"]
+        finally:
+            with self.lock:
+                self.waiters.pop(token, None)
+
+    def discard(self, token):
+        with self.lock:
+            self.waiters.pop(token, None)
+
+    def resolve(self, token, output=None, error=None):
+        with self.lock:
+            waiter = self.waiters.get(token)
+        if waiter is None:
+            raise KeyError(f"Task token does not exist or has timed out: {token}")
+        waiter["output"] = output
+        waiter["error"] = error
+        waiter["event"].set()
+
+
+class Interpreter:
+    """
+    Runs executions of a state machine definition against in-process Lambda handlers
+
+    Args:
+        definition: The parsed ASL definition
+        functions: Callables taking an event, keyed by the Resource or FunctionName used in the definition
+        metrics: A Metrics instance recording every state
+        time_scale: Factor applied to retry intervals, to run long backoffs quickly
+        callback_timeout: Longest a waitForTaskToken task waits for its callback, TimeoutSeconds when shorter
+    """
+
+    def __init__(self, definition, functions, metrics, time_scale=1.0, callback_timeout=300):
+        self.definition = definition
+        self.functions = functions
+        self.metrics = metrics
+        self.time_scale = time_scale
+        self.callback_timeout = callback_timeout
+        self.tokens = TaskTokens()
+        self.pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="lambda")
+        self.state_machine_arn = "arn:aws:states:us-east-2:000000000000:stateMachine:LocalCollectionStateMachine"
+        # Client starting the executions of states:startExecution tasks, set by the runner
+        self.step_functions = None
+
+    def execute(self, execution_input, name=None):
+        """
+        Run one execution to completion
+        Args:
+            execution_input: The execution input
+            name: The execution name
+
+        Returns:
+            result: A dict with the status, output, error, visited states and duration
+        """
+        name = name or str(uuid.uuid4())
+        context = {
+            "Execution": {
+                "Id": f"{self.state_machine_arn.replace(':stateMachine:', ':execution:')}:{name}",
+                "Name": name,
+                "Input": execution_input,
+                "StartTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            },
+            "StateMachine": {"Id": self.state_machine_arn}
+        }
+        path = []
+        start = time.perf_counter()
+        try:
+            output = self.run_states(self.definition, execution_input, context, path)
+            status, error = "SUCCEEDED", None
+        except StatesError as e:
+            output, status, error = None, "FAILED", {"Error": e.error, "Cause": e.cause}
+        duration = time.perf_counter() - start
+        self.metrics.record_execution(status, duration, path)
+        return {"name": name, "status": status, "output": output, "error": error, "path": path, "duration": duration}
+
+    def run_states(self, definition, data, context, path):
+        states = definition["States"]
+        name = definition["StartAt"]
+        while True:
+            state = states[name]
+            path.append(name)
+            context = {**context, "State": {"Name": name, "EnteredTime": time.time()}}
+            try:
+                data, next_name = self.run_state(name, state, data, context, path)
+            except StatesError as e:
+                catcher = next((catcher for catcher in state.get("Catch", [])
+                                if matches(catcher["ErrorEquals"], e.error)), None)
+                if catcher is None:
+                    raise
+                data = set_path(data, catcher.get("ResultPath", "$"), {"Error": e.error, "Cause": e.cause})
+                next_name = catcher["Next"]
+
+            if next_name is None:
+                return data
+            name = next_name
+
+    def run_state(self, name, state, data, context, path):
+        state_type = state["Type"]
+        if state_type == "Choice":
+            for rule in state["Choices"]:
+                if evaluate_rule(rule, data, context):
+                    return data, rule["Next"]
+            if "Default" not in state:
+                raise StatesError("States.NoChoiceMatched", f"No choice matched in {name}")
+            return data, state["Default"]
+        if state_type == "Pass":
+            effective_input = get_path(data, state.get("InputPath", "$"), context)
+            result = state.get("Result", effective_input)
+            if "Parameters" in state:
+                result = resolve_parameters(state["Parameters"], effective_input, context)
+            return self.apply_output(state, data, result, context), self.get_next(state)
+        if state_type == "Succeed":
+            return data, None
+        if state_type == "Fail":
+            raise StatesError(state.get("Error", "States.Fail"), state.get("Cause", ""))
+        if state_type == "Task":
+            effective_input = get_path(data, state.get("InputPath", "$"), context)
+            result = self.run_task(name, state, effective_input, context)
+            return self.apply_output(state, data, result, context), self.get_next(state)
+        if state_type == "Map":
+            effective_input = get_path(data, state.get("InputPath", "$"), context)
+            start = time.perf_counter()
+            try:
+                result = self.run_map(state, effective_input, context, path)
+            except StatesError as e:
+                self.metrics.record_state(name, time.perf_counter() - start, effective_input, None, error=e.error)
+                raise
+            self.metrics.record_state(name, time.perf_counter() - start, effective_input, result)
+            return self.apply_output(state, data, result, context), self.get_next(state)
+        raise StatesError("States.Runtime", f"Unsupported state type {state_type} in {name}")
+
+    def run_map(self, state, effective_input, context, path):
+        """
+        Run an inline Map: every item goes through the ItemProcessor, at most MaxConcurrency at a time
+        """
+        items = get_path(effective_input, state.get("ItemsPath", "$"), context)
+        if not isinstance(items, list):
+            raise StatesError("States.Runtime", f"Map items at {state.get('ItemsPath', '$')} are not a list")
+        if not items:
+            return []
+
+        concurrency = state.get("MaxConcurrency", 0)
+        if "MaxConcurrencyPath" in state:
+            concurrency = get_path(effective_input, state["MaxConcurrencyPath"], context)
+        processor = state.get("ItemProcessor") or state["Iterator"]
+        selector = state.get("ItemSelector") or state.get("Parameters")
+
+        def run_item(index, item):
+            item_context = {**context, "Map": {"Item": {"Index": index, "Value": item}}}
+            item_input = resolve_parameters(selector, effective_input, item_context) if selector else item
+            return self.run_states(processor, item_input, item_context, path)
+
+        # MaxConcurrency 0 means no limit
+        workers = min(concurrency or len(items), len(items))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="map") as executor:
+            futures = [executor.submit(run_item, index, item) for index, item in enumerate(items)]
+            return [future.result() for future in futures]
+
+    @staticmethod
+    def get_next(state):
+        return None if state.get("End") else state["Next"]
+
+    @staticmethod
+    def apply_output(state, data, result, context):
+        if "ResultSelector" in state:
+            result = resolve_parameters(state["ResultSelector"], result, context)
+        result_path = state.get("ResultPath", "$")
+        output = data if result_path is None else set_path(data, result_path, result)
+        return get_path(output, state.get("OutputPath", "$"), context)
+
+    def run_task(self, name, state, effective_input, context):
+        attempts = {}
+        while True:
+            start = time.perf_counter()
+            try:
+                result = self.invoke(state, effective_input, context)
+                self.metrics.record_state(name, time.perf_counter() - start, effective_input, result)
+                return result
+            except StatesError as e:
+                self.metrics.record_state(name, time.perf_counter() - start, effective_input, None, error=e.error)
+                retriers = state.get("Retry", [])
+                index = next((index for index, retrier in enumerate(retriers)
+                              if matches(retrier["ErrorEquals"], e.error)), None)
+                if index is None:
+                    raise
+                retrier = retriers[index]
+                attempt = attempts.get(index, 0)
+                if attempt >= retrier.get("MaxAttempts", 3):
+                    raise
+                attempts[index] = attempt + 1
+                self.metrics.record_retry(name)
+                delay = retrier.get("IntervalSeconds", 1) * retrier.get("BackoffRate", 2.0) ** attempt
+                time.sleep(delay * self.time_scale)
+
+    def invoke(self, state, effective_input, context):
+        resource = state["Resource"]
+        timeout = state.get("TimeoutSeconds")
+
+        if resource == WAIT_FOR_TASK_TOKEN:
+            token = str(uuid.uuid4())
+            context = {**context, "Task": {"Token": token}}
+            parameters = resolve_parameters(state.get("Parameters", {}), effective_input, context)
+            self.tokens.register(token)
+            try:
+                self.call(parameters["FunctionName"], parameters.get("Payload", {}), timeout)
+            except StatesError:
+                self.tokens.discard(token)
+                raise
+            # The deployed timeouts are hours, a local run gives up sooner
+            return self.tokens.wait(token, min(timeout or self.callback_timeout, self.callback_timeout))
+
+        payload = effective_input
+        if "Parameters" in state:
+            payload = resolve_parameters(state["Parameters"], effective_input, context)
+        if resource == LAMBDA_INVOKE:
+            return {"Payload": self.call(payload["FunctionName"], payload.get("Payload", {}), timeout),
+                    "StatusCode": 200}
+        if resource == START_EXECUTION:
+            return self.start_execution(payload)
+        return self.call(resource, payload, timeout)
+
+    def call(self, function, payload, timeout):
+        if function not in self.functions:
+            raise StatesError("States.Runtime", f"No local handler for {function}")
+        future = self.pool.submit(self.functions[function], payload)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise StatesError("States.Timeout", f"{function} did not finish within {timeout} second(s)")
+        except StatesError:
+            raise
+        except Exception as e:
+            raise StatesError(type(e).__name__, json.dumps({"errorMessage": str(e), "errorType": type(e).__name__}))
+
+    def start_execution(self, parameters):
+        execution_input = parameters.get("Input", {})
+        if not isinstance(execution_input, str):
+            execution_input = json.dumps(execution_input)
+        try:
+            response = self.step_functions.start_execution(stateMachineArn=parameters["StateMachineArn"],
+                                                           input=execution_input, name=parameters.get("Name"))
+        except Exception as e:
+            code = (getattr(e, "response", None) or {}).get("Error", {}).get("Code") or type(e).__name__
+            raise StatesError(f"StepFunctions.{code}", str(e))
+        return {"ExecutionArn": response["executionArn"], "StartDate": response["startDate"]}
+
+    # boto3 Step Functions client methods used by the notification Lambda
+    def send_task_success(self, taskToken, output):
+        self.tokens.resolve(taskToken, output=json.loads(output))
+        return {}
+
+    def send_task_failure(self, taskToken, error="", cause=""):
+        self.tokens.resolve(taskToken, error=(error, cause))
+        return {}
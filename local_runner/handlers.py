@@ -0,0 +1,113 @@
+"""
+Loads the src/*/app.py handlers in-process and wires them to the local stubs and state machine.
+"""
+import importlib.util
+import json
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Definition substitution -> (source directory, Lambda timeout in seconds) as configured in template.yml
+FUNCTIONS = {
+    "${ScrapeProductPageFunctionArn}": ("scrape_product_page", 90),
+    "${SummarizeProductDetailsFunctionArn}": ("summarize_product_details", 90),
+    "${ExtractKeywordsFunctionArn}": ("extract_keywords", 90),
+    "${BrightdataCallbackFunctionArn}": ("brightdata_callback", 30),
+    "${CleanDataFunctionArn}": ("clean_data", 90),
+    "${IngestDataFunctionArn}": ("ingest_data", 90),
+    "${NotifySlackFunctionArn}": ("notify_slack", 60),
+}
+
+
+def configure_environment(stub_url):
+    """
+    Point the handlers at the stub server. Variables already set in the environment win, so modes like
+    STREAMING_MODE or CLAIM_CHECK_MODE can be benchmarked by exporting them before the run.
+    """
+    defaults = {
+        "AWS_DEFAULT_REGION": "us-east-2",
+        "API_KEY": "local",
+        "BEARER_TOKEN": "local",
+        "BRIGHTDATA_API_URL": f"{stub_url}/brightdata/datasets/v3",
+        "NOTIFICATION_URL": f"{stub_url}/notification",
+        "OPENAI_BASE_URL": f"{stub_url}/openai/v1",
+        "API_BASE_URL": stub_url,
+        "SLACK_WEBHOOK_URL": f"{stub_url}/slack",
+        # Clean and ingest share the process here, so in-memory stores are seen by both
+        "SEEN_POSTS_BACKEND": "memory",
+        "WATERMARK_BACKEND": "memory",
+        "COALESCE_BACKEND": "memory",
+        "SNAPSHOT_CACHE_BACKEND": "memory",
+        # Claim checks go to the in-memory S3 stand-in of the runner. As deployed, the watermarks are advanced by
+        # ingest_data from the claim check, clean_data does not apply them to a list of posts.
+        "CLAIM_CHECK_MODE": "true",
+        "PAYLOAD_BUCKET": "local-payloads",
+        "STATE_MACHINE_ARN": "arn:aws:states:us-east-2:000000000000:stateMachine:LocalCollectionStateMachine",
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+    common_layer = str(ROOT / "src" / "layers" / "common")
+    if common_layer not in sys.path:
+        sys.path.insert(0, common_layer)
+
+
+def load_app(name):
+    spec = importlib.util.spec_from_file_location(f"{name}_app", ROOT / "src" / name / "app.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class LambdaContext:
+    def __init__(self, function_name, timeout):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self.invoked_function_arn = f"arn:aws:lambda:us-east-2:000000000000:function:{function_name}"
+        self.deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(int((self.deadline - time.monotonic()) * 1000), 0)
+
+
+class LocalFunction:
+    """
+    A handler invoked like Lambda does: the event and the result go through JSON
+    """
+
+    def __init__(self, name, timeout, module):
+        self.name = name
+        self.timeout = timeout
+        self.module = module
+
+    def __call__(self, event):
+        event = json.loads(json.dumps(event))
+        result = self.module.lambda_handler(event, LambdaContext(self.name, self.timeout))
+        return json.loads(json.dumps(result))
+
+
+def load_functions(step_functions_client):
+    """
+    Load every handler of the state machine plus the collection and notification APIs and the collection intake
+    Args:
+        step_functions_client: Stand-in for the boto3 Step Functions client of the API Lambdas
+
+    Returns:
+        functions: LocalFunction per definition substitution, and the collection, notification and intake functions
+    """
+    functions = {key: LocalFunction(name, timeout, load_app(name)) for key, (name, timeout) in FUNCTIONS.items()}
+
+    collection = load_app("collection")
+    collection.client = step_functions_client
+    notification = load_app("notification")
+    notification.sfn_client = step_functions_client
+    intake = load_app("collection_intake")
+    intake.client = step_functions_client
+    functions["${BrightdataCallbackFunctionArn}"].module.sfn_client = step_functions_client
+
+    return (functions, LocalFunction("collection", 60, collection), LocalFunction("notification", 90, notification),
+            LocalFunction("collection_intake", 60, intake))
@@ -0,0 +1,100 @@
+import json
+import statistics
+import threading
+from collections import Counter, defaultdict
+
+
+def payload_size(payload):
+    if payload is None:
+        return 0
+    return len(json.dumps(payload, default=str).encode("utf-8"))
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Metrics:
+    """
+    Per-state latency, retries and payload sizes, plus execution outcomes, collected across threads
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = defaultdict(lambda: {"durations": [], "errors": 0, "retries": 0,
+                                           "input_bytes": [], "output_bytes": []})
+        self.executions = []
+
+    def record_state(self, name, duration, payload, result, error=None):
+        input_bytes, output_bytes = payload_size(payload), payload_size(result)
+        with self.lock:
+            state = self.states[name]
+            state["durations"].append(duration)
+            state["input_bytes"].append(input_bytes)
+            if error is None:
+                state["output_bytes"].append(output_bytes)
+            else:
+                state["errors"] += 1
+
+    def record_retry(self, name):
+        with self.lock:
+            self.states[name]["retries"] += 1
+
+    def record_execution(self, status, duration, path):
+        # A workflow that reached Notify Failure ends successfully as far as Step Functions is concerned
+        outcome = "failed" if status != "SUCCEEDED" or "Notify Failure" in path else "succeeded"
+        with self.lock:
+            self.executions.append({"status": status, "outcome": outcome, "duration": duration,
+                                    "final_state": path[-1] if path else None})
+
+    def report(self, elapsed):
+        with self.lock:
+            durations = [execution["duration"] for execution in self.executions]
+            succeeded = sum(execution["outcome"] == "succeeded" for execution in self.executions)
+            states = {}
+            for name, state in self.states.items():
+                states[name] = {
+                    "calls": len(state["durations"]),
+                    "errors": state["errors"],
+                    "retries": state["retries"],
+                    "p50_ms": round(percentile(state["durations"], 0.5) * 1000, 1),
+                    "p95_ms": round(percentile(state["durations"], 0.95) * 1000, 1),
+                    "avg_input_bytes": round(statistics.mean(state["input_bytes"])) if state["input_bytes"] else 0,
+                    "max_input_bytes": max(state["input_bytes"], default=0),
+                    "avg_output_bytes": round(statistics.mean(state["output_bytes"])) if state["output_bytes"] else 0,
+                    "max_output_bytes": max(state["output_bytes"], default=0),
+                }
+            return {
+                "executions": len(self.executions),
+                "succeeded": succeeded,
+                "failed": len(self.executions) - succeeded,
+                "elapsed_seconds": round(elapsed, 3),
+                "executions_per_minute": round(len(self.executions) / elapsed * 60, 2) if elapsed else 0.0,
+                "execution_p50_ms": round(percentile(durations, 0.5) * 1000, 1),
+                "execution_p95_ms": round(percentile(durations, 0.95) * 1000, 1),
+                # The last state each execution ran, Notify Failure for a workflow that failed gracefully
+                "final_states": dict(Counter(execution["final_state"] for execution in self.executions)),
+                "states": states
+            }
+
+
+def format_report(report):
+    lines = [
+        f"executions: {report['executions']} ({report['succeeded']} succeeded, {report['failed']} failed) "
+        f"in {report['elapsed_seconds']}s -> {report['executions_per_minute']} executions/minute",
+        f"execution latency: p50 {report['execution_p50_ms']} ms, p95 {report['execution_p95_ms']} ms",
+        "final states: " + ", ".join(f"{name} {count}" for name, count in report["final_states"].items()),
+        "",
+        f"{'state':<28} {'calls':>6} {'errors':>7} {'retries':>8} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'avg in KiB':>11} {'max in KiB':>11} {'avg out KiB':>12}",
+    ]
+    for name, state in report["states"].items():
+        lines.append(
+            f"{name:<28} {state['calls']:>6} {state['errors']:>7} {state['retries']:>8} {state['p50_ms']:>9} "
+            f"{state['p95_ms']:>9} {state['avg_input_bytes'] / 1024:>11.1f} {state['max_input_bytes'] / 1024:>11.1f} "
+            f"{state['avg_output_bytes'] / 1024:>12.1f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,247 @@
+"""
+One local HTTP server standing in for Brightdata, OpenAI, the ingestion API, Slack and product pages.
+
+Every service has its own latency and error injection settings.
+"""
+import gzip
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+SERVICES = ("brightdata", "openai", "ingest", "slack", "product")
+
+REGIONS = ["US", "US", "US", "CA", "GB", "IN"]
+
+
+@dataclass
+class ServiceConfig:
+    latency: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+
+
+class StubServer:
+    """
+    Args:
+        configs: ServiceConfig per service name
+        records_per_term: Posts returned per search term by a snapshot
+        snapshot_delay: Seconds between a Brightdata trigger and its notification
+        features: Features returned by the keyword completion
+        seed: Seed of the synthetic data and of the error injection
+    """
+
+    def __init__(self, configs=None, records_per_term=100, snapshot_delay=1.0, features=3, seed=7):
+        self.configs = {service: ServiceConfig() for service in SERVICES}
+        self.configs.update(configs or {})
+        self.records_per_term = records_per_term
+        self.snapshot_delay = snapshot_delay
+        self.features = features
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.snapshots = {}
+        self.notification_handler = None
+        self.counters = {service: 0 for service in SERVICES}
+        self.triggers = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def should_fail(self, service):
+        with self.random_lock:
+            self.counters[service] += 1
+            return self.random.random() < self.configs[service].error_rate
+
+    def make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes, Nagle would hold the body on keep-alive connections
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                stub.route(self, "GET")
+
+            def do_POST(self):
+                stub.route(self, "POST")
+
+        return Handler
+
+    def route(self, request, method):
+        parsed = urllib.parse.urlsplit(request.path)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        body = request.rfile.read(int(request.headers.get("Content-Length", 0) or 0))
+        if request.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+
+        routes = [
+            ("POST", "/brightdata/datasets/v3/trigger", "brightdata", self.trigger),
+            ("GET", "/brightdata/datasets/v3/snapshot/", "brightdata", self.snapshot),
+            ("POST", "/openai/v1/chat/completions", "openai", self.completion),
+            ("POST", "/ingest/videos", "ingest", self.ingest),
+            ("POST", "/slack", "slack", self.slack),
+            ("GET", "/product/", "product", self.product),
+            ("POST", "/notification", None, self.notification),
+        ]
+        for route_method, prefix, service, handler in routes:
+            if method == route_method and parsed.path.startswith(prefix):
+                break
+        else:
+            return self.respond(request, 404, {"error": f"No stub for {method} {parsed.path}"})
+
+        if service is not None:
+            config = self.configs[service]
+            if config.latency:
+                time.sleep(config.latency)
+            if self.should_fail(service):
+                headers = {"retry-after-ms": "100"} if config.error_status == 429 else {}
+                error = {"error": {"message": f"Injected {service} error", "type": "stub_error"}}
+                return self.respond(request, config.error_status, error, headers)
+
+        status, payload, headers = handler(parsed.path, query, body)
+        self.respond(request, status, payload, headers)
+
+    @staticmethod
+    def respond(request, status, payload, headers=None):
+        if isinstance(payload, (bytes, str)):
+            data = payload.encode("utf-8") if isinstance(payload, str) else payload
+            content_type = "text/html; charset=utf-8"
+        else:
+            data = json.dumps(payload).encode("utf-8")
+            content_type = "application/json"
+        headers = {"Content-Type": content_type, **(headers or {})}
+
+        request.send_response(status)
+        for key, value in headers.items():
+            request.send_header(key, value)
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def trigger(self, path, query, body):
+        terms = [item.get("search_keyword", "") for item in json.loads(body or b"[]")]
+        snapshot_id = f"s_{uuid.uuid4().hex[:17]}"
+        with self.random_lock:
+            self.snapshots[snapshot_id] = terms
+            self.triggers += 1
+
+        notify_url = query.get("notify")
+        if notify_url:
+            timer = threading.Timer(self.snapshot_delay, self.notify, args=(notify_url, snapshot_id))
+            timer.daemon = True
+            timer.start()
+        return 200, {"snapshot_id": snapshot_id}, {}
+
+    @staticmethod
+    def notify(notify_url, snapshot_id):
+        requests.post(notify_url, json={"snapshot_id": snapshot_id, "status": "ready"}, timeout=30)
+
+    def snapshot(self, path, query, body):
+        snapshot_id = path.rsplit("/", 1)[-1]
+        if snapshot_id not in self.snapshots:
+            return 404, {"error": f"Snapshot {snapshot_id} not found"}, {}
+        records = self.make_records(snapshot_id, self.snapshots[snapshot_id])
+        if query.get("format") in ("ndjson", "jsonl"):
+            return 200, "\n".join(json.dumps(record) for record in records), {"Content-Type": "application/x-ndjson"}
+        return 200, records, {}
+
+    def make_records(self, snapshot_id, terms):
+        rng = random.Random(snapshot_id)
+        now = datetime.now(timezone.utc)
+        records = []
+        for term in terms:
+            for _ in range(self.records_per_term):
+                post_id = str(rng.randint(7_000_000_000_000_000_000, 7_999_999_999_999_999_999))
+                handle = f"creator{rng.randint(1, 5000)}"
+                records.append({
+                    "url": f"https://www.tiktok.com/@{handle}/video/{post_id}",
+                    "post_id": post_id,
+                    "description": f"{term} review #fyp",
+                    "create_time": (now - timedelta(days=rng.randint(0, 540))).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                    "region": rng.choice(REGIONS),
+                    "commerce_info": None,
+                    "profile_id": str(rng.randint(1, 10 ** 18)),
+                    "profile_url": f"https://www.tiktok.com/@{handle}",
+                    "preview_image": f"https://p16-sign.tiktokcdn-us.com/obj/{post_id}?x-expires=1744225200",
+                    "digg_count": rng.randint(0, 50_000),
+                    "share_count": rng.randint(0, 5_000),
+                    "collect_count": rng.randint(0, 5_000),
+                    "comment_count": rng.randint(0, 2_000),
+                    "profile_followers": rng.randint(0, 3_000_000),
+                    "video_duration": rng.randint(5, 180),
+                    "hashtags": ["fyp", term.split()[0].lower()],
+                    "music": {"id": str(rng.randint(1, 10 ** 18)), "title": "original sound", "original": True,
+                              "authorname": handle, "playurl": f"https://v77.tiktokcdn.com/{post_id}/audio"},
+                    "play_count": rng.randint(0, 200_000),
+                    "profile_biography": rng.choice(["", "Wellness\ncoach", None]),
+                    "discovery_input": {"search_keyword": term},
+                })
+        return records
+
+    def completion(self, path, query, body):
+        request = json.loads(body)
+        prompt = request["messages"][-1]["content"]
+        if "'descriptor'" in prompt:
+            content = json.dumps({"descriptor": "Vitamin D3",
+                                  "features": [f"Feature {index + 1}" for index in range(self.features)]})
+        else:
+            content = "A daily supplement for adults looking to support bone and immune health."
+        return 200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": "stop", "logprobs": None}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(prompt) + len(content)) // 4},
+        }, {}
+
+    def ingest(self, path, query, body):
+        posts = json.loads(body or b"[]")
+        return 200, {"message": "Records sent for ingestion", "request_id": str(uuid.uuid4()),
+                     "status": "success", "records": len(posts)}, {}
+
+    def slack(self, path, query, body):
+        return 200, "ok", {}
+
+    def product(self, path, query, body):
+        paragraphs = "".join(f"<p>Vitamin D3 with K2 supports bone health, paragraph {index}.</p>" for index in range(50))
+        page = (
+            "<html><head><title>Vitamin D3 10000 IU</title><script>var tracking = 1;</script></head><body>"
+            "<nav>Home Orders Cart</nav><h1>Vitamin D3 10000 IU Plus K2</h1>"
+            f"{paragraphs}<img src='https://example.com/front.jpg'><img src='https://example.com/back.jpg'>"
+            "<div class='review'>Great product! The softgels are small. Excellent value for money.</div>"
+            "<footer>Conditions of Use Privacy Notice</footer></body></html>"
+        )
+        return 200, page, {}
+
+    def notification(self, path, query, body):
+        if self.notification_handler is None:
+            return 500, {"error": "No notification handler registered"}, {}
+        event = {"queryStringParameters": query, "body": body.decode("utf-8")}
+        response = self.notification_handler(event)
+        return response.get("statusCode", 200), response.get("body", {}), {}
@@ -1,9 +1,11 @@
 import json
 import logging
 import os
+import time
 import urllib.parse
 
 import requests
+from common import coalescing, http_client, instrumentation, snapshot_cache
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -11,12 +13,20 @@ logger.setLevel(logging.INFO)
 BEARER_TOKEN = os.getenv("BEARER_TOKEN", "")
 NOTIFICATION_URL = os.getenv("NOTIFICATION_URL", "")
 LIMIT_RECORDS = int(os.getenv("LIMIT_RECORDS", 10))
+BRIGHTDATA_API_URL = os.getenv("BRIGHTDATA_API_URL", "https://api.brightdata.com/datasets/v3")
+# Time kept for the trigger after a leader waited out its window
+TRIGGER_MARGIN_SECONDS = 10
 
+# Created on first use, only a coalescing leader whose trigger failed needs it
+sfn_client = None
 
-def trigger_api_request(task_token, payload):
-    safe_token = urllib.parse.quote_plus(task_token)
 
-    brightdata_url = "https://api.brightdata.com/datasets/v3/trigger"
+@instrumentation.timed()
+def trigger_api_request(task_token, payload, batch_id=None):
+    # A coalesced trigger is notified for its batch, the notification Lambda resolves the waiting task tokens
+    notify_params = {"batchId": batch_id} if batch_id else {"taskToken": task_token}
+
+    brightdata_url = f"{BRIGHTDATA_API_URL}/trigger"
 
     querystring = {
         "dataset_id": "gd_lu702nij2f790tmv9h",
@@ -24,7 +34,7 @@ def trigger_api_request(task_token, payload):
         "discover_by": "keyword",
         "include_errors": "true",
         "limit_per_input": f"{LIMIT_RECORDS}",
-        "notify": f"{NOTIFICATION_URL}?taskToken={safe_token}"
+        "notify": f"{NOTIFICATION_URL}?{urllib.parse.urlencode(notify_params)}"
     }
 
     headers = {
@@ -33,7 +43,7 @@ def trigger_api_request(task_token, payload):
     }
 
     try:
-        response = requests.request("POST", brightdata_url, json=payload, headers=headers, params=querystring)
+        response = http_client.request("POST", brightdata_url, json=payload, headers=headers, params=querystring)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -59,14 +69,152 @@ def get_payload(event_input: dict):
     return [dict(search_keyword=term) for term in search_terms]
 
 
+def plan_shards(event_input: dict, shard_size: int):
+    terms = [item["search_keyword"] for item in get_payload(event_input)]
+    # A repeated term would trigger the same search in two shards
+    terms = list(dict.fromkeys(terms))
+    return [{"search_terms": terms[start:start + shard_size]} for start in range(0, len(terms), shard_size)]
+
+
+# Function to look up the search terms in the snapshot cache, the trigger is only skipped when every term is fresh
+def check_cache(event_input):
+    terms = list(dict.fromkeys(item["search_keyword"] for item in get_payload(event_input)))
+    results = snapshot_cache.get_results(terms)
+    hit = bool(terms) and len(results) == len(terms)
+    logger.info(f"Snapshot cache: {len(results)} of {len(terms)} search term(s) fresh")
+    instrumentation.record("snapshot_cache", Records=len(results))
+    return {
+        "hit": hit,
+        "terms": len(terms),
+        "cached_terms": len(results),
+        "results": [results[term] for term in terms] if hit else []
+    }
+
+
+# Function to fail the task tokens of a batch whose trigger failed, they would otherwise wait for a notification
+def fail_waiters(waiters, error):
+    global sfn_client
+    if sfn_client is None:
+        import boto3
+        sfn_client = boto3.client("stepfunctions")
+
+    for waiter in waiters:
+        try:
+            sfn_client.send_task_failure(taskToken=waiter["task_token"], error="BrightdataTriggerFailed",
+                                         cause=str(error)[:32768])
+        except Exception as e:
+            logger.error(f"Failed to fail a coalesced task token: {str(e)}")
+
+
+# Function to trigger for the waiters of a closed batch, the ones in notify_on_failure are failed if the trigger fails
+def trigger_batch(batch_id, waiters, notify_on_failure):
+    terms = coalescing.merge_terms(waiters)
+    try:
+        response = trigger_api_request(None, [dict(search_keyword=term) for term in terms], batch_id=batch_id)
+    except Exception as e:
+        fail_waiters(notify_on_failure, e)
+        raise e
+    instrumentation.record("coalesce_batch", Records=len(waiters))
+    return terms, response
+
+
+# Function to close and trigger the open batches of earlier windows whose leader never did, however old they are
+def take_over(store, group, current_batch_id):
+    for batch_id in store.list_open(group):
+        if batch_id == current_batch_id:
+            continue
+        batch = store.get(batch_id)
+        if batch is None:
+            # Expired while listed, closing it only drops it from the open batches
+            store.close(batch_id)
+            continue
+        if not coalescing.is_abandoned(batch):
+            continue
+        waiters = store.close(batch_id)
+        if waiters is None:
+            # Closed by its leader or by another execution in the meantime
+            continue
+        logger.warning(f"Taking over batch {batch_id}, its leader never triggered it for {len(waiters)} execution(s)")
+        try:
+            trigger_batch(batch_id, waiters, waiters)
+        except Exception as e:
+            # The waiters were failed, this execution goes on with its own trigger
+            logger.error(f"Failed to trigger abandoned batch {batch_id}: {str(e)}")
+
+
+# Function to join the coalescing window, the first execution in a window triggers for the whole batch
+def coalesce_trigger(task_token, payload, context):
+    store = coalescing.get_store()
+    window, closes_at = coalescing.get_window()
+    # Triggers only share a snapshot when they ask for the same number of records per term
+    group = f"limit{LIMIT_RECORDS}"
+    batch_id = coalescing.get_batch_id(group, window)
+    search_terms = [item["search_keyword"] for item in payload]
+
+    take_over(store, group, batch_id)
+    position = store.join(batch_id, {"task_token": task_token, "search_terms": search_terms},
+                          ttl=coalescing.COALESCE_TTL_SECONDS, closes_at=closes_at)
+    if position is None:
+        logger.info(f"Batch {batch_id} is closed or full, triggering alone")
+        return None
+    if position > 1:
+        logger.info(f"Joined batch {batch_id} at position {position}")
+        return {"batch_id": batch_id, "position": position}
+
+    wait = closes_at - time.time()
+    if context is not None:
+        wait = min(wait, context.get_remaining_time_in_millis() / 1000 - TRIGGER_MARGIN_SECONDS)
+    time.sleep(max(wait, 0))
+
+    waiters = store.close(batch_id)
+    if waiters is None:
+        # Another execution took the batch over and its trigger notifies this task token too. A batch that expired
+        # notifies nobody, the state times out and its retry joins a new batch.
+        logger.warning(f"Batch {batch_id} was taken over or expired before its leader closed it")
+        return {"batch_id": batch_id, "position": position, "taken_over": True}
+    requested = sum(len(waiter["search_terms"]) for waiter in waiters)
+    # The leader fails on its own by raising
+    terms, response = trigger_batch(batch_id, waiters, waiters[1:])
+
+    logger.info(f"Triggered batch {batch_id}: {len(waiters)} execution(s), "
+                f"{len(terms)} search term(s) out of {requested} requested")
+    return {"batch_id": batch_id, "position": position, "waiters": len(waiters), "search_terms": terms,
+            "brightdata_response": response}
+
+
+@instrumentation.handler
 def lambda_handler(event, context):
-    logger.info("Event received: %s", json.dumps(event))
+    instrumentation.log_event(event)
 
     event_input = event.get("input", {})
     task_token = event.get("taskToken", "")
 
+    if event.get("action") == "check_cache":
+        return check_cache(event_input)
+
+    if event.get("action") == "plan_shards":
+        shard_size = int(event.get("shard_size", 1))
+        if shard_size < 1:
+            raise ValueError("shard_size must be a positive integer")
+        shards = plan_shards(event_input, shard_size)
+        logger.info(f"Planned {len(shards)} shard(s) of up to {shard_size} search term(s)")
+        return {
+            "shards": shards,
+            "count": len(shards)
+        }
+
     try:
         payload = get_payload(event_input)
+        if coalescing.is_enabled():
+            batch = coalesce_trigger(task_token, payload, context)
+            if batch is not None:
+                logger.info(f"Coalesced trigger: {json.dumps(batch)}")
+                return {
+                    "payload": payload,
+                    "batch": batch,
+                    "message": "Joined a coalesced Brightdata trigger"
+                }
+
         response = trigger_api_request(task_token, payload)
         success_message = "Called brightdata API successfully"
 
@@ -1,15 +1,62 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
 import json
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
-from typing import List, Optional
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from common import claim_check, http_client, ingestion, instrumentation, seen_posts, snapshot_cache, watermarks
+from common.lazy import lazy_import
 
-import pandas as pd
-import requests
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
+else:
+    # pandas alone adds hundreds of milliseconds to a cold start, validation failures should not pay for it
+    pd = lazy_import("pandas")
+    pa = lazy_import("pyarrow")
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 BEARER_TOKEN = os.getenv("BEARER_TOKEN", "")
+BRIGHTDATA_API_URL = os.getenv("BRIGHTDATA_API_URL", "https://api.brightdata.com/datasets/v3")
+STREAMING_MODE = os.getenv("STREAMING_MODE", "false").lower() == "true"
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 500))
+CLAIM_CHECK_MODE = os.getenv("CLAIM_CHECK_MODE", "false").lower() == "true"
+# 'json' keeps the original records, 'parquet' and 'arrow' store typed columns behind a claim check
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "json").lower()
+COLUMNAR_FORMATS = (claim_check.PARQUET, claim_check.ARROW_IPC)
+if OUTPUT_FORMAT in COLUMNAR_FORMATS and not claim_check.is_columnar_available():
+    logger.warning(f"OUTPUT_FORMAT {OUTPUT_FORMAT} needs pyarrow, which is not installed, writing json instead")
+    OUTPUT_FORMAT = "json"
+# 'skip' drops posts ingested by a previous run, 'mark' keeps them with previously_ingested set
+SEEN_POSTS_MODE = os.getenv("SEEN_POSTS_MODE", "skip").lower()
+# Backfill ignores the per-term watermarks and goes back to filters["create_time"]
+BACKFILL_MODE = os.getenv("BACKFILL_MODE", "false").lower() == "true"
+# Posts can show up in search results a while after they were created, or gain the plays the filters ask for, so
+# this window behind each watermark is read again
+WATERMARK_LOOKBACK_HOURS = float(os.getenv("WATERMARK_LOOKBACK_HOURS", 24))
+# Fused mode streams the cleaned posts straight to the ingestion API, the Ingest Data step is skipped
+FUSED_MODE = os.getenv("FUSED_MODE", "false").lower() == "true"
+# Several snapshots are downloaded to DOWNLOAD_DIR by DOWNLOAD_WORKERS threads and cleaned by up to CLEAN_WORKERS
+# processes, as many as the memory of the function holds at CLEAN_WORKER_MEMORY_MB each next to the parent
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 4))
+CLEAN_WORKERS = int(os.getenv("CLEAN_WORKERS", 1))
+CLEAN_WORKER_MEMORY_MB = int(os.getenv("CLEAN_WORKER_MEMORY_MB", 1024))
+DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", tempfile.gettempdir())
+# Smaller partitions cost more in process starts and result transfers than they save in balance
+PARTITION_MIN_BYTES = int(os.getenv("PARTITION_MIN_BYTES", 4 * 1024 * 1024))
 
 filters = {
     "region": ["US", "CA"],
@@ -44,6 +91,19 @@ object_columns = [
     'music',
 ]
 
+# Levels are binned on the bin edges, `right` tells whether an edge belongs to the lower label
+play_levels = {
+    "bins": [10_000, 50_000],
+    "labels": ["low", "medium", "high"],
+    "right": False
+}
+
+influencer_types = {
+    "bins": [10_000, 100_000, 1_000_000],
+    "labels": ["nano", "micro", "major", "celebrity"],
+    "right": True
+}
+
 new_columns = [
     'play_count',
     'plays',
@@ -53,7 +113,23 @@ new_columns = [
     'product_promo'
 ]
 
+# Raw fields read by the cleaning stages, the rest of a Brightdata record is dropped when the record is parsed
+raw_columns = string_columns + numeric_columns + array_columns + object_columns + [
+    'play_count',
+    'profile_biography',
+    'discovery_input'
+]
+
+# Low-cardinality columns, stored once per distinct value
+category_columns = [
+    'region',
+    'plays',
+    'influencer_type',
+    'search_term'
+]
+
 
+@instrumentation.timed()
 def restructure(df: pd.DataFrame) -> pd.DataFrame:
     """
     Restructure the dataframe
@@ -66,17 +142,36 @@ def restructure(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty:
         return df
 
-    df[string_columns] = df[string_columns].astype('string')
-    df[numeric_columns] = df[numeric_columns].apply(pd.to_numeric, errors='coerce').fillna(0).astype(int)
+    text_columns = [col for col in string_columns if col not in category_columns]
+    df[text_columns] = df[text_columns].astype('string')
+    df['region'] = df['region'].astype('category')
+    df[numeric_columns] = df[numeric_columns].apply(to_integers)
     df = add_new_columns(df)
-    # TODO: Remove these two line once we figure out automated pertinent video selection
-    df = restructure_records(df, array_columns, replace_with=list)
-    df = restructure_records(df, object_columns, replace_with=dict)
+    if OUTPUT_FORMAT in COLUMNAR_FORMATS:
+        df = type_records(df, array_columns, replace_with=list)
+        df = type_records(df, object_columns, replace_with=dict)
+    else:
+        # TODO: Remove these two line once we figure out automated pertinent video selection
+        df = restructure_records(df, array_columns, replace_with=list)
+        df = restructure_records(df, object_columns, replace_with=dict)
 
     df = df[string_columns + numeric_columns + array_columns + object_columns + new_columns]
     return df
 
 
+def to_integers(values: pd.Series) -> pd.Series:
+    """
+    Parse counts into the smallest integer type holding them
+    Args:
+        values: A Pandas series of numbers or numeric strings
+
+    Returns:
+        values: A Pandas series of integers, 0 where the value was missing or malformed
+    """
+    values = pd.to_numeric(values, errors='coerce').fillna(0).astype('int64')
+    return pd.to_numeric(values, downcast='integer')
+
+
 def restructure_records(df: pd.DataFrame, cols: List[str], replace_with) -> pd.DataFrame:
     replacement = replace_with()
 
@@ -92,84 +187,79 @@ def restructure_records(df: pd.DataFrame, cols: List[str], replace_with) -> pd.D
     return df
 
 
-def add_new_columns(df: pd.DataFrame) -> pd.DataFrame:
+def type_records(df: pd.DataFrame, cols: List[str], replace_with) -> pd.DataFrame:
     """
-    Add new columns to the dataframe
+    Keep nested values as Python objects for the columnar formats, replacing missing or malformed ones
     Args:
         df: A Pandas dataframe
+        cols: The nested columns
+        replace_with: The expected type, list or dict
 
     Returns:
         df: A Pandas dataframe
     """
-    df['play_count'] = pd.to_numeric(df['play_count'].str.replace(',', ''), errors='coerce').fillna(0).astype(int)
-    df['plays'] = df['play_count'].map(get_play_level).astype('string')
-    df['influencer_type'] = df['profile_followers'].map(get_influencer_type).astype('string')
-    df['profile_biography'] = df['profile_biography'].map(fix_biography).astype('string')
-    df['search_term'] = df['discovery_input'].map(get_search_term).astype('string')
-    df['product_promo'] = False
+    for col in cols:
+        values = df[col] if col in df.columns else [None] * len(df)
+        df[col] = [value if isinstance(value, replace_with) else replace_with() for value in values]
     return df
 
 
-def get_play_level(play_count: int) -> str:
+def add_new_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Get the play level
+    Add new columns to the dataframe
     Args:
-        play_count: An integer
+        df: A Pandas dataframe
 
     Returns:
-        play_level: A string
+        df: A Pandas dataframe
     """
-    if play_count < 10_000:
-        return "low"
-    elif play_count < 50_000:
-        return "medium"
-    else:
-        return "high"
+    df['play_count'] = to_integers(df['play_count'].str.replace(',', ''))
+    df['plays'] = get_levels(df['play_count'], play_levels)
+    df['influencer_type'] = get_levels(df['profile_followers'], influencer_types)
+    df['profile_biography'] = fix_biography(df['profile_biography'])
+    df['product_promo'] = False
+    return df
 
 
-def get_influencer_type(profile_followers: int) -> str:
+def get_levels(values: pd.Series, levels: dict) -> pd.Series:
     """
-    Get the influencer type
+    Bin numeric values into the labels of a level table
     Args:
-        profile_followers: An integer
+        values: A Pandas series of numbers
+        levels: A dict with the bin edges, their labels and which side of each edge is closed
 
     Returns:
-        influencer_type: A string
+        levels: A categorical Pandas series of the labels
     """
-    if profile_followers > 1_000_000:
-        return "celebrity"
-    elif profile_followers > 100_000:
-        return "major"
-    elif profile_followers > 10_000:
-        return "micro"
-    else:
-        return "nano"
+    bins = [float("-inf"), *levels["bins"], float("inf")]
+    return pd.cut(values, bins=bins, labels=levels["labels"], right=levels["right"])
 
 
-def get_search_term(discovery: dict) -> str:
+def get_search_terms(discovery: pd.Series) -> pd.Series:
     """
-    Get the search term
+    Get the search terms
     Args:
-        discovery: A dict
+        discovery: A Pandas series of dicts
 
     Returns:
-        search_term: A string
+        search_terms: A categorical Pandas series of strings, empty where the keyword is missing
     """
-    return discovery.get("search_keyword", "")
+    # A per-row lookup, json_normalize flattens every key of every dict and is about five times slower. The .str
+    # accessor would fail on a malformed value that is a string.
+    terms = discovery.map(lambda value: value.get("search_keyword") if isinstance(value, dict) else None)
+    return terms.fillna("").astype(str).astype('category')
 
 
-def fix_biography(biography: Optional[str]) -> str:
+def fix_biography(biography: pd.Series) -> pd.Series:
     """
     Fix the biography
     Args:
-        biography: A string
+        biography: A Pandas series of strings
 
     Returns:
-        biography: A string
+        biography: A Pandas series of strings
     """
-    if pd.isna(biography):
-        return ""
-    return biography.replace("\n", " ").replace("\r", " ")
+    return biography.astype('string').str.replace(r"[\n\r]", " ", regex=True).fillna("")
 
 
 def fix_create_time(df: pd.DataFrame) -> pd.DataFrame:
@@ -188,11 +278,33 @@ def fix_create_time(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def apply_filters(df: pd.DataFrame) -> pd.DataFrame:
+def get_cutoffs(terms: pd.Series, term_watermarks: Dict[str, Optional[str]], default: pd.Timestamp) -> pd.Series:
+    """
+    Get the create_time cutoff of every post from the watermark of its search term
+    Args:
+        terms: A Pandas series of search terms
+        term_watermarks: Watermarks already looked up during this run, updated in place with the missing terms
+        default: The cutoff of terms without a watermark
+
+    Returns:
+        cutoffs: A Pandas series of timestamps
+    """
+    missing = [term for term in terms.dropna().unique() if term not in term_watermarks]
+    if missing:
+        found = watermarks.get_watermarks(missing)
+        term_watermarks.update({term: found.get(term) for term in missing})
+
+    marks = pd.to_datetime(terms.astype(object).map(term_watermarks), utc=True, format="ISO8601")
+    marks = marks - pd.Timedelta(hours=WATERMARK_LOOKBACK_HOURS)
+    return marks.where(marks > default, default)
+
+
+def apply_filters(df: pd.DataFrame, term_watermarks: Optional[Dict[str, Optional[str]]] = None) -> pd.DataFrame:
     """
     Apply filters to the dataframe
     Args:
         df: A Pandas dataframe
+        term_watermarks: Watermarks by search term, None to only apply the default create_time cutoff
 
     Returns:
         df: A Pandas dataframe
@@ -202,10 +314,31 @@ def apply_filters(df: pd.DataFrame) -> pd.DataFrame:
 
     df = df[df["region"].isin(filters["region"])]
     cutoff_date = pd.to_datetime(filters["create_time"], utc=True)
+    if term_watermarks is not None:
+        cutoff_date = get_cutoffs(df["search_term"], term_watermarks, cutoff_date)
     df = df[df["create_time"] > cutoff_date]
     return df
 
 
+def filter_search_terms(df: pd.DataFrame, search_terms: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Keep the posts of the search terms an execution asked for, a coalesced snapshot holds those of the whole batch
+    Args:
+        df: A Pandas dataframe
+        search_terms: The search terms of the execution, None to keep every post
+
+    Returns:
+        df: A Pandas dataframe
+    """
+    if df.empty or search_terms is None:
+        return df
+
+    wanted = {watermarks.normalize_term(term) for term in search_terms}
+    # Normalized once per distinct term, a snapshot holds a handful of terms over thousands of posts
+    keep = {term for term in df["search_term"].unique() if watermarks.normalize_term(term) in wanted}
+    return df[df["search_term"].isin(keep)]
+
+
 def apply_filters_on_restructured_data(df: pd.DataFrame) -> pd.DataFrame:
     """
     Apply filters on the restructured data
@@ -222,46 +355,884 @@ def apply_filters_on_restructured_data(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def get_response(snapshot_id: str) -> List[dict]:
-    brightdata_url = f"https://api.brightdata.com/datasets/v3/snapshot/{snapshot_id}"
-    querystring = {"format": "json"}
+def iter_records(snapshot_id: str) -> Iterator[dict]:
+    """
+    Stream the snapshot from Brightdata as JSON lines, one record at a time
+    Args:
+        snapshot_id: Submitted to the Brightdata call
+
+    Returns:
+        records: An iterator of Brightdata records, projected by project_record
+    """
+    brightdata_url = f"{BRIGHTDATA_API_URL}/snapshot/{snapshot_id}"
+    querystring = {"format": "ndjson"}
     headers = {"Authorization": f"Bearer {BEARER_TOKEN}"}
 
     try:
-        response = requests.request("GET", brightdata_url, headers=headers, params=querystring)
-        response.raise_for_status()
-        return response.json()
+        with http_client.request("GET", brightdata_url, headers=headers, params=querystring, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield project_record(json.loads(line))
     except Exception as e:
-        logger.error(f"Failed to fetch response from Brightdata - {str(e)}")
+        logger.error(f"Failed to stream response from Brightdata - {str(e)}")
         raise e
 
 
-def clean_data(snapshot_id: str) -> pd.DataFrame:
+def iter_chunks(records: Iterable[dict], chunk_size: int) -> Iterator[List[dict]]:
+    """
+    Group records into chunks. Posts outside the region filter are kept, their create_time still advances the
+    watermarks as it does when the snapshot is cleaned whole.
+    Args:
+        records: An iterable of projected Brightdata records
+        chunk_size: Maximum number of records per chunk
+
+    Returns:
+        chunks: An iterator of record lists
+    """
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def project_record(record: dict) -> dict:
+    """
+    Keep the fields of a raw Brightdata record the cleaning stages read, so the signed URLs, comments and other large
+    fields are released as soon as the record is parsed
+    Args:
+        record: A raw Brightdata record
+
+    Returns:
+        record: The record with the raw_columns only, discovery_input reduced to its search keyword
+    """
+    projected = {col: record[col] for col in raw_columns if col in record}
+    discovery = projected.get('discovery_input')
+    if isinstance(discovery, dict):
+        projected['discovery_input'] = {"search_keyword": discovery.get("search_keyword")}
+    return projected
+
+
+def get_response(snapshot_id: str) -> Iterator[dict]:
+    # JSON lines are parsed and projected one record at a time, so only the projected records reach the frame
+    yield from iter_records(snapshot_id)
+
+
+def to_dataframe(records: Iterable[dict]) -> pd.DataFrame:
+    """
+    Build a dataframe of the raw fields the cleaning stages read, with the search keyword of discovery_input as the
+    search_term column
+    Args:
+        records: An iterable of raw or projected Brightdata records
+
+    Returns:
+        df: A Pandas dataframe with the search_term column
+    """
+    df = pd.DataFrame(records, columns=raw_columns)
+    df['search_term'] = get_search_terms(df.pop('discovery_input'))
+    df = df.astype({'post_id': 'string', 'create_time': 'string', 'play_count': 'string', 'region': 'category'})
+    return df
+
+
+@instrumentation.timed()
+def clean_records(df: pd.DataFrame, term_watermarks: Optional[dict] = None,
+                  search_terms: Optional[List[str]] = None,
+                  new_watermarks: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """
+    Run the cleaning stages on a dataframe of raw records
+    Args:
+        df: A Pandas dataframe
+        term_watermarks: Watermarks by search term, None for a backfill
+        search_terms: The search terms of the execution, None to keep every post
+        new_watermarks: Newest create_time per search term of the records read, updated in place
+
+    Returns:
+        df: A Pandas dataframe
+    """
+    df = filter_search_terms(df, search_terms)
+    df = fix_create_time(df)
+    if new_watermarks is not None:
+        # Before the filters, a post skipped for its region, date or plays was read all the same. It is read again
+        # while it is within WATERMARK_LOOKBACK_HOURS of the watermark.
+        update_watermarks(new_watermarks, get_new_watermarks(df))
+    df = apply_filters(df, term_watermarks)
+    df = restructure(df)
+    df = apply_filters_on_restructured_data(df)
+    return df
+
+
+@instrumentation.timed()
+def clean_data(snapshot_id: str, term_watermarks: Optional[dict] = None,
+               search_terms: Optional[List[str]] = None,
+               new_watermarks: Optional[Dict[str, str]] = None) -> pd.DataFrame:
     """
     Download data from Brightdata and process it
     Args:
         snapshot_id: Submitted to the Brightdata call
-    
+        term_watermarks: Watermarks by search term, None for a backfill
+        search_terms: The search terms of the execution, None to keep every post
+        new_watermarks: Newest create_time per search term of the snapshot, updated in place
+
     Returns:
         df: A Pandas dataframe
     """
-    data = get_response(snapshot_id)
-    df = pd.DataFrame(data)
-    df = df.astype({'post_id': 'string', 'profile_id': 'string', 'create_time': 'string', 'play_count': 'string'})
+    # The raw records are released as soon as the frame is built
+    df = to_dataframe(get_response(snapshot_id))
 
     logger.info(f"Received {len(df)} records from Brightdata")
-    df = fix_create_time(df)
-    df = apply_filters(df)
-    df = restructure(df)
-    df = apply_filters_on_restructured_data(df)
+    df = clean_records(df, term_watermarks, search_terms, new_watermarks)
     logger.info(f"Cleaned data has {len(df)} records")
     return df
 
 
+@instrumentation.timed()
+def clean_data_streaming(snapshot_id: str, chunk_size: int = CHUNK_SIZE,
+                         term_watermarks: Optional[dict] = None,
+                         search_terms: Optional[List[str]] = None,
+                         new_watermarks: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """
+    Stream data from Brightdata and process it chunk by chunk, so memory is bounded by the chunk size
+    Args:
+        snapshot_id: Submitted to the Brightdata call
+        chunk_size: Maximum number of records cleaned at once
+        term_watermarks: Watermarks by search term, None for a backfill
+        search_terms: The search terms of the execution, None to keep every post
+        new_watermarks: Newest create_time per search term of the snapshot, updated in place
+
+    Returns:
+        df: A Pandas dataframe
+    """
+    cleaned = []
+    received = 0
+    for chunk in iter_chunks(iter_records(snapshot_id), chunk_size):
+        received += len(chunk)
+        df = clean_records(to_dataframe(chunk), term_watermarks, search_terms, new_watermarks)
+        if not df.empty:
+            cleaned.append(df)
+
+    logger.info(f"Received {received} records from Brightdata")
+    df = merge_frames(cleaned)
+    logger.info(f"Cleaned data has {len(df)} records")
+    return df
+
+
+def merge_frames(frames: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate cleaned frames in order
+    Args:
+        frames: Pandas dataframes
+
+    Returns:
+        df: A Pandas dataframe
+    """
+    frames = [frame for frame in frames if not frame.empty]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if not df.empty:
+        # Frames with different categories concatenate to plain objects
+        df = df.astype({col: 'category' for col in category_columns})
+    return df
+
+
+@instrumentation.timed(payload_bytes=lambda result: result["bytes"])
+def download_snapshot(snapshot_id: str, path: str) -> dict:
+    """
+    Download a snapshot from Brightdata as JSON lines to a local file
+    Args:
+        snapshot_id: Submitted to the Brightdata call
+        path: The file written
+
+    Returns:
+        download: A dict with the snapshot ID, the path and the size of the file
+    """
+    brightdata_url = f"{BRIGHTDATA_API_URL}/snapshot/{snapshot_id}"
+    querystring = {"format": "ndjson"}
+    headers = {"Authorization": f"Bearer {BEARER_TOKEN}"}
+
+    try:
+        with http_client.request("GET", brightdata_url, headers=headers, params=querystring, stream=True) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    file.write(chunk)
+    except Exception as e:
+        logger.error(f"Failed to download snapshot {snapshot_id} from Brightdata - {str(e)}")
+        raise e
+    return {"snapshot_id": snapshot_id, "path": path, "bytes": os.path.getsize(path)}
+
+
+@instrumentation.timed(records=len)
+def download_snapshots(snapshot_ids: List[str], directory: str, workers: int = DOWNLOAD_WORKERS) -> List[dict]:
+    """
+    Download snapshots concurrently, the threads wait on the network and not on each other
+    Args:
+        snapshot_ids: Submitted to the Brightdata calls
+        directory: The directory the files are written to
+        workers: Downloads at the same time
+
+    Returns:
+        downloads: The download_snapshot result of every snapshot, in the order of snapshot_ids
+    """
+    paths = [os.path.join(directory, f"{index}.ndjson") for index in range(len(snapshot_ids))]
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(snapshot_ids)), 1),
+                            thread_name_prefix="download") as executor:
+        return list(executor.map(download_snapshot, snapshot_ids, paths))
+
+
+def get_partitions(paths: List[str], count: int, min_bytes: int = PARTITION_MIN_BYTES) -> List[Tuple[str, int, int]]:
+    """
+    Split files of JSON lines into about `count` byte ranges starting and ending on line boundaries
+    Args:
+        paths: The files
+        count: The number of partitions aimed at
+        min_bytes: The smallest partition, a file under it stays whole
+
+    Returns:
+        partitions: (path, start, end) tuples in the order of the files and of their lines
+    """
+    sizes = [os.path.getsize(path) for path in paths]
+    target = max(sum(sizes) // max(count, 1), min_bytes, 1)
+    partitions = []
+    for path, size in zip(paths, sizes):
+        parts = -(-size // target)
+        bounds = [0]
+        with open(path, 'rb') as file:
+            for part in range(1, parts):
+                file.seek(size * part // parts)
+                # The rest of the line belongs to the previous partition
+                file.readline()
+                if bounds[-1] < file.tell() < size:
+                    bounds.append(file.tell())
+        bounds.append(size)
+        partitions.extend((path, start, end) for start, end in zip(bounds, bounds[1:]) if end > start)
+    return partitions
+
+
+def read_partition(partition: Tuple[str, int, int]) -> List[dict]:
+    """
+    Parse the records of a partition, projected by project_record
+    Args:
+        partition: A (path, start, end) tuple from get_partitions
+
+    Returns:
+        records: A list of Brightdata records
+    """
+    path, start, end = partition
+    records = []
+    with open(path, 'rb') as file:
+        file.seek(start)
+        position = start
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            if line.strip():
+                records.append(project_record(json.loads(line)))
+    return records
+
+
+def clean_partition(partition: Tuple[str, int, int], search_terms: Optional[List[str]] = None) -> dict:
+    """
+    Clean a partition up to the watermark cutoffs, which clean_snapshots applies once the partitions are merged
+    Args:
+        partition: A (path, start, end) tuple from get_partitions
+        search_terms: The search terms of the execution, None to keep every post
+
+    Returns:
+        result: A dict with the cleaned dataframe, the records read, their watermarks and the duration
+    """
+    start = time.perf_counter()
+    records = read_partition(partition)
+    received = len(records)
+    new_watermarks = {}
+    df = clean_records(to_dataframe(records), None, search_terms, new_watermarks)
+    return {"df": df, "received": received, "watermarks": new_watermarks,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 3)}
+
+
+def clean_worker(connection, partition: Tuple[str, int, int], search_terms: Optional[List[str]] = None):
+    """
+    Entry point of a cleaning process, the result or the error goes back through the pipe
+    """
+    try:
+        connection.send(("ok", clean_partition(partition, search_terms)))
+    except Exception as e:
+        connection.send(("error", f"{type(e).__name__}: {str(e)}"))
+    finally:
+        connection.close()
+
+
+@instrumentation.timed(records=lambda results: sum(len(result["df"]) for result in results))
+def clean_partitions(partitions: List[Tuple[str, int, int]], search_terms: Optional[List[str]] = None,
+                     workers: int = CLEAN_WORKERS) -> List[dict]:
+    """
+    Clean partitions with up to `workers` processes at a time. A process and a pipe per partition, because
+    multiprocessing pools and queues need /dev/shm, which Lambda does not have.
+    Args:
+        partitions: (path, start, end) tuples from get_partitions
+        search_terms: The search terms of the execution, None to keep every post
+        workers: Processes at the same time, 1 cleans in this process
+
+    Returns:
+        results: The clean_partition result of every partition, in the order of partitions
+    """
+    if workers <= 1 or len(partitions) <= 1:
+        results = [clean_partition(partition, search_terms) for partition in partitions]
+    else:
+        # Forked children start with pandas imported and the module configured, the partitions are read from disk
+        context = multiprocessing.get_context("fork")
+        results = [None] * len(partitions)
+        pending = list(enumerate(partitions))
+        running = {}
+        try:
+            while pending or running:
+                while pending and len(running) < workers:
+                    index, partition = pending.pop(0)
+                    receiver, sender = context.Pipe(duplex=False)
+                    process = context.Process(target=clean_worker, args=(sender, partition, search_terms), daemon=True)
+                    process.start()
+                    sender.close()
+                    running[receiver] = (index, process)
+
+                for receiver in multiprocessing.connection.wait(list(running)):
+                    index, process = running.pop(receiver)
+                    try:
+                        status, result = receiver.recv()
+                    except EOFError:
+                        process.join()
+                        status, result = "error", f"Process exited with code {process.exitcode}"
+                    receiver.close()
+                    process.join()
+                    if status == "error":
+                        raise Exception(f"Failed to clean partition {partitions[index]}: {result}")
+                    results[index] = result
+        finally:
+            for receiver, (_, process) in running.items():
+                process.kill()
+                receiver.close()
+
+    for result in results:
+        # The instrumentation of the children is not flushed, their stages are recorded here
+        instrumentation.record("clean_partition", Duration=result["duration_ms"], Records=len(result["df"]))
+    return results
+
+
+def apply_watermarks(df: pd.DataFrame, term_watermarks: Dict[str, Optional[str]]) -> pd.DataFrame:
+    """
+    Drop the cleaned posts behind the watermark of their search term
+    Args:
+        df: A Pandas dataframe of cleaned posts
+        term_watermarks: Watermarks by search term, filled with the terms looked up
+
+    Returns:
+        df: A Pandas dataframe
+    """
+    if df.empty:
+        return df
+    cutoff_date = get_cutoffs(df["search_term"], term_watermarks, pd.to_datetime(filters["create_time"], utc=True))
+    # restructure turns create_time back into a string column
+    return df[pd.to_datetime(df["create_time"], utc=True, format="mixed") > cutoff_date]
+
+
+def get_memory_mb() -> Optional[int]:
+    """
+    Get the memory of the function, or of the machine outside Lambda
+
+    Returns:
+        memory: The memory in MB, None when it cannot be read
+    """
+    memory = os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE")
+    if memory:
+        return int(memory)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_clean_workers(workers: int = CLEAN_WORKERS, memory_mb: Optional[int] = None) -> int:
+    """
+    Cap the cleaning processes to the memory available, every process holds its own partition and frames
+    Args:
+        workers: The processes configured
+        memory_mb: The memory available, read from the function or the machine by default
+
+    Returns:
+        workers: The processes to start, at least 1
+    """
+    memory_mb = memory_mb or get_memory_mb()
+    if memory_mb is None:
+        return 1
+    # The parent keeps one share for the merged frames
+    fitting = memory_mb // CLEAN_WORKER_MEMORY_MB - 1
+    return max(min(workers, fitting), 1)
+
+
+@instrumentation.timed(records=lambda frames: sum(len(df) for df in frames.values()))
+def clean_snapshots(snapshot_ids: List[str], term_watermarks: Optional[dict] = None,
+                    search_terms: Optional[List[str]] = None, download_workers: int = DOWNLOAD_WORKERS,
+                    clean_workers: int = CLEAN_WORKERS,
+                    new_watermarks: Optional[Dict[str, str]] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Download several snapshots concurrently and clean them in parallel processes
+    Args:
+        snapshot_ids: Submitted to the Brightdata calls
+        term_watermarks: Watermarks by search term, None for a backfill
+        search_terms: The search terms of the execution, None to keep every post
+        download_workers: Downloads at the same time
+        clean_workers: Cleaning processes at the same time, capped by get_clean_workers
+        new_watermarks: Newest create_time per search term of the snapshots, updated in place
+
+    Returns:
+        frames: The cleaned dataframe of every snapshot, in the order of snapshot_ids
+    """
+    workers = get_clean_workers(clean_workers)
+    if workers < clean_workers:
+        logger.warning(f"Cleaning with {workers} of {clean_workers} processes, {CLEAN_WORKER_MEMORY_MB} MB each do "
+                       f"not fit in {get_memory_mb()} MB")
+    clean_workers = workers
+
+    directory = tempfile.mkdtemp(prefix="snapshots-", dir=DOWNLOAD_DIR)
+    try:
+        downloads = download_snapshots(snapshot_ids, directory, download_workers)
+        # Twice as many partitions as processes, so the last ones to finish are small
+        partitions = get_partitions([download["path"] for download in downloads], clean_workers * 2)
+        results = clean_partitions(partitions, search_terms, clean_workers)
+    finally:
+        # /tmp outlives the invocation on a warm container
+        shutil.rmtree(directory, ignore_errors=True)
+
+    snapshots = {download["path"]: download["snapshot_id"] for download in downloads}
+    cleaned = {snapshot_id: [] for snapshot_id in snapshot_ids}
+    for partition, result in zip(partitions, results):
+        cleaned[snapshots[partition[0]]].append(result["df"])
+        if new_watermarks is not None:
+            update_watermarks(new_watermarks, result["watermarks"])
+
+    frames = {}
+    for snapshot_id, partition_frames in cleaned.items():
+        df = merge_frames(partition_frames)
+        if term_watermarks is not None:
+            # In this process, the children do not share the connections of the watermark store
+            df = apply_watermarks(df, term_watermarks)
+        frames[snapshot_id] = df
+    logger.info(f"Received {sum(result['received'] for result in results)} records from {len(snapshot_ids)} "
+                f"snapshots in {len(partitions)} partitions, cleaned data has "
+                f"{sum(len(df) for df in frames.values())} records")
+    return frames
+
+
+def get_new_watermarks(df: pd.DataFrame) -> Dict[str, str]:
+    """
+    Get the newest create_time per search term, to be stored once the posts are ingested
+    Args:
+        df: A Pandas dataframe with one row per post and search term
+
+    Returns:
+        watermarks: A dict of ISO 8601 strings by search term
+    """
+    if df.empty:
+        return {}
+    df = df[df['search_term'].notna() & (df['search_term'] != "")]
+    # restructure turns create_time back into a string column
+    create_time = pd.to_datetime(df['create_time'], utc=True, format="mixed")
+    newest = create_time.groupby(df['search_term'], observed=True).max()
+    return {term: create_time.isoformat() for term, create_time in newest.items() if not pd.isna(create_time)}
+
+
+def update_watermarks(new_watermarks: Dict[str, str], found: Dict[str, str]) -> Dict[str, str]:
+    """
+    Keep the newest of two sets of watermarks
+    Args:
+        new_watermarks: Watermarks by search term, updated in place
+        found: Watermarks of more posts
+
+    Returns:
+        new_watermarks: The updated watermarks
+    """
+    for term, create_time in found.items():
+        if term not in new_watermarks or datetime.fromisoformat(create_time) > \
+                datetime.fromisoformat(new_watermarks[term]):
+            new_watermarks[term] = create_time
+    return new_watermarks
+
+
+def drop_duplicate_posts(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Keep one row per post, overlapping search terms return the same post several times in a snapshot
+    Args:
+        df: A Pandas dataframe
+
+    Returns:
+        df: A Pandas dataframe with the search_terms column listing every term that matched the post
+    """
+    if df.empty:
+        return df
+
+    matches = df.drop_duplicates(['post_id', 'search_term'])
+    terms = matches['search_term'].astype(object).groupby(matches['post_id'], sort=False).agg(list)
+    # Posts without an ID cannot be compared, they are all kept
+    keep = df['post_id'].isna() | ~df.duplicated('post_id')
+    df = df[keep].copy()
+    search_terms = df['post_id'].map(terms).fillna(df['search_term'].astype(object).map(lambda term: [term]))
+    if OUTPUT_FORMAT in COLUMNAR_FORMATS:
+        df['search_terms'] = search_terms
+    else:
+        df['search_terms'] = search_terms.astype(str).astype('string')
+    return df
+
+
+def filter_seen_posts(df: pd.DataFrame, mode: str = SEEN_POSTS_MODE) -> Tuple[pd.DataFrame, int]:
+    """
+    Skip or mark the posts already ingested by a previous run
+    Args:
+        df: A Pandas dataframe
+        mode: 'skip' or 'mark'
+
+    Returns:
+        df: A Pandas dataframe
+        seen: The number of posts found in the seen posts index
+    """
+    if df.empty:
+        return df, 0
+
+    seen = seen_posts.get_seen(df['post_id'].dropna().unique())
+    is_seen = df['post_id'].isin(seen).fillna(False).astype(bool)
+    if mode == 'mark':
+        df = df.assign(previously_ingested=is_seen)
+    else:
+        df = df[~is_seen]
+    return df, int(is_seen.sum())
+
+
+@instrumentation.timed(records=lambda result: len(result[0]))
+def dedupe_posts(df: pd.DataFrame) -> Tuple[pd.DataFrame, dict]:
+    """
+    Run the deduplication stage on the cleaned posts
+    Args:
+        df: A Pandas dataframe
+
+    Returns:
+        df: A Pandas dataframe
+        stats: A dict with the duplicate counts and ratio of the run
+    """
+    records = len(df)
+    df = drop_duplicate_posts(df)
+    in_snapshot = records - len(df)
+    df, previously_ingested = filter_seen_posts(df, SEEN_POSTS_MODE)
+
+    stats = {
+        "records": records,
+        "in_snapshot_duplicates": in_snapshot,
+        "previously_ingested": previously_ingested,
+        "duplicate_ratio": round((in_snapshot + previously_ingested) / records, 4) if records else 0.0,
+        "seen_posts_mode": SEEN_POSTS_MODE
+    }
+    logger.info("Deduplication: %s", json.dumps(stats))
+    return df, stats
+
+
+def get_post_schema(columns: List[str]) -> pa.Schema:
+    """
+    Arrow schema of a cleaned post
+    Args:
+        columns: The columns of the cleaned dataframe, in order
+
+    Returns:
+        schema: An Arrow schema
+    """
+    music = pa.struct([
+        ('id', pa.string()),
+        ('title', pa.string()),
+        ('authorname', pa.string()),
+        ('original', pa.bool_()),
+        ('playurl', pa.string()),
+        ('covermedium', pa.string())
+    ])
+    types = {
+        **{col: pa.string() for col in string_columns},
+        **{col: pa.int64() for col in numeric_columns},
+        'create_time': pa.timestamp('us', tz='UTC'),
+        'hashtags': pa.list_(pa.string()),
+        'music': music,
+        'play_count': pa.int64(),
+        'plays': pa.string(),
+        'influencer_type': pa.string(),
+        'profile_biography': pa.string(),
+        'search_term': pa.string(),
+        'product_promo': pa.bool_(),
+        'search_terms': pa.list_(pa.string()),
+        'previously_ingested': pa.bool_()
+    }
+    return pa.schema([pa.field(col, types[col]) for col in columns])
+
+
+def to_arrow(df: pd.DataFrame) -> pa.Table:
+    """
+    Convert the cleaned posts to an Arrow table with the post schema
+    Args:
+        df: A Pandas dataframe
+
+    Returns:
+        table: An Arrow table
+    """
+    if df.empty:
+        columns = string_columns + numeric_columns + array_columns + object_columns + new_columns + ['search_terms']
+        return get_post_schema(columns).empty_table()
+    # restructure casts create_time to a string column, Arrow stores it as a timestamp again
+    df = df.assign(create_time=pd.to_datetime(df['create_time'], utc=True, format='mixed'))
+    return pa.Table.from_pandas(df, schema=get_post_schema(list(df.columns)), preserve_index=False)
+
+
+def get_terms_digest(search_terms: Iterable[str]) -> str:
+    normalized = "\n".join(sorted({watermarks.normalize_term(term) for term in search_terms}))
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12]
+
+
+def put_posts(df: pd.DataFrame, name: str) -> dict:
+    """
+    Write posts to the payload bucket in the output format
+    Args:
+        df: A Pandas dataframe
+        name: The object key under cleaned/, without the extension
+
+    Returns:
+        claim_check: A dict with the object location and the record count
+    """
+    if OUTPUT_FORMAT in COLUMNAR_FORMATS:
+        return claim_check.put_table(to_arrow(df), key=f"cleaned/{name}.{OUTPUT_FORMAT}",
+                                     output_format=OUTPUT_FORMAT)
+    ndjson = df.to_json(orient='records', lines=True, date_format='iso') if not df.empty else ""
+    return claim_check.put_ndjson(ndjson, key=f"cleaned/{name}.ndjson.gz", count=len(df))
+
+
+@instrumentation.timed()
+def store_posts(df: pd.DataFrame, snapshot_id: str, search_terms: Optional[List[str]] = None) -> dict:
+    """
+    Write the cleaned posts to the payload bucket so only a pointer travels through the state machine
+    Args:
+        df: A Pandas dataframe
+        snapshot_id: Submitted to the Brightdata call
+        search_terms: The search terms of the execution, when it shares a coalesced snapshot
+
+    Returns:
+        claim_check: A dict with the object location and the record count
+    """
+    name = snapshot_id
+    if search_terms is not None:
+        # Executions sharing a snapshot each write their own subset of it
+        name = f"{snapshot_id}-{get_terms_digest(search_terms)}"
+    return put_posts(df, name)
+
+
+@instrumentation.timed(records=lambda cached: cached)
+def cache_term_results(df: pd.DataFrame, snapshot_id: str, search_terms: Iterable[str] = ()) -> int:
+    """
+    Store the cleaned posts of every search term on their own, so a later execution asking for the same terms
+    within the freshness window can skip the discovery. Posts are stored before deduplication, the execution
+    reusing them runs it against the seen posts index of its own time.
+    Args:
+        df: A Pandas dataframe with one row per post and search term
+        snapshot_id: Submitted to the Brightdata call
+        search_terms: Terms looked up during the run, cached as empty when none of their posts were kept
+
+    Returns:
+        cached: The number of terms cached
+    """
+    results = {term: {"count": 0} for term in search_terms if term}
+    if not df.empty:
+        for term, posts in df.groupby('search_term', sort=False, observed=True):
+            if term:
+                results[term] = put_posts(posts, f"terms/{snapshot_id}/{get_terms_digest([term])}")
+    return snapshot_cache.put_results(results, snapshot_id)
+
+
+@instrumentation.timed()
+def load_cached_results(results: List[dict]) -> pd.DataFrame:
+    """
+    Read the cleaned posts of cached search terms
+    Args:
+        results: Snapshot cache entries, an entry without a claim check had no posts
+
+    Returns:
+        df: A Pandas dataframe with one row per post and search term
+    """
+    frames = [pd.DataFrame(list(claim_check.iter_records(result))) for result in results if "claim_check" in result]
+    frames = [frame for frame in frames if not frame.empty]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    logger.info(f"Loaded {len(df)} cached records for {len(results)} search term(s)")
+    return df
+
+
+def finish_posts(df: pd.DataFrame, snapshot_id: str, new_watermarks: Dict[str, str],
+                 search_terms: Optional[List[str]] = None):
+    """
+    Deduplicate the cleaned posts and hand them to ingest_data
+    Args:
+        df: A Pandas dataframe with one row per post and search term
+        snapshot_id: Names the claim check object
+        new_watermarks: Newest create_time per search term of the records read, before the filters
+        search_terms: The search terms of the execution, when it shares a coalesced snapshot
+
+    Returns:
+        posts: The list of posts, or a claim check with the deduplication stats and the new watermarks
+    """
+    df, dedup = dedupe_posts(df)
+    # A columnar table can only travel behind a claim check
+    if CLAIM_CHECK_MODE or OUTPUT_FORMAT in COLUMNAR_FORMATS:
+        # ingest_data stores the watermarks once every batch is accepted
+        return {**store_posts(df, snapshot_id, search_terms), "dedup": dedup, "watermarks": new_watermarks}
+    posts = df.to_dict(orient='records')
+    return posts
+
+
+def iter_fused_posts(snapshot_id: str, stats: dict, new_watermarks: Dict[str, str], chunk_size: int = CHUNK_SIZE,
+                     term_watermarks: Optional[dict] = None,
+                     search_terms: Optional[List[str]] = None) -> Iterator[dict]:
+    """
+    Stream the snapshot through the cleaning and deduplication stages one chunk at a time. Posts are deduplicated
+    across chunks by ID, a post found again in a later chunk keeps the search terms of the chunk it was first sent in.
+    Args:
+        snapshot_id: Submitted to the Brightdata call
+        stats: Deduplication stats, updated in place
+        new_watermarks: Newest create_time per search term, updated in place
+        chunk_size: Maximum number of records cleaned at once
+        term_watermarks: Watermarks by search term, None for a backfill
+        search_terms: The search terms of the execution, None to keep every post
+
+    Returns:
+        posts: An iterator of cleaned posts
+    """
+    sent = set()
+    for chunk in iter_chunks(iter_records(snapshot_id), chunk_size):
+        stats["received"] += len(chunk)
+        df = clean_records(to_dataframe(chunk), term_watermarks, search_terms, new_watermarks)
+        if df.empty:
+            continue
+        stats["records"] += len(df)
+        deduped = drop_duplicate_posts(df)
+        deduped = deduped[deduped['post_id'].isna() | ~deduped['post_id'].isin(sent)]
+        stats["in_snapshot_duplicates"] += len(df) - len(deduped)
+        deduped, previously_ingested = filter_seen_posts(deduped, SEEN_POSTS_MODE)
+        stats["previously_ingested"] += previously_ingested
+        sent.update(deduped['post_id'].dropna())
+        if deduped.empty:
+            continue
+        # Through pandas' JSON writer, like the claim check, so missing values become null
+        for line in deduped.to_json(orient='records', lines=True, date_format='iso').splitlines():
+            yield json.loads(line)
+
+
+@instrumentation.timed()
+def clean_and_ingest(snapshot_id: str, term_watermarks: Optional[dict] = None,
+                     search_terms: Optional[List[str]] = None) -> dict:
+    """
+    Clean the snapshot and send it to the ingestion API in a single pass. The records in memory are bounded by the
+    chunk size plus the in-flight batches, and a slow or throttling ingestion API slows the download down.
+    Args:
+        snapshot_id: Submitted to the Brightdata call
+        term_watermarks: Watermarks by search term, None for a backfill
+        search_terms: The search terms of the execution, None to keep every post
+
+    Returns:
+        output: The ingest_data output, with fused set
+    """
+    api_base_url = os.getenv('API_BASE_URL', None)
+    if api_base_url is None:
+        raise ValueError("API Base URL is missing")
+
+    stats = {"received": 0, "records": 0, "in_snapshot_duplicates": 0, "previously_ingested": 0}
+    new_watermarks = {}
+    post_ids = {}
+
+    def track(batches):
+        # Only the IDs are kept, to index the posts of the accepted batches
+        for batch in batches:
+            post_ids[batch["index"]] = batch["post_ids"]
+            yield batch
+
+    start = time.perf_counter()
+    posts = iter_fused_posts(snapshot_id, stats, new_watermarks, term_watermarks=term_watermarks,
+                             search_terms=search_terms)
+    results = ingestion.stream_batches(f"{api_base_url}/ingest/videos", track(ingestion.iter_batches(posts)))
+    summary = ingestion.summarize(results, time.perf_counter() - start)
+
+    summary["indexed_posts"] = seen_posts.mark_seen(
+        post_id for result in results if result["status"] == "success" for post_id in post_ids[result["index"]]
+    )
+    duplicates = stats["in_snapshot_duplicates"] + stats["previously_ingested"]
+    summary["dedup"] = {
+        "records": stats["records"],
+        "in_snapshot_duplicates": stats["in_snapshot_duplicates"],
+        "previously_ingested": stats["previously_ingested"],
+        "duplicate_ratio": round(duplicates / stats["records"], 4) if stats["records"] else 0.0,
+        "seen_posts_mode": SEEN_POSTS_MODE
+    }
+    # A partial ingestion keeps the old watermarks, otherwise the failed posts would fall behind the cutoff
+    if new_watermarks and not summary["failed_batches"]:
+        summary["watermarks"] = watermarks.advance_watermarks(new_watermarks)
+    logger.info(f"Received {stats['received']} records from Brightdata, ingested "
+                f"{summary['records'] - summary['failed_records']} of {summary['records']} in "
+                f"{summary['batches']} batch(es)")
+
+    if results and summary["failed_batches"] == len(results):
+        raise Exception(f"All {len(results)} ingestion batch(es) failed")
+    return {**ingestion.make_response(results, summary), "fused": True}
+
+
+def clean_many(snapshot_ids: List[str], term_watermarks: Optional[dict] = None,
+               search_terms: Optional[List[str]] = None):
+    """
+    Clean several snapshots and hand their posts to ingest_data as one. Posts are deduplicated across the
+    snapshots, the first snapshot holding a post keeps it. The fused and streaming modes apply to one snapshot.
+    Args:
+        snapshot_ids: Submitted to the Brightdata calls
+        term_watermarks: Watermarks by search term, None for a backfill
+        search_terms: The search terms of the execution, None to keep every post
+
+    Returns:
+        posts: The list of posts, or a claim check with the deduplication stats and the new watermarks
+    """
+    try:
+        new_watermarks = {}
+        frames = clean_snapshots(snapshot_ids, term_watermarks=term_watermarks, search_terms=search_terms,
+                                 new_watermarks=new_watermarks)
+        if snapshot_cache.is_enabled():
+            for snapshot_id, df in frames.items():
+                try:
+                    cache_term_results(df, snapshot_id, [*(search_terms or []), *new_watermarks])
+                except Exception as e:
+                    logger.warning(f"Failed to cache the search term results of {snapshot_id}: {str(e)}")
+        df = merge_frames(frames.values())
+        name = hashlib.sha1("\n".join(snapshot_ids).encode('utf-8')).hexdigest()[:12]
+        return finish_posts(df, f"snapshots-{name}", new_watermarks, search_terms)
+    except Exception as e:
+        logger.error(f"Failed to clean data: {str(e)}")
+        raise e
+
+
+@instrumentation.handler
 def lambda_handler(event, context):
-    logger.info("Event received: %s", json.dumps(event))
+    instrumentation.log_event(event)
+
+    # Set by the Use Snapshot Cache branch, every search term of the execution has fresh cleaned posts
+    cached_results = event.get('cached_results', None)
+    if cached_results is not None:
+        try:
+            df = load_cached_results(cached_results)
+            # The records behind the cached posts were read by an earlier run, which advanced their watermarks
+            return finish_posts(df, f"cached-{event.get('execution_name', '')}", get_new_watermarks(df))
+        except Exception as e:
+            logger.error(f"Failed to clean cached data: {str(e)}")
+            raise e
 
     snapshot_id = event.get('snapshot_id', None)
+    # Several snapshots ready at the same time, e.g. from sharded triggers or retries, are cleaned together
+    snapshot_ids = event.get('snapshot_ids', None)
     status = event.get('status', 'fail')
 
     if status == 'fail':
@@ -269,15 +1240,93 @@ def lambda_handler(event, context):
         logger.error(err_message)
         raise Exception(err_message)
 
-    if snapshot_id is None:
+    if snapshot_ids is not None and (not isinstance(snapshot_ids, list)
+                                     or not all(isinstance(item, str) and item for item in snapshot_ids)):
+        err_message = "Snapshot IDs must be a list of snapshot IDs"
+        logger.error(err_message)
+        raise Exception(err_message)
+
+    if snapshot_id is None and not snapshot_ids:
         err_message = "Snapshot ID is missing"
         logger.error(err_message)
         raise Exception(err_message)
 
+    streaming = event.get('streaming', STREAMING_MODE)
+    fused = event.get('fused', FUSED_MODE)
+    backfill = event.get('backfill', BACKFILL_MODE)
+    term_watermarks = None if backfill else {}
+    if term_watermarks is not None and not fused and not (CLAIM_CHECK_MODE or OUTPUT_FORMAT in COLUMNAR_FORMATS) \
+            and watermarks.is_enabled():
+        # ingest_data advances the watermarks it finds next to a claim check, a list of posts has no room for them
+        logger.warning("Watermarks are only advanced with CLAIM_CHECK_MODE or FUSED_MODE, filtering without them")
+        term_watermarks = None
+    # Set by the notification Lambda when the snapshot was triggered for a coalesced batch
+    search_terms = event.get('search_terms', None)
+
+    if snapshot_ids:
+        snapshot_ids = list(dict.fromkeys([snapshot_id, *snapshot_ids] if snapshot_id else snapshot_ids))
+        if len(snapshot_ids) > 1:
+            return clean_many(snapshot_ids, term_watermarks=term_watermarks, search_terms=search_terms)
+        snapshot_id = snapshot_ids[0]
+
     try:
-        df = clean_data(snapshot_id)
-        posts = df.to_dict(orient='records')
-        return posts
+        if fused:
+            return clean_and_ingest(snapshot_id, term_watermarks=term_watermarks, search_terms=search_terms)
+        new_watermarks = {}
+        if streaming:
+            df = clean_data_streaming(snapshot_id, term_watermarks=term_watermarks, search_terms=search_terms,
+                                      new_watermarks=new_watermarks)
+        else:
+            df = clean_data(snapshot_id, term_watermarks=term_watermarks, search_terms=search_terms,
+                            new_watermarks=new_watermarks)
+        if term_watermarks:
+            logger.info("Filtered on watermarks: %s", json.dumps(term_watermarks))
+        if snapshot_cache.is_enabled():
+            try:
+                # new_watermarks holds every term of the snapshot, including those left without posts
+                cache_term_results(df, snapshot_id, [*(search_terms or []), *new_watermarks])
+            except Exception as e:
+                logger.warning(f"Failed to cache the search term results: {str(e)}")
+        return finish_posts(df, snapshot_id, new_watermarks, search_terms)
     except Exception as e:
         logger.error(f"Failed to clean data: {str(e)}")
         raise e
+
+
+def main():
+    """
+    Clean snapshots from the command line, e.g. to reprocess a backfill on a larger machine. The cleaned and
+    deduplicated posts are written as JSON lines, nothing is ingested, marked as seen or cached.
+    """
+    parser = argparse.ArgumentParser(description="Download Brightdata snapshots and clean them into JSON lines")
+    parser.add_argument("snapshot_ids", nargs="+", help="The snapshots to clean")
+    parser.add_argument("--output", help="File the posts are written to, stdout otherwise")
+    parser.add_argument("--search-terms", nargs="+", help="Keep the posts of these search terms only")
+    parser.add_argument("--backfill", action="store_true", default=BACKFILL_MODE,
+                        help="Ignore the per-term watermarks")
+    parser.add_argument("--download-workers", type=int, default=DOWNLOAD_WORKERS)
+    parser.add_argument("--clean-workers", type=int, default=CLEAN_WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(stream=sys.stderr, format="%(asctime)s %(levelname)s %(message)s")
+
+    # The metric documents would be printed between the posts
+    with instrumentation.collect():
+        new_watermarks = {}
+        frames = clean_snapshots(list(dict.fromkeys(args.snapshot_ids)), term_watermarks=None if args.backfill else {},
+                                 search_terms=args.search_terms, download_workers=args.download_workers,
+                                 clean_workers=args.clean_workers, new_watermarks=new_watermarks)
+        df = merge_frames(frames.values())
+        df, dedup = dedupe_posts(df)
+
+    ndjson = df.to_json(orient='records', lines=True, date_format='iso') if not df.empty else ""
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(ndjson)
+    else:
+        sys.stdout.write(ndjson)
+    logger.info("Cleaned %d snapshot(s) into %d posts: %s", len(frames), len(df),
+                json.dumps({"dedup": dedup, "watermarks": new_watermarks}))
+
+
+if __name__ == "__main__":
+    main()
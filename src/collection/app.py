@@ -1,31 +1,229 @@
 import json
 import logging
 import os
+import re
+from urllib.parse import urlsplit, urlunsplit
 
 import boto3
+from common import executions, instrumentation, rate_limiter
+from common.watermarks import normalize_term
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 client = boto3.client("stepfunctions")
 
+FAN_OUT_ENABLED = os.getenv("FAN_OUT_ENABLED", "false").lower() == "true"
+FAN_OUT_MAX_CONCURRENCY = int(os.getenv("FAN_OUT_MAX_CONCURRENCY", 4))
+FAN_OUT_SHARD_SIZE = int(os.getenv("FAN_OUT_SHARD_SIZE", 2))
+# Step Functions caps inline Map concurrency at 40 branches
+MAX_FAN_OUT_CONCURRENCY = 40
 
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", 500))
+# 'executions' starts one execution per item from this function, 'map' starts a single execution whose Map state
+# starts them
+BULK_MODE = os.getenv("BULK_MODE", "executions").lower()
+# API Gateway gives up on the integration after 29 seconds
+BULK_DEADLINE_SECONDS = float(os.getenv("BULK_DEADLINE_SECONDS", 25))
+BULK_MODES = ("executions", "map")
+# Step Functions rejects execution inputs over 256 KB
+MAX_INPUT_BYTES = 256 * 1024
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,40}$")
+
+
+# Function to read the fan-out settings of a request, falling back to the function defaults
+def get_fan_out(body):
+    fan_out = body.get('fan_out', {})
+    if isinstance(fan_out, bool):
+        fan_out = {'enabled': fan_out}
+    if not isinstance(fan_out, dict):
+        raise ValueError("fan_out must be a boolean or an object")
+
+    enabled = fan_out.get('enabled', FAN_OUT_ENABLED)
+    max_concurrency = fan_out.get('max_concurrency', FAN_OUT_MAX_CONCURRENCY)
+    shard_size = fan_out.get('shard_size', FAN_OUT_SHARD_SIZE)
+
+    if not isinstance(enabled, bool):
+        raise ValueError("fan_out.enabled must be a boolean")
+    if not isinstance(max_concurrency, int) or not 1 <= max_concurrency <= MAX_FAN_OUT_CONCURRENCY:
+        raise ValueError(f"fan_out.max_concurrency must be an integer between 1 and {MAX_FAN_OUT_CONCURRENCY}")
+    if not isinstance(shard_size, int) or shard_size < 1:
+        raise ValueError("fan_out.shard_size must be a positive integer")
+
+    return {
+        'enabled': enabled,
+        'max_concurrency': max_concurrency,
+        'shard_size': shard_size
+    }
+
+
+# Function to build the execution input of a single url or search_terms request
+def get_input(body, fan_out):
+    input = {}
+    if "url" in body:
+        input['url'] = body.get('url')
+        input['type'] = 'scrape'
+    elif "search_terms" in body:
+        input['search_terms'] = body.get('search_terms', [])
+        input['type'] = 'collect'
+    else:
+        input['type'] = 'undefined'
+        input['body'] = body
+    # Always present, the state machine reads it from the execution input after the scrape steps
+    input['fan_out'] = fan_out
+    return input
+
+
+# Function to normalize a product URL, so that the same page written differently is collected once
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", parts.query, ""))
+
+
+# Function to validate one item of a bulk request, returning its dedupe key and execution input
+def get_bulk_item(item, default_fan_out):
+    if not isinstance(item, dict):
+        raise ValueError("item must be an object")
+    if ("url" in item) == ("search_terms" in item):
+        raise ValueError("item must have either url or search_terms")
+
+    fan_out = get_fan_out({'fan_out': item['fan_out']}) if 'fan_out' in item else default_fan_out
+    if "url" in item:
+        url = item['url']
+        if not isinstance(url, str) or urlsplit(url.strip()).scheme not in ("http", "https") \
+                or not urlsplit(url.strip()).netloc:
+            raise ValueError("url must be an http(s) URL")
+        return f"url#{normalize_url(url)}", get_input({'url': url.strip()}, fan_out)
+
+    search_terms = item['search_terms']
+    if not isinstance(search_terms, list) or not search_terms \
+            or not all(isinstance(term, str) and term.strip() for term in search_terms):
+        raise ValueError("search_terms must be a non-empty list of non-empty strings")
+    # The same terms in another order or case are the same collection
+    key = "terms#" + "|".join(sorted({normalize_term(term) for term in search_terms}))
+    return key, get_input({'search_terms': search_terms}, fan_out)
+
+
+# Function to validate every item of a bulk request in one pass and drop the duplicates
+def get_bulk_items(body, request_id):
+    items = body.get('items')
+    if not isinstance(items, list) or not items:
+        raise ValueError("items must be a non-empty list")
+    if len(items) > BULK_MAX_ITEMS:
+        raise ValueError(f"items has {len(items)} entries, at most {BULK_MAX_ITEMS} are accepted")
+    default_fan_out = get_fan_out(body)
+
+    errors, unique, handles = [], {}, []
+    for index, item in enumerate(items):
+        try:
+            key, input = get_bulk_item(item, default_fan_out)
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+            continue
+        if key in unique:
+            handles.append({"index": index, "status": "duplicate", "duplicate_of": unique[key]["index"]})
+            continue
+        unique[key] = {"index": index, "name": executions.get_execution_name(request_id, key), "input": input}
+        handles.append({"index": index})
+    return list(unique.values()), handles, errors
+
+
+# Function to read the bulk mode and idempotency key of a bulk request
+def get_bulk_options(body, context):
+    mode = body.get('mode', BULK_MODE)
+    if mode not in BULK_MODES:
+        raise ValueError(f"mode must be one of {', '.join(BULK_MODES)}")
+    # Sending a request again with the same request_id starts no execution twice
+    request_id = body.get('request_id') or context.aws_request_id.replace("-", "")[:16]
+    if not isinstance(request_id, str) or not REQUEST_ID_PATTERN.match(request_id):
+        raise ValueError("request_id must be 1 to 40 letters, digits, dashes or underscores")
+    return mode, request_id
+
+
+# Function to start the executions of a bulk request and report a handle per item
+def start_bulk(body, context):
+    mode, request_id = get_bulk_options(body, context)
+    unique, handles, errors = get_bulk_items(body, request_id)
+    if errors:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"message": "Invalid collection request", "errors": errors})
+        }
+
+    state_machine_arn = os.environ['STATE_MACHINE_ARN']
+    deadline = rate_limiter.deadline_from_context(context, cap_seconds=BULK_DEADLINE_SECONDS)
+    bulk_execution = None
+    if mode == "map":
+        input = {
+            'type': 'bulk',
+            'items': [{'name': item['name'], 'input': item['input']} for item in unique],
+            'max_concurrency': min(executions.DISPATCH_CONCURRENCY, MAX_FAN_OUT_CONCURRENCY)
+        }
+        if len(json.dumps(input)) > MAX_INPUT_BYTES:
+            raise ValueError("items are too large for a single execution, use mode executions")
+        bulk_execution = executions.start_execution(client, state_machine_arn, f"{request_id}-bulk", input, deadline)
+        if "error" in bulk_execution:
+            raise RuntimeError(f"{bulk_execution['error']}: {bulk_execution['message']}")
+        # The Map state starts the executions under these names
+        results = [{"name": item['name'],
+                    "execution_arn": executions.get_execution_arn(state_machine_arn, item['name'])} for item in unique]
+    else:
+        results = executions.start_executions(client, state_machine_arn, unique, deadline=deadline)
+
+    started = {item['index']: result for item, result in zip(unique, results)}
+    for handle in handles:
+        result = started.get(handle['index'])
+        if result is None:
+            continue
+        handle['execution_name'] = result['name']
+        if "error" in result:
+            handle.update(status="failed", error=result['error'])
+        else:
+            handle.update(status="queued" if mode == "map" else "started", execution_arn=result['execution_arn'])
+
+    failed = sum(1 for handle in handles if handle['status'] == "failed")
+    response_body = {
+        "message": "Collection triggered successfully" if not failed else "Collection partially triggered",
+        "request_id": request_id,
+        "mode": mode,
+        "started": len(unique) - failed,
+        "duplicates": len(handles) - len(unique),
+        "failed": failed,
+        "items": handles
+    }
+    if bulk_execution is not None:
+        response_body['execution_arn'] = bulk_execution['execution_arn']
+    logger.info("Bulk collection %s: %d started, %d duplicates, %d failed", request_id, response_body['started'],
+                response_body['duplicates'], failed)
+    # 207 tells the client to retry the failed items, with the same request_id the started ones are not started again
+    return {"statusCode": 200 if not failed else 207, "body": json.dumps(response_body)}
+
+
+@instrumentation.handler
 def lambda_handler(event, context):
     try:
-        logger.info("Event received: %s", json.dumps(event))
+        instrumentation.log_event(event)
 
         body = json.loads(event.get("body", "{}"))
 
-        input = {}
-        if "url" in body:
-            input['url'] = body.get('url')
-            input['type'] = 'scrape'
-        elif "search_terms" in body:
-            input['search_terms'] = body.get('search_terms', [])
-            input['type'] = 'collect'
-        else:
-            input['type'] = 'undefined'
-            input['body'] = body
+        if "items" in body:
+            try:
+                return start_bulk(body, context)
+            except ValueError as e:
+                return {
+                    "statusCode": 400,
+                    "body": json.dumps({"message": "Invalid collection request", "error": str(e)})
+                }
+
+        try:
+            fan_out = get_fan_out(body)
+        except ValueError as e:
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"message": "Invalid collection request", "error": str(e)})
+            }
+
+        input = get_input(body, fan_out)
 
         response = client.start_execution(
             stateMachineArn=os.environ['STATE_MACHINE_ARN'],
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+
+import boto3
+from common import executions, instrumentation, rate_limiter
+from common.watermarks import normalize_term
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+client = boto3.client("stepfunctions")
+
+EVENT_SOURCE = "tapestry.collection_service"
+EVENT_DETAIL_TYPE = "collection-request"
+# The batching window and size are set on the SQS event source, this caps the search terms of one execution and
+# a larger batch starts one execution per chunk
+INTAKE_MAX_TERMS = int(os.getenv("INTAKE_MAX_TERMS", 50))
+FAN_OUT_ENABLED = os.getenv("FAN_OUT_ENABLED", "false").lower() == "true"
+FAN_OUT_MAX_CONCURRENCY = int(os.getenv("FAN_OUT_MAX_CONCURRENCY", 4))
+FAN_OUT_SHARD_SIZE = int(os.getenv("FAN_OUT_SHARD_SIZE", 2))
+
+
+# Function to read the search terms of a queued EventBridge event, None when the message is not a collection request
+def get_search_terms(record):
+    try:
+        event = json.loads(record["body"])
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(event, dict) or event.get("source") != EVENT_SOURCE \
+            or event.get("detail-type") != EVENT_DETAIL_TYPE:
+        return None
+    search_terms = (event.get("detail") or {}).get("search_terms")
+    if not isinstance(search_terms, list):
+        return None
+    return [term.strip() for term in search_terms if isinstance(term, str) and term.strip()] or None
+
+
+# Function to merge the search terms of a batch, each term keeps the messages that asked for it
+def merge_search_terms(records):
+    terms, dropped = {}, 0
+    for record in records:
+        search_terms = get_search_terms(record)
+        if search_terms is None:
+            # Retrying a malformed message cannot fix it, it is dropped rather than sent to the dead-letter queue
+            logger.warning("Dropping message %s, not a collection request: %s", record.get("messageId"),
+                           str(record.get("body"))[:200])
+            dropped += 1
+            continue
+        for term in search_terms:
+            entry = terms.setdefault(normalize_term(term), {"term": term, "message_ids": []})
+            if record["messageId"] not in entry["message_ids"]:
+                entry["message_ids"].append(record["messageId"])
+    return list(terms.values()), dropped
+
+
+# Function to split the merged search terms into chunks of at most max_terms, keeping the terms a message brought in
+# the same chunk when they fit. A chunk that fails only sends its own messages back to the queue, and a message split
+# across chunks would otherwise collect the terms of its started chunks again on redelivery.
+def get_chunks(terms, max_terms):
+    groups = {}
+    for entry in terms:
+        groups.setdefault(entry["message_ids"][0], []).append(entry)
+
+    chunks, chunk = [], []
+    for message_id, group in groups.items():
+        if len(chunk) + len(group) > max_terms and chunk:
+            chunks.append(chunk)
+            chunk = []
+        if len(group) > max_terms:
+            # Too many terms for one execution, the message gets chunks of its own
+            chunks.extend(group[start:start + max_terms] for start in range(0, len(group), max_terms))
+            continue
+        chunk.extend(group)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+# Function to name the execution of a chunk after the messages whose terms it holds, so that the same messages
+# redelivered after a failure get the same names and a chunk that started is not started twice
+def get_execution_name(chunk):
+    message_ids = sorted({entry["message_ids"][0] for entry in chunk})
+    key = "|".join(message_ids) + "#" + "|".join(normalize_term(entry["term"]) for entry in chunk)
+    return executions.get_execution_name("intake", key)
+
+
+# Function to build the execution input of a chunk of merged search terms
+def get_input(chunk, message_ids):
+    return {
+        "type": "collect",
+        "search_terms": [entry["term"] for entry in chunk],
+        # Always present, the state machine reads it from the execution input
+        "fan_out": {
+            "enabled": FAN_OUT_ENABLED,
+            "max_concurrency": FAN_OUT_MAX_CONCURRENCY,
+            "shard_size": FAN_OUT_SHARD_SIZE
+        },
+        "source": {"type": "eventbridge", "messages": len(message_ids)}
+    }
+
+
+@instrumentation.handler
+def lambda_handler(event, context):
+    records = event.get("Records", [])
+    terms, dropped = merge_search_terms(records)
+
+    batch = []
+    for chunk in get_chunks(terms, INTAKE_MAX_TERMS):
+        # Every message asking for a term of the chunk waits on it, the first one to ask merely placed it
+        message_ids = sorted({message_id for entry in chunk for message_id in entry["message_ids"]})
+        batch.append({"name": get_execution_name(chunk), "input": get_input(chunk, message_ids),
+                      "message_ids": message_ids})
+
+    deadline = rate_limiter.deadline_from_context(context)
+    results = executions.start_executions(client, os.environ["STATE_MACHINE_ARN"], batch, deadline=deadline)
+
+    # Only the messages of the chunks that did not start go back to the queue. A message of a started chunk that also
+    # asked for a term of a failed chunk goes back as well and its other terms are collected again, duplicate
+    # discoveries are limited to such shared terms and ingestion drops the posts it already has.
+    failures = sorted({message_id for execution, result in zip(batch, results) if "error" in result
+                       for message_id in execution["message_ids"]})
+    instrumentation.record("intake_batch", Records=len(records), Errors=len(failures) or None)
+    logger.info("Intake of %d messages (%d dropped): %d search terms in %d executions, %d messages to retry",
+                len(records), dropped, len(terms), len(batch), len(failures))
+    for execution, result in zip(batch, results):
+        if "error" not in result:
+            logger.info("Started %s with %d search terms", result["execution_arn"],
+                        len(execution["input"]["search_terms"]))
+
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]}
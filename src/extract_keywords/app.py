@@ -2,41 +2,20 @@ import ast
 import json
 import logging
 import os
-import time
 
-import openai
-from openai import OpenAI
+from common import instrumentation, llm, page_cache, rate_limiter
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-client = OpenAI(
-    api_key=os.environ.get("API_KEY"),
-)
+# The Extract Keywords state times out after 30s, well before the Lambda does
+SAFETY_MARGIN_MS = int(os.getenv("SAFETY_MARGIN_MS", 2000))
+STEP_TIMEOUT_SECONDS = float(os.getenv("STEP_TIMEOUT_SECONDS", 28))
 
 
-# Function to get OpenAI completion with retry logic
-def get_openai_completion(prompt):
-    while True:
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=200,
-                n=1,
-                stop=None,
-                temperature=0.7,
-            )
-            return response.choices[0].message.content
-        except openai.RateLimitError as e:
-            logger.warning("Rate limit exceeded. Retrying in 5 seconds...", e)
-            time.sleep(5)
-        except openai.OpenAIError as e:
-            logger.error("Error in fetching response: %s", str(e), exc_info=True)
-            raise e
+# Function to get OpenAI completion, errors are raised to the state machine
+def get_openai_completion(prompt, deadline=None):
+    return llm.get_openai_completion(prompt, deadline=deadline)
 
 
 # Util function to convert string literal to a python object
@@ -60,7 +39,8 @@ def get_dict(input_string: str) -> str:
 
 
 # Function to suggest keywords based on product summary and benefits
-def suggest_keywords(summary, benefits):
+@instrumentation.timed()
+def suggest_keywords(summary, benefits, deadline=None):
     prompt = (f"Given a product's description and reviews, give me a json object with the following structure:"
               f"\n 1. 'descriptor': a search term can be used to lookup similar products on TikTok, Instagram reels"
               f" or Youtube shorts. The search term should be as brief as possible (2-3 words)."
@@ -71,18 +51,31 @@ def suggest_keywords(summary, benefits):
               f"Product Summary: {summary}\n\n"
               f"Product Reviews: {benefits}")
 
-    response = get_openai_completion(prompt)
+    response = get_openai_completion(prompt, deadline)
     return get_dict(response)
 
 
+@instrumentation.handler
 def lambda_handler(event, context):
-    logger.info("Received event: %s", json.dumps(event))
+    instrumentation.log_event(event)
 
     product_summary = event.get("product_summary", "")
     reviews_summary = event.get("reviews_summary", [])
 
-    keywords = suggest_keywords(product_summary, reviews_summary)
+    deadline = rate_limiter.deadline_from_context(context, SAFETY_MARGIN_MS, STEP_TIMEOUT_SECONDS)
+    keywords = suggest_keywords(product_summary, reviews_summary, deadline)
     logger.info("Extracted keywords successfully")
+    llm.log_stats()
+
+    # Let the next collection of an unchanged page skip summarization and keyword extraction
+    url = event.get("url")
+    fingerprint = event.get("fingerprint")
+    if url and fingerprint and product_summary:
+        page_cache.save_results(url, fingerprint, {
+            "product_summary": product_summary,
+            "reviews_summary": reviews_summary,
+            "keywords": keywords
+        })
     return {
         "keywords": keywords
     }
@@ -1,38 +1,56 @@
-import json
 import logging
 import os
+import time
 
-import requests
+from common import claim_check, ingestion, instrumentation, seen_posts, watermarks
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+@instrumentation.handler
 def lambda_handler(event, context):
-    logger.info(f"Event received: {json.dumps(event)}")
+    instrumentation.log_event(event)
 
     api_base_url = os.getenv('API_BASE_URL', None)
     if api_base_url is None:
         raise ValueError("API Base URL is missing")
 
+    is_claim_check = claim_check.is_claim_check(event)
+    posts = claim_check.iter_records(event) if is_claim_check else event
+
+    post_ids = {}
+
+    def track(batches):
+        # Only the IDs are kept, to index the posts of the accepted batches
+        for batch in batches:
+            post_ids[batch["index"]] = batch["post_ids"]
+            yield batch
+
     ingestion_url = f"{api_base_url}/ingest/videos"
-    headers = {'Content-Type': 'application/json'}
+    start = time.perf_counter()
     try:
-        response = requests.post(
-            ingestion_url,
-            json=event,
-            headers=headers,
-            timeout=30
-        )
-        response.raise_for_status()
-        return {
-            "response": response.json()
-        }
-    except requests.exceptions.JSONDecodeError as e:
-        logger.warning(f"Unable to parse response to JSON: {str(e)}")
-        return {
-            "response": response.text
-        }
+        # Batches are built while earlier ones are sent, so only the in-flight batches are held in memory
+        results = ingestion.stream_batches(ingestion_url, track(ingestion.iter_batches(posts)))
     except Exception as e:
         logger.error(f"Error while ingesting data")
         raise e
+
+    summary = ingestion.summarize(results, time.perf_counter() - start)
+
+    # Only posts the API accepted go into the index, a failed batch is picked up again by the next run
+    summary["indexed_posts"] = seen_posts.mark_seen(
+        post_id for result in results if result["status"] == "success" for post_id in post_ids[result["index"]]
+    )
+    if is_claim_check and event.get("dedup"):
+        summary["dedup"] = event["dedup"]
+    # A partial ingestion keeps the old watermarks, otherwise the failed posts would fall behind the cutoff
+    if is_claim_check and event.get("watermarks") and not summary["failed_batches"]:
+        summary["watermarks"] = watermarks.advance_watermarks(event["watermarks"])
+    logger.info(f"Ingested {summary['records'] - summary['failed_records']} of {summary['records']} records "
+                f"in {summary['batches']} batch(es)")
+
+    if results and summary["failed_batches"] == len(results):
+        raise Exception(f"All {len(results)} ingestion batch(es) failed")
+
+    return ingestion.make_response(results, summary)
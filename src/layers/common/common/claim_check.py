@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import gzip
+import importlib.util
+import io
+import json
+import logging
+import os
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from common.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+else:
+    pa = lazy_import("pyarrow")
+    parquet = lazy_import("pyarrow.parquet")
+
+logger = logging.getLogger()
+
+PAYLOAD_BUCKET = os.getenv("PAYLOAD_BUCKET", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", None)
+
+NDJSON_GZIP = "ndjson.gz"
+PARQUET = "parquet"
+ARROW_IPC = "arrow"
+
+CONTENT_TYPES = {
+    PARQUET: "application/vnd.apache.parquet",
+    ARROW_IPC: "application/vnd.apache.arrow.file"
+}
+
+# Rows per record batch when iterating over a columnar payload
+READ_BATCH_SIZE = 1000
+
+_s3_client = None
+
+
+def get_s3_client():
+    """
+    Get the S3 client, created on first use so a local stand-in can be configured through S3_ENDPOINT_URL
+    """
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+
+        _s3_client = boto3.client("s3", endpoint_url=S3_ENDPOINT_URL)
+    return _s3_client
+
+
+def is_columnar_available() -> bool:
+    """
+    Check whether pyarrow can be imported, without importing it. It is left out of the requirements because next to
+    pandas it is over the Lambda zip package limit, the columnar formats need a container image.
+    """
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def is_claim_check(event) -> bool:
+    """
+    Check whether a state payload is a claim check rather than the records themselves
+    Args:
+        event: The state payload
+
+    Returns:
+        is_claim_check: A boolean
+    """
+    return isinstance(event, dict) and "claim_check" in event
+
+
+def put_ndjson(ndjson: str, key: str, count: int, bucket: str = PAYLOAD_BUCKET) -> dict:
+    """
+    Store newline-delimited JSON records as a gzip object and return the claim check pointing to it
+    Args:
+        ndjson: The records, one JSON document per line
+        key: The object key
+        count: The number of records
+        bucket: The payload bucket
+
+    Returns:
+        claim_check: A dict with the object location and the record count
+    """
+    body = gzip.compress(ndjson.encode("utf-8"))
+    return put_object(body, key, count, NDJSON_GZIP, "application/x-ndjson", bucket, content_encoding="gzip")
+
+
+def serialize_table(table: pa.Table, output_format: str, compression: str = "zstd") -> bytes:
+    """
+    Serialize an Arrow table as Parquet or as an Arrow IPC file
+    Args:
+        table: The Arrow table
+        output_format: 'parquet' or 'arrow'
+        compression: The codec, zstd by default
+
+    Returns:
+        body: The serialized table
+    """
+    sink = io.BytesIO()
+    if output_format == PARQUET:
+        parquet.write_table(table, sink, compression=compression)
+    elif output_format == ARROW_IPC:
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f"Unsupported columnar format: {output_format}")
+    return sink.getvalue()
+
+
+def put_table(table: pa.Table, key: str, output_format: str, bucket: str = PAYLOAD_BUCKET) -> dict:
+    """
+    Store an Arrow table as Parquet or Arrow IPC and return the claim check pointing to it
+    Args:
+        table: The Arrow table
+        key: The object key
+        output_format: 'parquet' or 'arrow'
+        bucket: The payload bucket
+
+    Returns:
+        claim_check: A dict with the object location and the record count
+    """
+    body = serialize_table(table, output_format)
+    return put_object(body, key, table.num_rows, output_format, CONTENT_TYPES[output_format], bucket)
+
+
+def put_object(body: bytes, key: str, count: int, payload_format: str, content_type: str, bucket: str,
+               content_encoding: Optional[str] = None) -> dict:
+    bucket = bucket or PAYLOAD_BUCKET
+    if not bucket:
+        raise ValueError("Payload bucket is missing")
+
+    extra = {"ContentEncoding": content_encoding} if content_encoding else {}
+    get_s3_client().put_object(Bucket=bucket, Key=key, Body=body, ContentType=content_type, **extra)
+    logger.info(f"Stored {count} records ({len(body)} bytes) at s3://{bucket}/{key}")
+    return {
+        "claim_check": {
+            "bucket": bucket,
+            "key": key,
+            "format": payload_format
+        },
+        "count": count
+    }
+
+
+def iter_table_records(body: bytes, payload_format: str) -> Iterator[dict]:
+    """
+    Iterate over the rows of a serialized Parquet or Arrow IPC table, one record batch at a time. Timestamps are
+    returned as ISO 8601 strings, as in the newline-delimited JSON payloads, rather than datetimes.
+    Args:
+        body: The serialized table
+        payload_format: 'parquet' or 'arrow'
+
+    Returns:
+        records: An iterator of dicts
+    """
+    if not is_columnar_available():
+        raise ImportError(f"Reading a {payload_format} claim check needs pyarrow")
+    source = pa.BufferReader(body)
+    if payload_format == PARQUET:
+        batches = parquet.ParquetFile(source).iter_batches(batch_size=READ_BATCH_SIZE)
+    else:
+        reader = pa.ipc.open_file(source)
+        batches = (reader.get_batch(index) for index in range(reader.num_record_batches))
+    for batch in batches:
+        timestamps = [field.name for field in batch.schema if pa.types.is_timestamp(field.type)]
+        for record in batch.to_pylist():
+            for name in timestamps:
+                if record[name] is not None:
+                    record[name] = record[name].isoformat()
+            yield record
+
+
+def iter_records(event: dict) -> Iterator[dict]:
+    """
+    Stream the records referenced by a claim check
+    Args:
+        event: The claim check returned by put_ndjson
+
+    Returns:
+        records: An iterator of dicts
+    """
+    claim_check = event["claim_check"]
+    payload_format = claim_check.get("format")
+    if payload_format not in (NDJSON_GZIP, PARQUET, ARROW_IPC):
+        raise ValueError(f"Unsupported claim check format: {payload_format}")
+
+    response = get_s3_client().get_object(Bucket=claim_check["bucket"], Key=claim_check["key"])
+    if payload_format != NDJSON_GZIP:
+        # Columnar files keep their metadata in the footer, so the object is read whole
+        yield from iter_table_records(response["Body"].read(), payload_format)
+        return
+    with gzip.GzipFile(fileobj=response["Body"]) as stream:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,261 @@
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from common.watermarks import normalize_term
+
+logger = logging.getLogger()
+
+COALESCE_BACKEND = os.getenv("COALESCE_BACKEND", "none")
+COALESCE_TABLE = os.getenv("COALESCE_TABLE", "")
+# Length of a window, 0 disables coalescing and every execution triggers its own snapshot
+COALESCE_WINDOW_SECONDS = float(os.getenv("COALESCE_WINDOW_SECONDS", 0))
+# A batch item holds every task token, about 1 KB each, well under the 400 KB DynamoDB item limit
+COALESCE_MAX_WAITERS = int(os.getenv("COALESCE_MAX_WAITERS", 100))
+# Batches only need to outlive the snapshot, Brightdata notifies within hours
+COALESCE_TTL_SECONDS = int(os.getenv("COALESCE_TTL_SECONDS", 24 * 60 * 60))
+# A batch still open this long after its window closed lost its leader, the next execution closes and triggers it
+COALESCE_TAKEOVER_SECONDS = float(os.getenv("COALESCE_TAKEOVER_SECONDS", 60))
+
+DYNAMODB_ENDPOINT_URL = os.getenv("DYNAMODB_ENDPOINT_URL", None)
+
+
+class BatchStore(ABC):
+    """
+    Batches of executions waiting on one Brightdata trigger. Joining and closing are atomic, so exactly one
+    execution sees itself first in a batch and exactly one close returns the full list of waiters.
+    """
+
+    @abstractmethod
+    def join(self, batch_id: str, waiter: dict, ttl: int, closes_at: float) -> Optional[int]:
+        """
+        Returns:
+            position: 1-based position of the waiter, None when the batch is closed or full
+        """
+
+    @abstractmethod
+    def close(self, batch_id: str) -> Optional[List[dict]]:
+        """
+        Returns:
+            waiters: The waiters of the batch, None when it was already closed or has expired
+        """
+
+    @abstractmethod
+    def get(self, batch_id: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def list_open(self, group: str) -> List[str]:
+        """
+        Returns:
+            batch_ids: The batches of a group that were joined but not closed yet, whatever their window
+        """
+
+
+class MemoryBatchStore(BatchStore):
+    """
+    Process-local batches, for tests and local runs
+    """
+
+    def __init__(self):
+        self.batches: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def join(self, batch_id, waiter, ttl, closes_at):
+        now = time.time()
+        with self.lock:
+            for key in [key for key, batch in self.batches.items() if batch["expires_at"] <= now]:
+                del self.batches[key]
+            batch = self.batches.setdefault(batch_id, {"waiters": [], "expires_at": now + ttl,
+                                                       "closes_at": closes_at})
+            if "closed_at" in batch or len(batch["waiters"]) >= COALESCE_MAX_WAITERS:
+                return None
+            batch["waiters"].append(waiter)
+            return len(batch["waiters"])
+
+    def close(self, batch_id):
+        now = time.time()
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None or batch["expires_at"] <= now or "closed_at" in batch:
+                return None
+            batch["closed_at"] = now
+            return list(batch["waiters"])
+
+    def get(self, batch_id):
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None or batch["expires_at"] <= time.time():
+                return None
+            return dict(batch)
+
+    def list_open(self, group):
+        now = time.time()
+        with self.lock:
+            return sorted(key for key, batch in self.batches.items() if get_group(key) == group
+                          and "closed_at" not in batch and batch["expires_at"] > now)
+
+
+class DynamoDBBatchStore(BatchStore):
+    """
+    One DynamoDB item per batch keyed on `pk`, with the table's TTL attribute set to `expires_at`. The open batches of
+    a group are listed in a string set on an index item, added by the leader and removed on close.
+    """
+
+    def __init__(self, table_name: str):
+        if not table_name:
+            raise ValueError("DynamoDB table name is missing")
+        import boto3
+
+        self.table = boto3.resource("dynamodb", endpoint_url=DYNAMODB_ENDPOINT_URL).Table(table_name)
+
+    def join(self, batch_id, waiter, ttl, closes_at):
+        try:
+            response = self.table.update_item(
+                Key={"pk": batch_id},
+                UpdateExpression="SET waiters = list_append(if_not_exists(waiters, :empty), :waiter), "
+                                 "expires_at = if_not_exists(expires_at, :expires_at), "
+                                 "closes_at = if_not_exists(closes_at, :closes_at)",
+                ConditionExpression="attribute_not_exists(closed_at) "
+                                    "AND (attribute_not_exists(waiters) OR size(waiters) < :max_waiters)",
+                ExpressionAttributeValues={":empty": [], ":waiter": [waiter], ":max_waiters": COALESCE_MAX_WAITERS,
+                                           ":expires_at": int(time.time() + ttl), ":closes_at": int(closes_at)},
+                ReturnValues="UPDATED_NEW"
+            )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return None
+        position = len(response["Attributes"]["waiters"])
+        if position == 1:
+            self.table.update_item(
+                Key={"pk": get_index_key(get_group(batch_id))},
+                UpdateExpression="ADD batch_ids :batch_ids SET expires_at = :expires_at",
+                ExpressionAttributeValues={":batch_ids": {batch_id}, ":expires_at": int(time.time() + ttl)}
+            )
+        return position
+
+    def close(self, batch_id):
+        now = time.time()
+        try:
+            response = self.table.update_item(
+                Key={"pk": batch_id},
+                UpdateExpression="SET closed_at = :closed_at",
+                # Closing twice would trigger the batch twice, closing an expired batch would create an empty one.
+                # DynamoDB deletes expired items up to days late.
+                ConditionExpression="attribute_exists(pk) AND attribute_not_exists(closed_at) AND expires_at > :now",
+                ExpressionAttributeValues={":closed_at": int(now), ":now": int(now)},
+                ReturnValues="ALL_NEW"
+            )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return None
+        finally:
+            self.forget(batch_id)
+        return response["Attributes"].get("waiters", [])
+
+    def forget(self, batch_id):
+        try:
+            self.table.update_item(
+                Key={"pk": get_index_key(get_group(batch_id))},
+                UpdateExpression="DELETE batch_ids :batch_ids",
+                ConditionExpression="attribute_exists(pk)",
+                ExpressionAttributeValues={":batch_ids": {batch_id}}
+            )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    def get(self, batch_id):
+        # Strongly consistent, the batch is read right after it was closed
+        batch = self.table.get_item(Key={"pk": batch_id}, ConsistentRead=True).get("Item")
+        if batch is None or batch.get("expires_at", 0) <= time.time():
+            return None
+        return batch
+
+    def list_open(self, group):
+        index = self.table.get_item(Key={"pk": get_index_key(group)}, ConsistentRead=True).get("Item") or {}
+        return sorted(index.get("batch_ids", []))
+
+
+_store = None
+
+
+def get_store() -> Optional[BatchStore]:
+    global _store
+    if _store is None:
+        backend = (COALESCE_BACKEND or "none").lower()
+        if backend == "memory":
+            _store = MemoryBatchStore()
+        elif backend == "dynamodb":
+            _store = DynamoDBBatchStore(COALESCE_TABLE)
+        elif backend != "none":
+            raise ValueError(f"Unsupported coalescing backend: {backend}")
+    return _store
+
+
+def is_enabled() -> bool:
+    return COALESCE_WINDOW_SECONDS > 0 and get_store() is not None
+
+
+def get_window(now: Optional[float] = None, window_seconds: Optional[float] = None):
+    """
+    Get the window a trigger falls in
+    Args:
+        now: Epoch seconds, the current time by default
+        window_seconds: Length of a window, COALESCE_WINDOW_SECONDS by default
+
+    Returns:
+        window: The window start as an integer ID and the epoch seconds at which it closes
+    """
+    now = time.time() if now is None else now
+    window_seconds = COALESCE_WINDOW_SECONDS if window_seconds is None else window_seconds
+    window = int(now // window_seconds)
+    return window, (window + 1) * window_seconds
+
+
+def get_batch_id(group: str, window: int) -> str:
+    return f"batch#{group}#{window}"
+
+
+def get_group(batch_id: str) -> str:
+    return batch_id.split("#")[1]
+
+
+def get_index_key(group: str) -> str:
+    return f"open#{group}"
+
+
+def is_abandoned(batch: Optional[dict], now: Optional[float] = None,
+                 takeover_seconds: Optional[float] = None) -> bool:
+    """
+    Check whether a batch is still open well after its window closed, i.e. its leader timed out or crashed before
+    triggering and its waiters would wait on their task tokens until the state times out
+    Args:
+        batch: A batch from BatchStore.get
+        now: Epoch seconds, the current time by default
+        takeover_seconds: Time left to the leader after the window closed, COALESCE_TAKEOVER_SECONDS by default
+
+    Returns:
+        abandoned: A boolean
+    """
+    if not batch or "closed_at" in batch or batch.get("closes_at") is None:
+        return False
+    now = time.time() if now is None else now
+    takeover_seconds = COALESCE_TAKEOVER_SECONDS if takeover_seconds is None else takeover_seconds
+    return now >= float(batch["closes_at"]) + takeover_seconds
+
+
+def merge_terms(waiters: List[dict]) -> List[str]:
+    """
+    Union of the search terms of a batch in arrival order, terms differing only in case or spacing are triggered once
+    Args:
+        waiters: The waiters of a batch
+
+    Returns:
+        terms: The search terms to trigger
+    """
+    terms = {}
+    for waiter in waiters:
+        for term in waiter.get("search_terms", []):
+            terms.setdefault(normalize_term(term), term)
+    return list(terms.values())
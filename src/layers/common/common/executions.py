@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from common import instrumentation, rate_limiter
+
+logger = logging.getLogger()
+
+# StartExecution calls in flight at the same time for one bulk request
+DISPATCH_CONCURRENCY = int(os.getenv("DISPATCH_CONCURRENCY", 10))
+# StartExecution is a token bucket of 800 refilled at 150/s in most regions, staying well under the refill rate leaves
+# room for the other callers of the account
+DISPATCH_RATE_PER_SECOND = float(os.getenv("DISPATCH_RATE_PER_SECOND", 50))
+DISPATCH_MAX_ATTEMPTS = int(os.getenv("DISPATCH_MAX_ATTEMPTS", 6))
+
+THROTTLING_ERRORS = {"ThrottlingException", "TooManyRequestsException", "RequestLimitExceeded",
+                     "ServiceUnavailable", "InternalServerError", "InternalFailure"}
+# Execution names are at most 80 characters of letters, digits, dashes and underscores
+MAX_NAME_LENGTH = 80
+NAME_PATTERN = re.compile(r"[^A-Za-z0-9_-]")
+
+_limiter = None
+_lock = threading.Lock()
+
+
+def get_limiter() -> rate_limiter.RateLimiter:
+    global _limiter
+    with _lock:
+        if _limiter is None:
+            # StartExecution has no token dimension, requests are acquired with 0 tokens
+            _limiter = rate_limiter.RateLimiter(DISPATCH_RATE_PER_SECOND * 60, DISPATCH_RATE_PER_SECOND * 60)
+    return _limiter
+
+
+def get_error_code(error: Exception) -> str:
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") or type(error).__name__
+
+
+def get_execution_name(prefix: str, key: str) -> str:
+    """
+    Get a deterministic execution name, so that sending the same request again starts nothing new
+    Args:
+        prefix: The request the execution belongs to
+        key: What the execution is about, e.g. a normalized URL
+
+    Returns:
+        name: A valid execution name
+    """
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    prefix = NAME_PATTERN.sub("-", prefix)[:MAX_NAME_LENGTH - len(digest) - 1]
+    return f"{prefix}-{digest}"
+
+
+def get_execution_arn(state_machine_arn: str, name: str) -> str:
+    return f"{state_machine_arn.replace(':stateMachine:', ':execution:')}:{name}"
+
+
+def start_execution(client, state_machine_arn: str, name: str, execution_input: dict,
+                    deadline: Optional[float] = None) -> dict:
+    """
+    Start an execution, backing off when Step Functions throttles
+    Args:
+        client: The boto3 Step Functions client
+        state_machine_arn: The state machine
+        name: The execution name
+        execution_input: The execution input
+        deadline: A time.monotonic() value the execution has to start before
+
+    Returns:
+        result: The name with the execution ARN, or with the error when the execution could not be started.
+            already_started is set when an execution of that name had been started before.
+    """
+    limiter = get_limiter()
+    for attempt in range(DISPATCH_MAX_ATTEMPTS):
+        try:
+            limiter.acquire(0, deadline)
+        except rate_limiter.DeadlineExceeded as e:
+            return {"name": name, "error": "DeadlineExceeded", "message": str(e)}
+
+        start = time.monotonic()
+        try:
+            # Starting with the name and input of a running execution returns it, which makes retries idempotent
+            response = client.start_execution(stateMachineArn=state_machine_arn, name=name,
+                                              input=json.dumps(execution_input))
+            limiter.record_call(time.monotonic() - start)
+            return {"name": name, "execution_arn": response["executionArn"]}
+        except Exception as e:
+            limiter.record_call(time.monotonic() - start)
+            code = get_error_code(e)
+            if code == "ExecutionAlreadyExists":
+                # A finished execution, or a running one with another input, keeps the name for 90 days. The name is
+                # derived from the request, so the request was started before and a retry can never succeed.
+                logger.info(f"Execution {name} was already started")
+                return {"name": name, "execution_arn": get_execution_arn(state_machine_arn, name),
+                        "already_started": True}
+            if code not in THROTTLING_ERRORS or attempt == DISPATCH_MAX_ATTEMPTS - 1:
+                logger.error(f"Failed to start execution {name}: {code} {str(e)}")
+                return {"name": name, "error": code, "message": str(e)}
+            delay = rate_limiter.get_backoff_delay(attempt, base=0.2, cap=5.0)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                return {"name": name, "error": "DeadlineExceeded", "message": f"Throttled: {str(e)}"}
+            logger.warning(f"Start of {name} throttled, backing off {delay:.2f}s: {code}")
+            # Every thread of the dispatcher slows down, not only the one that was throttled
+            limiter.pause(delay)
+    return {"name": name, "error": "ThrottlingException", "message": "Throttled"}
+
+
+@instrumentation.timed(records=lambda results: sum(1 for result in results if "execution_arn" in result))
+def start_executions(client, state_machine_arn: str, executions: List[dict],
+                     max_workers: int = DISPATCH_CONCURRENCY, deadline: Optional[float] = None) -> List[dict]:
+    """
+    Start many executions with at most max_workers StartExecution calls in flight
+    Args:
+        client: The boto3 Step Functions client
+        state_machine_arn: The state machine
+        executions: Dicts with the name and the input of every execution
+        max_workers: The StartExecution calls in flight
+        deadline: A time.monotonic() value the executions have to start before
+
+    Returns:
+        results: The result of start_execution per execution, in the order of executions
+    """
+    if not executions:
+        return []
+    workers = max(min(max_workers, len(executions)), 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dispatch") as executor:
+        futures = [executor.submit(start_execution, client, state_machine_arn, execution["name"],
+                                   execution["input"], deadline) for execution in executions]
+        results = [future.result() for future in futures]
+
+    failed = sum(1 for result in results if "error" in result)
+    if failed:
+        instrumentation.record("start_executions", Errors=failed)
+    logger.info("StartExecution stats: %s", json.dumps(get_limiter().stats()))
+    return results
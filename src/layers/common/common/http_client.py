@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import urllib.parse
+from typing import TYPE_CHECKING, Iterable, Optional
+
+from common.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import requests
+else:
+    requests = lazy_import("requests")
+
+logger = logging.getLogger()
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 30))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", 0.5))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 10))
+# HTTP/2 needs httpx with the h2 extra, without them HTTP/1.1 keep-alive sessions are used
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# A POST is only retried on connection errors, before the request reached the server
+IDEMPOTENT_METHODS = frozenset({"DELETE", "GET", "HEAD", "OPTIONS", "PUT"})
+
+_sessions = {}
+_http2_clients = {}
+_lock = threading.Lock()
+
+
+def get_origin(url: str) -> str:
+    parts = urllib.parse.urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_timeout(read_timeout: Optional[float] = None) -> tuple:
+    return HTTP_CONNECT_TIMEOUT, read_timeout or HTTP_READ_TIMEOUT
+
+
+def make_adapter(retries: int, retry_methods: Iterable[str], pool_maxsize: int):
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(retry_methods),
+        respect_retry_after_header=True,
+        # Hand the last response back so callers keep raising HTTPError through raise_for_status
+        raise_on_status=False
+    )
+    return HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+
+
+def get_session(url: str, retries: int = HTTP_MAX_RETRIES, retry_methods: Iterable[str] = IDEMPOTENT_METHODS,
+                pool_maxsize: int = HTTP_POOL_MAXSIZE) -> requests.Session:
+    """
+    Get the pooled session of a host, created once per process so warm invocations reuse its connections
+    Args:
+        url: Any URL on the host
+        retries: Retries on connection errors and retryable statuses, 0 for callers retrying on their own
+        retry_methods: Methods also retried on read errors and retryable statuses
+        pool_maxsize: Connections kept open to the host, at least the number of threads using the session
+
+    Returns:
+        session: A requests session
+    """
+    key = (get_origin(url), retries, frozenset(retry_methods), pool_maxsize)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = make_adapter(retries, retry_methods, pool_maxsize)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[key] = session
+    return session
+
+
+def request(method: str, url: str, timeout=None, retries: int = HTTP_MAX_RETRIES,
+            retry_methods: Iterable[str] = IDEMPOTENT_METHODS, **kwargs) -> requests.Response:
+    """
+    Send a request through the pooled session of the host
+    Args:
+        method: The HTTP method
+        url: The URL
+        timeout: A (connect, read) tuple or a read timeout in seconds, the module defaults otherwise
+        retries: Retries on connection errors and retryable statuses
+        retry_methods: Methods also retried on read errors and retryable statuses
+        kwargs: Passed to requests
+
+    Returns:
+        response: A requests response
+    """
+    if not isinstance(timeout, tuple):
+        timeout = get_timeout(timeout)
+    session = get_session(url, retries=retries, retry_methods=retry_methods)
+    return session.request(method, url, timeout=timeout, **kwargs)
+
+
+def get_http2_client(url: str, read_timeout: Optional[float] = None):
+    """
+    Get a pooled HTTP/2 client for a host when HTTP2_ENABLED is set and httpx[http2] is installed
+    Args:
+        url: Any URL on the host
+        read_timeout: Read timeout in seconds, HTTP_READ_TIMEOUT by default
+
+    Returns:
+        client: An httpx client, or None to fall back to get_session
+    """
+    if not HTTP2_ENABLED:
+        return None
+    key = (get_origin(url), read_timeout)
+    with _lock:
+        if key in _http2_clients:
+            return _http2_clients[key]
+        try:
+            import h2  # noqa: F401
+            import httpx
+        except ImportError:
+            logger.warning("HTTP/2 is enabled but httpx[http2] is not installed, using HTTP/1.1")
+            client = None
+        else:
+            timeout = httpx.Timeout(read_timeout or HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+            transport = httpx.HTTPTransport(http2=True, retries=HTTP_MAX_RETRIES)
+            client = httpx.Client(http2=True, timeout=timeout, transport=transport)
+        _http2_clients[key] = client
+    return client
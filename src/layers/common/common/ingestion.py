@@ -0,0 +1,284 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, List
+
+from common import http_client, instrumentation, rate_limiter
+from common.lazy import lazy_import
+
+# Only the error types are read, from the except clauses of post_batch once a batch is sent
+requests = lazy_import("requests")
+
+logger = logging.getLogger()
+
+MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", 512 * 1024))
+MAX_BATCH_RECORDS = int(os.getenv("MAX_BATCH_RECORDS", 500))
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", 4))
+MAX_ATTEMPTS = int(os.getenv("MAX_ATTEMPTS", 3))
+COMPRESS_BATCHES = os.getenv("COMPRESS_BATCHES", "true").lower() == "true"
+REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", 30))
+# Batches built but not yet accepted by the ingestion API when streaming, which bounds the records held in memory
+MAX_IN_FLIGHT_BATCHES = int(os.getenv("MAX_IN_FLIGHT_BATCHES", 2 * MAX_WORKERS))
+# Failed batches and request IDs listed in the output, which travels in the 256 KB Step Functions state
+MAX_REPORTED_BATCHES = int(os.getenv("MAX_REPORTED_BATCHES", 20))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def get_idempotency_key(post_ids: List[str]) -> str:
+    """
+    Derive a stable key for a batch so the ingestion API can drop replays of the same posts
+    Args:
+        post_ids: The post IDs in the batch
+
+    Returns:
+        key: A hex digest
+    """
+    return hashlib.sha256("\n".join(sorted(post_ids)).encode("utf-8")).hexdigest()
+
+
+def make_batch(index: int, post_ids: List[str], lines: List[str]) -> dict:
+    body = f"[{','.join(lines)}]".encode("utf-8")
+    return {
+        "index": index,
+        "post_ids": post_ids,
+        "bytes": len(body),
+        "body": gzip.compress(body) if COMPRESS_BATCHES else body,
+        "idempotency_key": get_idempotency_key(post_ids)
+    }
+
+
+def iter_batches(posts: Iterable[dict], max_bytes: int = MAX_BATCH_BYTES,
+                 max_records: int = MAX_BATCH_RECORDS) -> Iterator[dict]:
+    """
+    Split posts into batches bounded by their serialized size and record count
+    Args:
+        posts: An iterable of posts
+        max_bytes: Maximum uncompressed size of a batch body
+        max_records: Maximum number of posts in a batch
+
+    Returns:
+        batches: An iterator of batch dicts with a ready-to-send body
+    """
+    post_ids, lines, size = [], [], 2
+    index = 0
+    for post in posts:
+        line = json.dumps(post, default=str)
+        if lines and (size + len(line) + 1 > max_bytes or len(lines) >= max_records):
+            yield make_batch(index, post_ids, lines)
+            index += 1
+            post_ids, lines, size = [], [], 2
+        post_ids.append(str(post.get("post_id", "")))
+        lines.append(line)
+        size += len(line) + 1
+    if lines:
+        yield make_batch(index, post_ids, lines)
+
+
+@instrumentation.timed(records=lambda result: result["records"], payload_bytes=lambda result: result["sent_bytes"])
+def post_batch(ingestion_url: str, batch: dict) -> dict:
+    """
+    Send one batch to the ingestion API
+    Args:
+        ingestion_url: The ingestion endpoint
+        batch: A batch from iter_batches
+
+    Returns:
+        result: A dict describing the outcome of the batch
+    """
+    headers = {
+        'Content-Type': 'application/json',
+        'Idempotency-Key': batch["idempotency_key"]
+    }
+    if COMPRESS_BATCHES:
+        headers['Content-Encoding'] = 'gzip'
+
+    result = {
+        "index": batch["index"],
+        "records": len(batch["post_ids"]),
+        "bytes": batch["bytes"],
+        "sent_bytes": len(batch["body"]),
+        "idempotency_key": batch["idempotency_key"]
+    }
+    # Failed batches are retried by the callers, the session only pools connections for the worker threads
+    session = http_client.get_session(ingestion_url, retries=0, pool_maxsize=MAX_WORKERS)
+    start = time.perf_counter()
+    response = None
+    try:
+        response = session.post(ingestion_url, data=batch["body"], headers=headers,
+                                timeout=http_client.get_timeout(REQUEST_TIMEOUT))
+        result["status_code"] = response.status_code
+        response.raise_for_status()
+        try:
+            body = response.json()
+            result["request_id"] = body.get("request_id") if isinstance(body, dict) else None
+        except requests.exceptions.JSONDecodeError as e:
+            logger.warning(f"Unable to parse response to JSON: {str(e)}")
+        result["status"] = "success"
+    except requests.exceptions.RequestException as e:
+        status_code = result.get("status_code")
+        logger.error(f"Error while ingesting batch {batch['index']}: {str(e)}")
+        result["status"] = "failed"
+        result["error"] = str(e)
+        result["retryable"] = status_code is None or status_code in RETRYABLE_STATUS_CODES
+        retry_after = rate_limiter.get_retry_after(response.headers if response is not None else None)
+        if retry_after is not None:
+            result["retry_after"] = retry_after
+    result["duration_ms"] = round((time.perf_counter() - start) * 1000)
+    return result
+
+
+@instrumentation.timed()
+def send_batches(ingestion_url: str, batches: List[dict]) -> List[dict]:
+    """
+    Send batches concurrently, retrying only the batches that failed with a retryable error
+    Args:
+        ingestion_url: The ingestion endpoint
+        batches: Batches from iter_batches
+
+    Returns:
+        results: The final result of every batch, ordered by batch index
+    """
+    results = {}
+    pending = batches
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            outcomes = list(executor.map(lambda batch: post_batch(ingestion_url, batch), pending))
+
+        for outcome in outcomes:
+            outcome["attempts"] = attempt
+            results[outcome["index"]] = outcome
+
+        pending = [batch for batch, outcome in zip(pending, outcomes)
+                   if outcome["status"] == "failed" and outcome["retryable"]]
+        if not pending:
+            break
+        if attempt < MAX_ATTEMPTS:
+            # Never sooner than the longest Retry-After of the API
+            retry_after = max((outcome["retry_after"] for outcome in outcomes if "retry_after" in outcome),
+                              default=None)
+            delay = rate_limiter.get_backoff_delay(attempt - 1, retry_after)
+            logger.warning(f"Retrying {len(pending)} failed batch(es) in {delay:.2f}s, attempt {attempt + 1} of "
+                           f"{MAX_ATTEMPTS}")
+            time.sleep(delay)
+
+    return [results[index] for index in sorted(results)]
+
+
+@instrumentation.timed()
+def stream_batches(ingestion_url: str, batches: Iterable[dict], max_workers: int = MAX_WORKERS,
+                   max_in_flight: int = MAX_IN_FLIGHT_BATCHES) -> List[dict]:
+    """
+    Send batches while they are being produced. A batch is pulled from `batches` only when the in-flight window has
+    room, so a generator upstream (download, parse, clean) runs at the pace the ingestion API accepts. A retryable
+    failure halves the window and holds new sends for the Retry-After of the API, every success widens it by one.
+    Args:
+        ingestion_url: The ingestion endpoint
+        batches: An iterable of batches from iter_batches, consumed lazily
+        max_workers: Concurrent requests
+        max_in_flight: Batches sent or waiting for a retry at the same time
+
+    Returns:
+        results: The final result of every batch, ordered by batch index
+    """
+    results = {}
+    batches = iter(batches)
+    exhausted = False
+    window = max(max_in_flight, 1)
+    paused_until = 0.0
+    retries = deque()
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while len(in_flight) < window and time.monotonic() >= paused_until:
+                if retries:
+                    batch, attempt = retries.popleft()
+                elif not exhausted:
+                    batch, attempt = next(batches, None), 1
+                    if batch is None:
+                        exhausted = True
+                        break
+                else:
+                    break
+                in_flight[executor.submit(post_batch, ingestion_url, batch)] = (batch, attempt)
+
+            if not in_flight:
+                if exhausted and not retries:
+                    break
+                # Paused by the API with nothing left to wait for
+                time.sleep(max(paused_until - time.monotonic(), 0))
+                continue
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch, attempt = in_flight.pop(future)
+                outcome = future.result()
+                outcome["attempts"] = attempt
+                if outcome["status"] == "failed" and outcome["retryable"] and attempt < MAX_ATTEMPTS:
+                    window = max(window // 2, 1)
+                    delay = rate_limiter.get_backoff_delay(attempt - 1, outcome.get("retry_after"))
+                    paused_until = max(paused_until, time.monotonic() + delay)
+                    logger.warning(f"Ingestion API pushed back on batch {batch['index']}, window {window}, "
+                                   f"retrying in {delay:.2f}s")
+                    retries.append((batch, attempt + 1))
+                    continue
+                if outcome["status"] == "success":
+                    window = min(window + 1, max(max_in_flight, 1))
+                results[outcome["index"]] = outcome
+
+    return [results[index] for index in sorted(results)]
+
+
+def summarize(results: List[dict], duration: float, max_reported: int = MAX_REPORTED_BATCHES) -> dict:
+    """
+    Summarize the batches of a run. Only the counts and the first failed batches are kept, so the summary does not
+    grow with the snapshot.
+    Args:
+        results: The result of every batch
+        duration: Seconds spent sending
+        max_reported: Failed batches listed in failed_batch_results
+
+    Returns:
+        summary: A dict of counts and failed batch results
+    """
+    records = sum(result["records"] for result in results)
+    failed = [result for result in results if result["status"] == "failed"]
+    return {
+        "records": records,
+        "batches": len(results),
+        "failed_batches": len(failed),
+        "failed_records": sum(result["records"] for result in failed),
+        "bytes": sum(result["bytes"] for result in results),
+        "sent_bytes": sum(result["sent_bytes"] for result in results),
+        "duration_ms": round(duration * 1000),
+        "records_per_second": round(records / duration, 2) if duration > 0 else 0,
+        "failed_batch_results": [{key: result[key] for key in ("index", "records", "attempts", "status_code", "error")
+                                  if key in result} for result in failed[:max_reported]]
+    }
+
+
+def make_response(results: List[dict], summary: dict) -> dict:
+    """
+    Build the ingestion output handed to the notification step
+    Args:
+        results: The result of every batch
+        summary: The summary of the run
+
+    Returns:
+        output: The response of the ingestion API and the summary
+    """
+    request_ids = [result["request_id"] for result in results if result.get("request_id")][:MAX_REPORTED_BATCHES]
+    return {
+        "response": {
+            "status": "partial" if summary["failed_batches"] else "success",
+            "message": "Records sent for ingestion",
+            "request_id": request_ids[0] if request_ids else None,
+            "request_ids": request_ids
+        },
+        "summary": summary
+    }
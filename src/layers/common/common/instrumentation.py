@@ -0,0 +1,236 @@
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+logger = logging.getLogger()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "Tapestry/Collection")
+FUNCTION_NAME = os.getenv("AWS_LAMBDA_FUNCTION_NAME", "local")
+# Events are logged as a bounded preview, LOG_EVENT_SAMPLE_RATE of the invocations log them whole
+LOG_EVENT_MAX_BYTES = int(os.getenv("LOG_EVENT_MAX_BYTES", 2048))
+LOG_EVENT_SAMPLE_RATE = float(os.getenv("LOG_EVENT_SAMPLE_RATE", 0))
+
+# CloudWatch accepts at most 100 values per metric in one EMF document
+EMF_MAX_VALUES = 100
+
+PREVIEW_ITEMS = 3
+PREVIEW_STRING_CHARS = 200
+PREVIEW_DEPTH = 4
+
+UNITS = {
+    "Duration": "Milliseconds",
+    "PayloadBytes": "Bytes",
+    "Records": "Count",
+    "Errors": "Count",
+    "TokensIn": "Count",
+    "TokensOut": "Count"
+}
+
+
+def preview(value, depth: int = PREVIEW_DEPTH):
+    """
+    Bounded copy of a JSON value: long lists keep their first items and their length, long strings are cut.
+    Building it costs the size of the preview, not of the value.
+    """
+    if isinstance(value, str):
+        return value if len(value) <= PREVIEW_STRING_CHARS else f"{value[:PREVIEW_STRING_CHARS]}... ({len(value)} chars)"
+    if depth == 0 and isinstance(value, (dict, list)):
+        return f"<{type(value).__name__} of {len(value)}>"
+    if isinstance(value, dict):
+        return {key: preview(item, depth - 1) for key, item in value.items()}
+    if isinstance(value, list):
+        items = [preview(item, depth - 1) for item in value[:PREVIEW_ITEMS]]
+        if len(value) > PREVIEW_ITEMS:
+            items.append(f"... {len(value) - PREVIEW_ITEMS} more item(s)")
+        return items
+    return value
+
+
+def log_event(event, max_bytes: int = LOG_EVENT_MAX_BYTES, sample_rate: float = LOG_EVENT_SAMPLE_RATE) -> None:
+    """
+    Log the event of an invocation without serializing a large payload
+    Args:
+        event: The Lambda event
+        max_bytes: Maximum size of the logged preview
+        sample_rate: Fraction of the invocations logging the whole event
+    """
+    if sample_rate and random.random() < sample_rate:
+        logger.info("Event received: %s", json.dumps(event, default=str))
+        return
+    logged = json.dumps(preview(event), default=str)
+    if len(logged) > max_bytes:
+        logged = f"{logged[:max_bytes]}... (truncated)"
+    logger.info("Event received: %s", logged)
+
+
+def get_records(result) -> Optional[int]:
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict) and isinstance(result.get("count"), int):
+        return result["count"]
+    if hasattr(result, "shape") and hasattr(result, "columns"):
+        return len(result)
+    return None
+
+
+def get_payload_bytes(result) -> Optional[int]:
+    if isinstance(result, (str, bytes)):
+        return len(result)
+    if hasattr(result, "memory_usage") and hasattr(result, "columns"):
+        # Shallow usage, deep=True would walk every string of the frame
+        return int(result.memory_usage(index=False).sum())
+    return None
+
+
+class MetricsBuffer:
+    """
+    Metric values of the current invocation, written as one EMF document per stage when the handler returns
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = defaultdict(lambda: defaultdict(list))
+        self.collectors: List[list] = []
+        self.handlers = 0
+
+    def record(self, stage: str, **metrics) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self.lock:
+            for name, value in metrics.items():
+                if value is not None:
+                    self.values[stage][name].append(value)
+            flush = self.handlers == 0
+        # Outside a handler, e.g. in a benchmark, there is no end of invocation to wait for
+        if flush:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            values, self.values = self.values, defaultdict(lambda: defaultdict(list))
+            collectors = list(self.collectors)
+
+        for stage, metrics in values.items():
+            for document in make_documents(stage, metrics):
+                if collectors:
+                    for collector in collectors:
+                        collector.append(document)
+                else:
+                    # EMF is read from stdout, a logging prefix would stop CloudWatch from parsing it
+                    print(json.dumps(document), flush=True)
+
+
+def make_documents(stage: str, metrics: dict) -> List[dict]:
+    documents = []
+    longest = max(len(values) for values in metrics.values())
+    for start in range(0, longest, EMF_MAX_VALUES):
+        chunk = {name: values[start:start + EMF_MAX_VALUES] for name, values in metrics.items()}
+        chunk = {name: values for name, values in chunk.items() if values}
+        documents.append({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Function", "Stage"]],
+                    "Metrics": [{"Name": name, "Unit": UNITS.get(name, "None")} for name in chunk]
+                }]
+            },
+            "Function": FUNCTION_NAME,
+            "Stage": stage,
+            **{name: values if len(values) > 1 else values[0] for name, values in chunk.items()}
+        })
+    return documents
+
+
+buffer = MetricsBuffer()
+
+
+def record(stage: str, **metrics) -> None:
+    """
+    Record metric values for a stage, e.g. record("post_batch", Duration=12.5, Records=500)
+    """
+    buffer.record(stage, **metrics)
+
+
+def timed(stage: Optional[str] = None, records: Optional[Callable] = None, payload_bytes: Optional[Callable] = None):
+    """
+    Decorator recording the duration of a function, plus the record count and payload size of its result
+    Args:
+        stage: The Stage dimension, the function name by default
+        records: Callable returning the record count of the result, inferred for lists, frames and claim checks
+        payload_bytes: Callable returning the payload size of the result, inferred for strings, bytes and frames
+
+    Returns:
+        decorator: A function decorator
+    """
+
+    def decorator(fn):
+        name = stage or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                record(name, Duration=round((time.perf_counter() - start) * 1000, 3), Errors=1)
+                raise
+            duration = round((time.perf_counter() - start) * 1000, 3)
+            try:
+                count = records(result) if records else get_records(result)
+                size = payload_bytes(result) if payload_bytes else get_payload_bytes(result)
+            except Exception:
+                count = size = None
+            record(name, Duration=duration, Records=count, PayloadBytes=size)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def handler(fn):
+    """
+    Decorator for lambda_handler: times the invocation and flushes the metrics recorded during it
+    """
+    timed_fn = timed("lambda_handler")(fn)
+
+    @functools.wraps(fn)
+    def wrapper(event, context):
+        with buffer.lock:
+            buffer.handlers += 1
+        try:
+            return timed_fn(event, context)
+        finally:
+            with buffer.lock:
+                buffer.handlers -= 1
+            buffer.flush()
+
+    return wrapper
+
+
+@contextmanager
+def collect():
+    """
+    Capture the EMF documents instead of printing them, for tests and local runs
+
+    Returns:
+        documents: The list the documents are appended to
+    """
+    documents = []
+    with buffer.lock:
+        buffer.collectors.append(documents)
+    try:
+        yield documents
+    finally:
+        buffer.flush()
+        with buffer.lock:
+            buffer.collectors.remove(documents)
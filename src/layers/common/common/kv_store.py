@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from common import rate_limiter
+
+logger = logging.getLogger()
+
+DYNAMODB_ENDPOINT_URL = os.getenv("DYNAMODB_ENDPOINT_URL", None)
+
+# DynamoDB rejects items over 400 KB, leave room for the key and attributes
+DYNAMODB_MAX_VALUE_BYTES = 380 * 1024
+# BatchGetItem calls per group of keys, the keys DynamoDB still leaves unprocessed after the last one read as missing
+DYNAMODB_MAX_BATCH_ATTEMPTS = int(os.getenv("DYNAMODB_MAX_BATCH_ATTEMPTS", 5))
+# First delay before asking again for unprocessed keys, doubled with every attempt
+DYNAMODB_BACKOFF_BASE = float(os.getenv("DYNAMODB_BACKOFF_BASE", 0.05))
+
+
+class KeyValueStore(ABC):
+    """
+    A small JSON key-value store with per-entry expiry, implemented by the backends below
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, value: dict, ttl: Optional[int] = None) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    def get_many(self, keys: List[str]) -> Dict[str, dict]:
+        values = {key: self.get(key) for key in keys}
+        return {key: value for key, value in values.items() if value is not None}
+
+    def put_many(self, values: Dict[str, dict], ttl: Optional[int] = None) -> None:
+        for key, value in values.items():
+            self.put(key, value, ttl=ttl)
+
+
+class MemoryStore(KeyValueStore):
+    """
+    Process-local store, for tests and local runs
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self.entries[key]
+                return None
+            # Re-insert so dict order doubles as the least recently used order
+            self.entries[key] = self.entries.pop(key)
+            return value
+
+    def put(self, key, value, ttl=None):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, time.time() + ttl if ttl else None)
+            while self.max_entries and len(self.entries) > self.max_entries:
+                del self.entries[next(iter(self.entries))]
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class SQLiteStore(KeyValueStore):
+    """
+    Local file store with least recently used eviction once max_entries or max_bytes is exceeded
+    """
+
+    def __init__(self, path: str, max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.connection.commit()
+                return None
+            self.connection.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+        return json.loads(value)
+
+    def put(self, key, value, ttl=None):
+        now = time.time()
+        serialized = json.dumps(value)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, serialized, len(serialized), now + ttl if ttl else None, now)
+            )
+            self.evict(now)
+            self.connection.commit()
+
+    def delete(self, key):
+        with self.lock:
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.connection.commit()
+
+    def evict(self, now: float) -> None:
+        self.connection.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        if self.max_entries:
+            self.connection.execute(
+                "DELETE FROM entries WHERE key IN "
+                "(SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        if self.max_bytes:
+            rows = self.connection.execute("SELECT key, size FROM entries ORDER BY accessed_at DESC").fetchall()
+            total, evicted = 0, []
+            for key, size in rows:
+                total += size
+                if total > self.max_bytes:
+                    evicted.append((key,))
+            self.connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+
+class DynamoDBStore(KeyValueStore):
+    """
+    DynamoDB table keyed on `pk`, with the table's TTL attribute set to `expires_at`
+    """
+
+    def __init__(self, table_name: str):
+        if not table_name:
+            raise ValueError("DynamoDB table name is missing")
+        import boto3
+
+        self.table_name = table_name
+        self.table = boto3.resource("dynamodb", endpoint_url=DYNAMODB_ENDPOINT_URL).Table(table_name)
+
+    def get(self, key):
+        item = self.table.get_item(Key={"pk": key}).get("Item")
+        return self.load(item)
+
+    def put(self, key, value, ttl=None):
+        serialized = json.dumps(value)
+        if len(serialized) > DYNAMODB_MAX_VALUE_BYTES:
+            logger.warning(f"Skipping {key}: {len(serialized)} bytes is over the DynamoDB item limit")
+            return
+        item = {"pk": key, "value": serialized}
+        if ttl:
+            item["expires_at"] = int(time.time() + ttl)
+        self.table.put_item(Item=item)
+
+    def delete(self, key):
+        self.table.delete_item(Key={"pk": key})
+
+    def get_many(self, keys):
+        values = {}
+        unique_keys = list(dict.fromkeys(keys))
+        # BatchGetItem accepts at most 100 keys per call
+        for start in range(0, len(unique_keys), 100):
+            request = {self.table_name: {"Keys": [{"pk": key} for key in unique_keys[start:start + 100]]}}
+            for attempt in range(DYNAMODB_MAX_BATCH_ATTEMPTS):
+                if attempt:
+                    # Unprocessed keys mean the table is throttled, asking again at once would be throttled too
+                    time.sleep(rate_limiter.get_backoff_delay(attempt - 1, base=DYNAMODB_BACKOFF_BASE, cap=2.0))
+                response = self.table.meta.client.batch_get_item(RequestItems=request)
+                for item in response.get("Responses", {}).get(self.table_name, []):
+                    value = self.load(item)
+                    if value is not None:
+                        values[item["pk"]] = value
+                request = response.get("UnprocessedKeys")
+                if not request:
+                    break
+            else:
+                unprocessed = len(request[self.table_name]["Keys"])
+                logger.warning(f"{unprocessed} key(s) of {self.table_name} still unprocessed after "
+                               f"{DYNAMODB_MAX_BATCH_ATTEMPTS} attempts, reading them as missing")
+        return values
+
+    def put_many(self, values, ttl=None):
+        expires_at = int(time.time() + ttl) if ttl else None
+        # batch_writer groups the puts into BatchWriteItem calls and resends unprocessed items
+        with self.table.batch_writer(overwrite_by_pkeys=["pk"]) as batch:
+            for key, value in values.items():
+                item = {"pk": key, "value": json.dumps(value)}
+                if expires_at is not None:
+                    item["expires_at"] = expires_at
+                batch.put_item(Item=item)
+
+    @staticmethod
+    def load(item: Optional[dict]) -> Optional[dict]:
+        if item is None:
+            return None
+        # TTL deletion is lazy, so expired items can still be read for a while
+        expires_at = item.get("expires_at")
+        if expires_at is not None and int(expires_at) <= time.time():
+            return None
+        return json.loads(item["value"])
+
+
+def create_store(backend: str, table: str = "", path: str = "", max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None) -> Optional[KeyValueStore]:
+    """
+    Create a store for the configured backend
+    Args:
+        backend: One of 'none', 'memory', 'sqlite' or 'dynamodb'
+        table: The DynamoDB table name
+        path: The SQLite database path
+        max_entries: Entry limit for the local backends
+        max_bytes: Size limit for the SQLite backend
+
+    Returns:
+        store: A KeyValueStore, or None when the backend is disabled
+    """
+    backend = (backend or "none").lower()
+    if backend == "none":
+        return None
+    if backend == "memory":
+        return MemoryStore(max_entries=max_entries)
+    if backend == "sqlite":
+        return SQLiteStore(path, max_entries=max_entries, max_bytes=max_bytes)
+    if backend == "dynamodb":
+        return DynamoDBStore(table)
+    raise ValueError(f"Unsupported store backend: {backend}")
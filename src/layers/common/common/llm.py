@@ -0,0 +1,93 @@
+import json
+import logging
+import os
+import time
+
+from common import instrumentation, llm_cache, rate_limiter
+from common.lazy import lazy_import
+
+# The SDK and its client are created on the first completion rather than at import time
+openai = lazy_import("openai")
+
+logger = logging.getLogger()
+
+MODEL = "gpt-4o"
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 500))
+OPENAI_TOKENS_PER_MINUTE = float(os.getenv("OPENAI_TOKENS_PER_MINUTE", 30_000))
+# At least one call, every attempt either returns the completion or raises
+OPENAI_MAX_ATTEMPTS = max(int(os.getenv("OPENAI_MAX_ATTEMPTS", 6)), 1)
+
+_client = None
+
+limiter = rate_limiter.RateLimiter(OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE)
+
+
+def get_client():
+    global _client
+    if _client is None:
+        # Retries are handled by the limiter so the SDK does not retry on its own
+        _client = openai.OpenAI(
+            api_key=os.environ.get("API_KEY"),
+            max_retries=0,
+        )
+    return _client
+
+
+# Rough token estimate of a request, ~4 characters per token plus the completion budget
+def estimate_tokens(messages, max_tokens):
+    return sum(len(message["content"]) for message in messages) / 4 + max_tokens
+
+
+# Function to get OpenAI completion with caching, rate limiting and retry logic
+@instrumentation.timed()
+def get_openai_completion(prompt, max_tokens=200, temperature=0.7, deadline=None):
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+    params = dict(max_tokens=max_tokens, n=1, stop=None, temperature=temperature)
+
+    cache = llm_cache.get_cache()
+    cache_key = llm_cache.get_cache_key(MODEL, messages, params)
+    if cache is not None:
+        content = cache.get(cache_key)
+        if content is not None:
+            logger.info("Completion served from the LLM cache")
+            return content
+
+    tokens = estimate_tokens(messages, max_tokens)
+    for attempt in range(OPENAI_MAX_ATTEMPTS):
+        limiter.acquire(tokens, deadline)
+        options = {"timeout": max(deadline - time.monotonic(), 0)} if deadline is not None else {}
+        start = time.monotonic()
+        try:
+            response = get_client().chat.completions.create(model=MODEL, messages=messages, **params, **options)
+            limiter.record_call(time.monotonic() - start)
+            content = response.choices[0].message.content
+            break
+        except openai.RateLimitError as e:
+            limiter.record_call(time.monotonic() - start)
+            retry_after = rate_limiter.get_retry_after(e.response.headers if e.response is not None else None)
+            delay = rate_limiter.get_backoff_delay(attempt, retry_after)
+            if attempt == OPENAI_MAX_ATTEMPTS - 1:
+                logger.error("Rate limit exceeded after %d attempts", OPENAI_MAX_ATTEMPTS)
+                raise e
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise rate_limiter.DeadlineExceeded("Rate limit backoff would exceed the deadline") from e
+            logger.warning("Rate limit exceeded. Retrying in %.1f seconds... %s", delay, str(e))
+            limiter.pause(delay)
+        except openai.OpenAIError as e:
+            limiter.record_call(time.monotonic() - start)
+            logger.error("Error in fetching response: %s", str(e), exc_info=True)
+            raise e
+
+    if cache is not None and content:
+        cache.put(cache_key, content)
+    return content
+
+
+def log_stats():
+    logger.info("OpenAI rate limiter stats: %s", json.dumps(limiter.stats()))
+    llm_cache.log_stats()
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+from common import kv_store
+
+logger = logging.getLogger()
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "none")
+LLM_CACHE_TABLE = os.getenv("LLM_CACHE_TABLE", "")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "/tmp/llm_cache.sqlite3")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10_000))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+
+
+def get_cache_key(model: str, messages: list, params: dict) -> str:
+    """
+    Content address of a completion request
+    Args:
+        model: The model name
+        messages: The chat messages
+        params: The completion parameters
+
+    Returns:
+        key: A hex digest
+    """
+    request = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True)
+    return f"completion#{hashlib.sha256(request.encode('utf-8')).hexdigest()}"
+
+
+class LLMCache:
+    """
+    Completion cache on top of a KeyValueStore, counting hits and misses
+    """
+
+    def __init__(self, store: kv_store.KeyValueStore, ttl: int = LLM_CACHE_TTL_SECONDS):
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            entry = self.store.get(key)
+        except Exception as e:
+            # A broken cache must never fail the completion itself
+            logger.warning(f"LLM cache read failed: {str(e)}")
+            entry = None
+            with self.lock:
+                self.errors += 1
+
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry["content"]
+
+    def put(self, key: str, content: str) -> None:
+        try:
+            self.store.put(key, {"content": content}, ttl=self.ttl)
+        except Exception as e:
+            logger.warning(f"LLM cache write failed: {str(e)}")
+            with self.lock:
+                self.errors += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[LLMCache]:
+    """
+    Get the process-wide cache for the configured backend, or None when caching is disabled
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            store = kv_store.create_store(
+                LLM_CACHE_BACKEND,
+                table=LLM_CACHE_TABLE,
+                path=LLM_CACHE_PATH,
+                max_entries=LLM_CACHE_MAX_ENTRIES,
+                max_bytes=LLM_CACHE_MAX_BYTES
+            )
+            if store is None:
+                return None
+            _cache = LLMCache(store)
+        return _cache
+
+
+def log_stats() -> None:
+    cache = get_cache()
+    if cache is not None:
+        logger.info("LLM cache stats: %s", json.dumps(cache.stats()))
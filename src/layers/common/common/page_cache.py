@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from common import kv_store
+
+logger = logging.getLogger()
+
+PAGE_CACHE_BACKEND = os.getenv("PAGE_CACHE_BACKEND", "none")
+PAGE_CACHE_TABLE = os.getenv("PAGE_CACHE_TABLE", "")
+PAGE_CACHE_PATH = os.getenv("PAGE_CACHE_PATH", "/tmp/page_cache.sqlite3")
+PAGE_CACHE_TTL_SECONDS = int(os.getenv("PAGE_CACHE_TTL_SECONDS", 30 * 24 * 60 * 60))
+
+_store = None
+
+
+def get_store() -> Optional[kv_store.KeyValueStore]:
+    global _store
+    if _store is None:
+        _store = kv_store.create_store(PAGE_CACHE_BACKEND, table=PAGE_CACHE_TABLE, path=PAGE_CACHE_PATH)
+    return _store
+
+
+def get_key(url: str) -> str:
+    return f"page#{hashlib.sha256(url.encode('utf-8')).hexdigest()}"
+
+
+def get_fingerprint(*content) -> str:
+    """
+    Hash of the extracted page content, stable across markup-only changes like rotating tokens
+    """
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_entry(url: str) -> Optional[dict]:
+    """
+    Get what is known about a URL from the previous collections
+    Args:
+        url: The product page URL
+
+    Returns:
+        entry: A dict with the validators, the fingerprint and the reusable results, or None
+    """
+    store = get_store()
+    if store is None or not url:
+        return None
+    try:
+        return store.get(get_key(url))
+    except Exception as e:
+        logger.warning(f"Page cache read failed: {str(e)}")
+        return None
+
+
+def get_conditional_headers(entry: Optional[dict]) -> dict:
+    """
+    Headers turning the page download into a conditional request
+    """
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def save_fetch(url: str, etag: Optional[str], last_modified: Optional[str], fingerprint: str,
+               previous: Optional[dict] = None) -> None:
+    """
+    Store the validators and fingerprint of a download, keeping the results only if the content did not change
+    """
+    store = get_store()
+    if store is None:
+        return
+    unchanged = previous is not None and previous.get("fingerprint") == fingerprint
+    entry = {
+        "url": url,
+        "etag": etag,
+        "last_modified": last_modified,
+        "fingerprint": fingerprint,
+        "fetched_at": int(time.time()),
+        "results": previous.get("results") if unchanged else None
+    }
+    try:
+        store.put(get_key(url), entry, ttl=PAGE_CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"Page cache write failed: {str(e)}")
+
+
+def save_results(url: str, fingerprint: str, results: dict) -> None:
+    """
+    Attach the summary and keywords produced for a page version, so the next unchanged download can reuse them
+    """
+    entry = get_entry(url)
+    if entry is None or entry.get("fingerprint") != fingerprint:
+        logger.info("Page changed since it was scraped, not caching its results")
+        return
+    entry["results"] = results
+    try:
+        get_store().put(get_key(url), entry, ttl=PAGE_CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"Page cache write failed: {str(e)}")
@@ -0,0 +1,201 @@
+import email.utils
+import logging
+import random
+import re
+import threading
+import time
+from datetime import timezone
+from typing import Mapping, Optional
+
+logger = logging.getLogger()
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class TokenBucket:
+    """
+    Bucket refilled continuously at `rate_per_minute`, holding at most a minute worth of tokens
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60
+        self.tokens = rate_per_minute
+        self.updated_at = time.monotonic()
+
+    def take(self, amount: float) -> float:
+        """
+        Take tokens if there are enough of them
+        Args:
+            amount: The number of tokens
+
+        Returns:
+            wait: 0 when the tokens were taken, otherwise the seconds until there will be enough
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Client-side limiter for requests/min and tokens/min, shared by the threads of a Lambda container
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.metrics = {"calls": 0, "throttled": 0, "wait_seconds": 0.0, "call_seconds": 0.0}
+
+    def acquire(self, tokens: float, deadline: Optional[float] = None) -> float:
+        """
+        Block until a request of `tokens` tokens fits in both buckets
+        Args:
+            tokens: The estimated tokens of the request
+            deadline: A time.monotonic() value the request has to start before
+
+        Returns:
+            waited: The seconds spent waiting
+        """
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0:
+                    wait = self.requests.take(1)
+                    if wait == 0:
+                        wait = self.tokens.take(tokens)
+                        if wait > 0:
+                            # Give the request token back, both buckets are taken together
+                            self.requests.tokens += 1
+                if wait <= 0:
+                    waited = now - start
+                    self.metrics["wait_seconds"] += waited
+                    return waited
+
+            if deadline is not None and time.monotonic() + wait >= deadline:
+                with self.lock:
+                    self.metrics["wait_seconds"] += time.monotonic() - start
+                raise DeadlineExceeded(f"Rate limit wait of {wait:.1f}s would exceed the deadline")
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold back every request of this limiter, used when the API asks us to slow down
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.metrics["throttled"] += 1
+
+    def record_call(self, seconds: float) -> None:
+        with self.lock:
+            self.metrics["calls"] += 1
+            self.metrics["call_seconds"] += seconds
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {key: round(value, 3) if isinstance(value, float) else value
+                    for key, value in self.metrics.items()}
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """
+    Parse durations like '20ms', '1.5s' or '6m0s' used by the rate limit reset headers
+    """
+    parts = DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def get_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """
+    Read how long the server wants us to wait from the Retry-After and rate limit headers
+    Args:
+        headers: The response headers
+
+    Returns:
+        retry_after: Seconds to wait, None when the server did not say
+    """
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                retry_at = email.utils.parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                # Neither seconds nor an HTTP date, the computed backoff applies
+                logger.warning(f"Ignoring malformed Retry-After: {retry_after}")
+                retry_at = None
+            if retry_at is not None:
+                if retry_at.tzinfo is None:
+                    # -0000 dates are naive, they are UTC all the same
+                    retry_at = retry_at.replace(tzinfo=timezone.utc)
+                return max(retry_at.timestamp() - time.time(), 0.0)
+
+    resets = [parse_duration(headers.get(header, "")) for header in
+              ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def get_backoff_delay(attempt: int, retry_after: Optional[float] = None, base: float = 1.0,
+                      cap: float = 30.0) -> float:
+    """
+    Exponential backoff with full jitter, never shorter than what the server asked for
+    Args:
+        attempt: The number of failed attempts so far, starting at 0
+        retry_after: Seconds the server asked us to wait
+        base: The delay of the first retry
+        cap: The longest delay
+
+    Returns:
+        delay: Seconds to wait
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        # Spread the clients that got the same Retry-After so they do not come back together
+        delay = retry_after + random.uniform(0, min(cap, base * 2 ** attempt) / 2)
+    return delay
+
+
+def deadline_from_context(context, margin_ms: int = 2000, cap_seconds: Optional[float] = None) -> float:
+    """
+    Deadline of an invocation as a time.monotonic() value
+    Args:
+        context: The Lambda context
+        margin_ms: Time kept to return a response before the Lambda is cut off
+        cap_seconds: Upper bound, e.g. a state timeout shorter than the Lambda timeout
+
+    Returns:
+        deadline: A time.monotonic() value
+    """
+    remaining = (context.get_remaining_time_in_millis() - margin_ms) / 1000
+    if cap_seconds is not None:
+        remaining = min(remaining, cap_seconds)
+    return time.monotonic() + max(remaining, 0)
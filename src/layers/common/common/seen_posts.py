@@ -0,0 +1,69 @@
+import logging
+import os
+from typing import Iterable, Optional, Set
+
+from common import kv_store
+
+logger = logging.getLogger()
+
+SEEN_POSTS_BACKEND = os.getenv("SEEN_POSTS_BACKEND", "none")
+SEEN_POSTS_TABLE = os.getenv("SEEN_POSTS_TABLE", "")
+SEEN_POSTS_PATH = os.getenv("SEEN_POSTS_PATH", "/tmp/seen_posts.sqlite3")
+SEEN_POSTS_TTL_SECONDS = int(os.getenv("SEEN_POSTS_TTL_SECONDS", 90 * 24 * 60 * 60))
+
+_store = None
+
+
+def get_store() -> Optional[kv_store.KeyValueStore]:
+    global _store
+    if _store is None:
+        _store = kv_store.create_store(SEEN_POSTS_BACKEND, table=SEEN_POSTS_TABLE, path=SEEN_POSTS_PATH)
+    return _store
+
+
+def get_key(post_id: str) -> str:
+    return f"post#{post_id}"
+
+
+def get_seen(post_ids: Iterable[str]) -> Set[str]:
+    """
+    Find the posts ingested by a previous run
+    Args:
+        post_ids: The post IDs to look up
+
+    Returns:
+        seen: The subset of post IDs already in the index
+    """
+    store = get_store()
+    post_ids = [str(post_id) for post_id in post_ids]
+    if store is None or not post_ids:
+        return set()
+    try:
+        entries = store.get_many([get_key(post_id) for post_id in post_ids])
+    except Exception as e:
+        # Without the index every post counts as new, duplicates are preferable to dropped posts
+        logger.warning(f"Seen posts lookup failed: {str(e)}")
+        return set()
+    return {post_id for post_id in post_ids if get_key(post_id) in entries}
+
+
+def mark_seen(post_ids: Iterable[str], ttl: int = SEEN_POSTS_TTL_SECONDS) -> int:
+    """
+    Record posts as ingested, they expire from the index after the TTL so they can be refreshed eventually
+    Args:
+        post_ids: The ingested post IDs
+        ttl: Seconds a post stays in the index
+
+    Returns:
+        count: The number of posts written to the index
+    """
+    store = get_store()
+    values = {get_key(post_id): {"post_id": post_id} for post_id in dict.fromkeys(map(str, post_ids)) if post_id}
+    if store is None or not values:
+        return 0
+    try:
+        store.put_many(values, ttl=ttl)
+    except Exception as e:
+        logger.warning(f"Seen posts update failed: {str(e)}")
+        return 0
+    return len(values)
@@ -0,0 +1,80 @@
+import logging
+import os
+import time
+from typing import Dict, Iterable, Optional
+
+from common import kv_store
+from common.watermarks import normalize_term
+
+logger = logging.getLogger()
+
+SNAPSHOT_CACHE_BACKEND = os.getenv("SNAPSHOT_CACHE_BACKEND", "none")
+SNAPSHOT_CACHE_TABLE = os.getenv("SNAPSHOT_CACHE_TABLE", "")
+SNAPSHOT_CACHE_PATH = os.getenv("SNAPSHOT_CACHE_PATH", "/tmp/snapshot_cache.sqlite3")
+# How long the cleaned posts of a term stand in for a new discovery, 0 disables the cache
+SNAPSHOT_CACHE_TTL_SECONDS = int(os.getenv("SNAPSHOT_CACHE_TTL_SECONDS", 30 * 60))
+
+_store = None
+
+
+def get_store() -> Optional[kv_store.KeyValueStore]:
+    global _store
+    if _store is None and SNAPSHOT_CACHE_TTL_SECONDS > 0:
+        _store = kv_store.create_store(SNAPSHOT_CACHE_BACKEND, table=SNAPSHOT_CACHE_TABLE, path=SNAPSHOT_CACHE_PATH)
+    return _store
+
+
+def is_enabled() -> bool:
+    return get_store() is not None
+
+
+def get_key(term: str) -> str:
+    return f"snapshot#{normalize_term(term)}"
+
+
+def get_results(terms: Iterable[str]) -> Dict[str, dict]:
+    """
+    Get the cached results of search terms
+    Args:
+        terms: The search terms
+
+    Returns:
+        results: The fresh cache entry per term, for the terms that have one
+    """
+    store = get_store()
+    terms = [term for term in dict.fromkeys(terms) if term]
+    if store is None or not terms:
+        return {}
+    try:
+        entries = store.get_many([get_key(term) for term in terms])
+    except Exception as e:
+        # A failed lookup costs a discovery, not the execution
+        logger.warning(f"Snapshot cache lookup failed: {str(e)}")
+        return {}
+    return {term: entries[get_key(term)] for term in terms if get_key(term) in entries}
+
+
+def put_results(results: Dict[str, dict], snapshot_id: str, ttl: int = SNAPSHOT_CACHE_TTL_SECONDS) -> int:
+    """
+    Cache the cleaned posts of search terms
+    Args:
+        results: The claim check of the cleaned posts per term
+        snapshot_id: The snapshot the posts come from
+        ttl: Freshness window in seconds
+
+    Returns:
+        cached: The number of terms written
+    """
+    store = get_store()
+    if store is None or not results:
+        return 0
+    cached_at = int(time.time())
+    try:
+        store.put_many({
+            get_key(term): {"term": term, "snapshot_id": snapshot_id, "cached_at": cached_at, **result}
+            for term, result in results.items()
+        }, ttl=ttl)
+    except Exception as e:
+        logger.warning(f"Snapshot cache update failed: {str(e)}")
+        return 0
+    return len(results)
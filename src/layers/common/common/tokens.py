@@ -0,0 +1,84 @@
+import logging
+import os
+import re
+import threading
+from typing import Optional
+
+logger = logging.getLogger()
+
+# 'tiktoken' counts with the model's encoding, 'approximate' never loads it
+TOKENIZER = os.getenv("TOKENIZER", "tiktoken").lower()
+# gpt-4o encoding; tiktoken reads it from TIKTOKEN_CACHE_DIR and downloads it there when it is missing
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+
+# Stand-in when the encoding is unavailable: runs of up to 4 word characters with their leading space, and every
+# punctuation mark, count as one token. English prose comes out slightly above the real count, which is the safe
+# side for a budget.
+APPROXIMATE_TOKEN_PATTERN = re.compile(r"\s?\w{1,4}|\s?[^\w\s]|\s+")
+
+_encoding = None
+_loaded = False
+_lock = threading.Lock()
+
+
+def get_encoding():
+    """
+    Get the tiktoken encoding, loaded once per process
+
+    Returns:
+        encoding: A tiktoken Encoding, or None to approximate
+    """
+    global _encoding, _loaded
+    if _loaded:
+        return _encoding
+    with _lock:
+        if not _loaded:
+            if TOKENIZER == "tiktoken":
+                try:
+                    import tiktoken
+
+                    _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception as e:
+                    logger.warning(f"Tokenizer {TOKENIZER_ENCODING} unavailable, approximating token counts: {str(e)}")
+            _loaded = True
+    return _encoding
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """
+    Count the tokens of a text
+    Args:
+        text: The text
+
+    Returns:
+        tokens: The token count, approximate when tiktoken is unavailable
+    """
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode_ordinary(text))
+    return sum(1 for _ in APPROXIMATE_TOKEN_PATTERN.finditer(text))
+
+
+def truncate(text: Optional[str], max_tokens: int) -> str:
+    """
+    Cut a text down to a token budget
+    Args:
+        text: The text
+        max_tokens: The token budget
+
+    Returns:
+        text: The text, or its first max_tokens tokens
+    """
+    if not text or max_tokens <= 0:
+        return ""
+    encoding = get_encoding()
+    if encoding is not None:
+        encoded = encoding.encode_ordinary(text)
+        return text if len(encoded) <= max_tokens else encoding.decode(encoded[:max_tokens])
+
+    for count, match in enumerate(APPROXIMATE_TOKEN_PATTERN.finditer(text), start=1):
+        if count == max_tokens:
+            return text[:match.end()]
+    return text
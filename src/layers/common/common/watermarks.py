@@ -0,0 +1,82 @@
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from common import kv_store
+
+logger = logging.getLogger()
+
+WATERMARK_BACKEND = os.getenv("WATERMARK_BACKEND", "none")
+WATERMARK_TABLE = os.getenv("WATERMARK_TABLE", "")
+WATERMARK_PATH = os.getenv("WATERMARK_PATH", "/tmp/watermarks.sqlite3")
+
+_store = None
+
+
+def get_store() -> Optional[kv_store.KeyValueStore]:
+    global _store
+    if _store is None:
+        _store = kv_store.create_store(WATERMARK_BACKEND, table=WATERMARK_TABLE, path=WATERMARK_PATH)
+    return _store
+
+
+def is_enabled() -> bool:
+    return get_store() is not None
+
+
+def normalize_term(term: str) -> str:
+    return " ".join(str(term).lower().split())
+
+
+def get_key(term: str) -> str:
+    return f"watermark#{normalize_term(term)}"
+
+
+def get_watermarks(terms: Iterable[str]) -> Dict[str, str]:
+    """
+    Get the high-water marks of search terms
+    Args:
+        terms: The search terms
+
+    Returns:
+        watermarks: The newest ingested create_time per term as an ISO 8601 string, for the terms that have one
+    """
+    store = get_store()
+    terms = [term for term in dict.fromkeys(terms) if term]
+    if store is None or not terms:
+        return {}
+    try:
+        entries = store.get_many([get_key(term) for term in terms])
+    except Exception as e:
+        # Falling back to the default cutoff reprocesses posts, the seen posts index keeps them out of ingestion
+        logger.warning(f"Watermark lookup failed: {str(e)}")
+        return {}
+    return {term: entries[get_key(term)]["create_time"] for term in terms if get_key(term) in entries}
+
+
+def advance_watermarks(watermarks: Dict[str, str]) -> Dict[str, str]:
+    """
+    Move the high-water marks of search terms forward, a watermark never goes back in time
+    Args:
+        watermarks: The newest create_time per term as an ISO 8601 string
+
+    Returns:
+        advanced: The watermarks that were written
+    """
+    store = get_store()
+    if store is None or not watermarks:
+        return {}
+
+    current = get_watermarks(watermarks)
+    advanced = {term: create_time for term, create_time in watermarks.items()
+                if term not in current
+                or datetime.fromisoformat(create_time) > datetime.fromisoformat(current[term])}
+    try:
+        store.put_many({get_key(term): {"term": term, "create_time": create_time, "updated_at": int(time.time())}
+                        for term, create_time in advanced.items()})
+    except Exception as e:
+        logger.warning(f"Watermark update failed: {str(e)}")
+        return {}
+    return advanced
@@ -2,6 +2,7 @@ import json
 import logging
 
 import boto3
+from common import coalescing, instrumentation
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -9,12 +10,52 @@ logger.setLevel(logging.INFO)
 sfn_client = boto3.client("stepfunctions")
 
 
+# Function to hand a coalesced snapshot to every execution of the batch, each one keeps only its own search terms
+def notify_batch(batch_id, payload):
+    store = coalescing.get_store()
+    batch = store.get(batch_id) if store is not None else None
+    if batch is None:
+        return {
+            "statusCode": 404,
+            "body": json.dumps({"batchId": batch_id, "error": "Batch not found"})
+        }
+
+    delivered, errors = 0, []
+    for waiter in batch.get("waiters", []):
+        output = {**payload, "search_terms": waiter["search_terms"], "batch_id": batch_id}
+        try:
+            sfn_client.send_task_success(taskToken=waiter["task_token"], output=json.dumps(output))
+            delivered += 1
+        except Exception as e:
+            # An execution that timed out or was stopped must not keep the others waiting
+            errors.append(str(e))
+
+    logger.info(f"Batch {batch_id}: notified {delivered} execution(s), {len(errors)} failure(s)")
+    if errors and not delivered:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"batchId": batch_id, "error": f"Failed to notify Step Function: {errors[0]}"})
+        }
+    return {
+        "statusCode": 200,
+        "body": {
+            "status": "SUCCESS",
+            "notification": payload,
+            "delivered": delivered,
+            "failed": len(errors)
+        }
+    }
+
+
+@instrumentation.handler
 def lambda_handler(event, context):
-    logger.info("Event received: %s", json.dumps(event))
+    instrumentation.log_event(event)
 
-    # Parse the Task Token from the query string
-    task_token = event.get("queryStringParameters", {}).get("taskToken")
-    if not task_token:
+    # Parse the Task Token, or the batch of a coalesced trigger, from the query string
+    query = event.get("queryStringParameters") or {}
+    task_token = query.get("taskToken")
+    batch_id = query.get("batchId")
+    if not task_token and not batch_id:
         return {
             "statusCode": 400,
             "body": json.dumps({"error": "Task Token is missing"})
@@ -29,6 +70,9 @@ def lambda_handler(event, context):
             "body": json.dumps({"error": "Invalid JSON payload"})
         }
 
+    if batch_id:
+        return notify_batch(batch_id, payload)
+
     # Notify the Step Function of success
     try:
         sfn_client.send_task_success(
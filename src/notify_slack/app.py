@@ -2,7 +2,7 @@ import json
 import logging
 import os
 
-import requests
+from common import http_client, instrumentation
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -10,6 +10,7 @@ logger.setLevel(logging.INFO)
 SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK_URL", None)
 
 
+@instrumentation.handler
 def lambda_handler(event, context):
     """
     Lambda handler that sends notifications to Slack.
@@ -21,7 +22,7 @@ def lambda_handler(event, context):
     Returns:
         Response dictionary with status code and message
     """
-    logger.info(f"Event received: {json.dumps(event)}")
+    instrumentation.log_event(event)
 
     if not SLACK_WEBHOOK_URL:
         error_msg = "SLACK_WEBHOOK_URL is missing"
@@ -62,6 +63,12 @@ def generate_slack_message(event, context):
     details = event.get('details', {})
     execution_id = event.get('executionId', 'Unknown')
 
+    if isinstance(details, dict) and isinstance(details.get('shards'), list):
+        details = {**details, **merge_shard_results(details['shards'])}
+        if status == 'success' and details['shard_summary']['shards'] and not details['shard_summary']['succeeded']:
+            status = 'failure'
+            message = f"{message}, but every shard failed"
+
     emoji = '✅' if status == 'success' else '❌'
 
     error_section = ""
@@ -77,10 +84,8 @@ def generate_slack_message(event, context):
     console_link = f"https://{aws_region}.console.aws.amazon.com/states/home?region={aws_region}#/executions/details/{execution_id}"
 
     success_section = ""
-    if details and status == 'success':
-        request_id = details.get('response', {}).get('request_id', None)
-        if request_id:
-            success_section = f"*Ingestion Details* \n\nRequest ID: {request_id}"
+    if details and (status == 'success' or details.get('shard_summary')):
+        success_section = generate_ingestion_details(details)
 
     slack_message = {
         "blocks": [
@@ -121,6 +126,102 @@ def generate_slack_message(event, context):
     return slack_message
 
 
+def generate_ingestion_details(details):
+    """
+    Creates the ingestion section of the slack message
+
+    Args:
+        details: Output of the Ingest Data step
+
+    Returns:
+        The section text, empty when there is nothing to report
+    """
+    lines = []
+    shard_summary = details.get('shard_summary', {})
+    if shard_summary:
+        lines.append(f"Shards: {shard_summary['succeeded']} of {shard_summary['shards']} succeeded")
+        for shard in shard_summary.get('failed', []):
+            lines.append(f"Shard {shard['shard']} failed ({', '.join(shard['search_terms'])}): {shard['error']}")
+
+    request_id = details.get('response', {}).get('request_id', None)
+    if request_id:
+        lines.append(f"Request ID: {request_id}")
+
+    summary = details.get('summary', {})
+    if summary:
+        lines.append(f"Records: {summary.get('records', 0)} in {summary.get('batches', 0)} batch(es)")
+        lines.append(f"Throughput: {summary.get('records_per_second', 0)} records/s "
+                     f"over {summary.get('duration_ms', 0)} ms")
+        if summary.get('failed_batches'):
+            failed_indexes = [str(result.get('index')) for result in summary.get('failed_batch_results', [])]
+            if len(failed_indexes) < summary['failed_batches']:
+                failed_indexes.append(f"{summary['failed_batches'] - len(failed_indexes)} more")
+            lines.append(f"Failed: {summary['failed_batches']} batch(es), {summary.get('failed_records', 0)} "
+                         f"record(s) (batches {', '.join(failed_indexes)})")
+        dedup = summary.get('dedup', {})
+        if dedup.get('records'):
+            lines.append(f"Duplicates: {dedup.get('in_snapshot_duplicates', 0)} in the snapshot, "
+                         f"{dedup.get('previously_ingested', 0)} already ingested "
+                         f"({dedup.get('duplicate_ratio', 0):.1%} of {dedup['records']} records)")
+
+    if not lines:
+        return ""
+    return "*Ingestion Details* \n\n" + "\n".join(lines)
+
+
+def merge_shard_results(shards):
+    """
+    Merges the outputs of the fan-out branches into one ingestion result
+
+    Args:
+        shards: Output of the Collect Shards map, one entry per shard
+
+    Returns:
+        A dict shaped like the Ingest Data output, plus a shard_summary section listing the failed shards
+    """
+    succeeded = [shard for shard in shards if shard.get('status') == 'success']
+    summaries = [shard.get('summary', {}) for shard in succeeded]
+
+    summary = {key: sum(item.get(key, 0) for item in summaries)
+               for key in ('records', 'batches', 'failed_batches', 'failed_records', 'bytes', 'sent_bytes')}
+    # Shards run in parallel, so the wall time is the slowest shard and the throughputs add up
+    summary['duration_ms'] = max((item.get('duration_ms', 0) for item in summaries), default=0)
+    summary['records_per_second'] = round(sum(item.get('records_per_second', 0) for item in summaries), 2)
+    summary['failed_batch_results'] = [{**result, 'index': f"{shard.get('shard')}.{result.get('index')}"}
+                                       for shard in succeeded
+                                       for result in shard.get('summary', {}).get('failed_batch_results', [])]
+
+    dedups = [item['dedup'] for item in summaries if item.get('dedup')]
+    if dedups:
+        dedup = {key: sum(item.get(key, 0) for item in dedups)
+                 for key in ('records', 'in_snapshot_duplicates', 'previously_ingested')}
+        duplicates = dedup['in_snapshot_duplicates'] + dedup['previously_ingested']
+        dedup['duplicate_ratio'] = round(duplicates / dedup['records'], 4) if dedup['records'] else 0.0
+        summary['dedup'] = dedup
+
+    request_ids = [request_id for shard in succeeded
+                   for request_id in shard.get('response', {}).get('request_ids', [])]
+    failed = [{
+        'shard': shard.get('shard'),
+        'search_terms': shard.get('search_terms', []),
+        'error': (shard.get('error') or {}).get('Error', 'Unknown')
+    } for shard in shards if shard.get('status') != 'success']
+
+    return {
+        'response': {
+            'request_id': request_ids[0] if request_ids else None,
+            'request_ids': request_ids
+        },
+        'summary': summary,
+        'shard_summary': {
+            'shards': len(shards),
+            'succeeded': len(succeeded),
+            'failed': failed
+        }
+    }
+
+
+@instrumentation.timed()
 def post_to_slack(webhook_url, message):
     """
     Posts a message to a Slack webhook URL.
@@ -138,7 +239,7 @@ def post_to_slack(webhook_url, message):
 
     headers = {'Content-Type': 'application/json'}
     try:
-        response = requests.request("POST", webhook_url, json=message, headers=headers)
+        response = http_client.request("POST", webhook_url, json=message, headers=headers)
         response.raise_for_status()
         return response.text
     except Exception as e:
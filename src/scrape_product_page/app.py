@@ -1,25 +1,71 @@
 import json
 import logging
+import os
 import re
 
-import requests
-from bs4 import BeautifulSoup
+from common import http_client, instrumentation, page_cache, tokens
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+PRUNED_TAGS = ('script', 'style', 'noscript', 'template')
 
-def download_webpage(url):
+# Sentences mentioning one of these words are kept as reviews
+REVIEW_PATTERN = re.compile('great|good|excellent', re.IGNORECASE)
+SENTENCE_PATTERN = re.compile('[?.!:]')
+
+PAGE_READ_TIMEOUT = 120
+
+# The page text is distilled down to this many tokens before it goes to the summarizer
+DISTILL_ENABLED = os.getenv("DISTILL_ENABLED", "true").lower() == "true"
+DISTILL_TOKEN_BUDGET = int(os.getenv("DISTILL_TOKEN_BUDGET", 2000))
+# A block whose text is mostly link text is a menu or a list of other products
+MAX_LINK_DENSITY = 0.5
+# The last block is cut to fit the budget, unless less than this is left of it
+MIN_TRUNCATED_TOKENS = 32
+
+BLOCK_TAGS = frozenset({
+    'address', 'article', 'aside', 'blockquote', 'body', 'dd', 'details', 'div', 'dl', 'dt', 'figcaption', 'figure',
+    'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section',
+    'summary', 'table', 'td', 'th', 'tr', 'ul'
+})
+HEADING_WEIGHTS = {'title': 3.0, 'h1': 3.0, 'h2': 1.0, 'h3': 1.0}
+BOILERPLATE_TAGS = frozenset({'nav', 'header', 'footer', 'aside', 'form', 'menu'})
+# Matched against the class and id of an element
+BOILERPLATE_PATTERN = re.compile(
+    'nav|menu|footer|breadcrumb|cookie|consent|banner|sidebar|newsletter|social|share|signup|sign-in|login|modal|'
+    'popup|advert|sponsor|recommend|carousel', re.IGNORECASE
+)
+PRODUCT_SIGNAL_PATTERN = re.compile(
+    r'\b(ingredients?|benefits?|supports?|helps?|formula|dosage|directions|servings?|suggested use|features?|'
+    r'specifications?|dimensions|weight|materials?|made (?:with|in|from)|free (?:of|from)|certified|organic|vegan|'
+    r'gluten|warranty|\d+(?:\.\d+)?\s?(?:mg|mcg|iu|g|kg|ml|oz|lbs?|count|ct|pack|capsules|softgels|tablets|gummies))\b',
+    re.IGNORECASE
+)
+WORD_PATTERN = re.compile(r'[a-z0-9]{3,}')
+
+
+@instrumentation.timed(payload_bytes=lambda response: len(response.content))
+def download_webpage(url, conditional_headers=None):
     headers = {
         'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) '
                       'Chrome/132.0.0.0 Safari/537.36',
         'Accept-Language': 'da, en-gb, en',
         'Accept-Encoding': 'gzip, deflate, br',
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-        'Referer': 'https://www.google.com/'
+        'Referer': 'https://www.google.com/',
+        **(conditional_headers or {})
     }
     try:
-        response = requests.get(url, headers=headers, timeout=120)
+        # Product sites commonly speak HTTP/2, the client is None unless HTTP2_ENABLED is set
+        client = http_client.get_http2_client(url, read_timeout=PAGE_READ_TIMEOUT)
+        if client is not None:
+            response = client.get(url, headers=headers, follow_redirects=True)
+        else:
+            response = http_client.request("GET", url, headers=headers, timeout=PAGE_READ_TIMEOUT)
+        # Checked first, httpx raises for any status outside 2xx
+        if response.status_code == 304:
+            return response
         response.raise_for_status()
         if len(response.content) < 100:
             raise Exception(f"Page redirected: {response.content}")
@@ -29,38 +75,296 @@ def download_webpage(url):
         raise e
 
 
-def scrape_product_page(url):
-    response = download_webpage(url)
-    soup = BeautifulSoup(response.content, 'html.parser')
+class BlockBuilder:
+    """
+    Splits the body text into the blocks of the page as the extractors walk it, with the link text and the
+    boilerplate context of every block
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self.open = []
+        self.elements = []
+        self.opened = 0
+        self.links = 0
+        self.boilerplate = 0
+
+    def start(self, tag, classes=''):
+        is_block = tag in BLOCK_TAGS
+        is_boilerplate = tag in BOILERPLATE_TAGS or bool(classes and BOILERPLATE_PATTERN.search(classes))
+        self.elements.append((is_block, tag == 'a', is_boilerplate))
+        self.links += tag == 'a'
+        self.boilerplate += is_boilerplate
+        if is_block:
+            self.open.append({"tag": tag, "parts": [], "link_chars": 0, "boilerplate": self.boilerplate > 0,
+                              "index": self.opened})
+            self.opened += 1
+
+    def end(self):
+        is_block, is_link, is_boilerplate = self.elements.pop()
+        self.links -= is_link
+        self.boilerplate -= is_boilerplate
+        if is_block:
+            self.flush(self.open.pop())
+
+    def text(self, text):
+        text = text.strip()
+        if text and self.open:
+            block = self.open[-1]
+            block["parts"].append(text)
+            if self.links:
+                block["link_chars"] += len(text)
+
+    def flush(self, block):
+        text = ' '.join(block.pop("parts"))
+        if text:
+            self.blocks.append({**block, "text": text})
+
+    def get_blocks(self, title=None):
+        while self.open:
+            self.flush(self.open.pop())
+        # Nested blocks are flushed before their parent, document order is the order they were opened in
+        blocks = sorted(self.blocks, key=lambda block: block["index"])
+        if title and title.strip():
+            blocks.insert(0, {"tag": "title", "text": title.strip(), "link_chars": 0, "boilerplate": False})
+        return blocks
+
+
+def extract_with_lxml(content):
+    import lxml.html
+    from lxml import etree
+
+    root = lxml.html.fromstring(content)
+    # Drop script and style nodes before walking the tree, keeping the text that follows them
+    etree.strip_elements(root, *PRUNED_TAGS, with_tail=False)
+
+    body = root.find('body')
+    body = body if body is not None else root
+
+    body_texts, image_urls, reviews = [], [], []
+    builder = BlockBuilder()
+    in_body = 0
+
+    def add_text(text):
+        collect_reviews(text, reviews)
+        if in_body:
+            builder.text(text)
+            text = text.strip()
+            if text:
+                body_texts.append(text)
+
+    # Single walk over the document: text on "start", tails on "end" keep the document order
+    for event, node in etree.iterwalk(root, events=("start", "end")):
+        is_element = isinstance(node.tag, str)
+        if event == "start":
+            if node is body:
+                in_body += 1
+            if in_body and is_element:
+                builder.start(node.tag, f"{node.get('class', '')} {node.get('id', '')}".strip())
+            if node.tag == 'img' and node.get('src'):
+                image_urls.append(node.get('src'))
+            if node.text and is_element:
+                add_text(node.text)
+        else:
+            if in_body and is_element:
+                builder.end()
+            if node is body:
+                in_body -= 1
+            if node.tail:
+                add_text(node.tail)
+
+    blocks = builder.get_blocks(root.findtext('.//title'))
+    return ' '.join(body_texts), image_urls, reviews, blocks
+
+
+def extract_with_bs4(content):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, 'html.parser')
+    for node in soup(PRUNED_TAGS):
+        node.decompose()
 
     # Extract all body text content
-    body_content = soup.body.get_text(separator=' ', strip=True)
+    body = soup.body or soup
+    body_content = body.get_text(separator=' ', strip=True)
+
+    builder = BlockBuilder()
+    builder.start('body')
+    walk_bs4(body, builder)
+    blocks = builder.get_blocks(soup.title.get_text() if soup.title else None)
 
     # Extract all image URLs
     image_urls = [img['src'] for img in soup.find_all('img') if 'src' in img.attrs]
 
     # Extract reviews based on identifiable patterns in the text
-    reviews = [sentence.strip() for text in soup.find_all(string=True)
-               for sentence in re.split('[?.!:]', text)
-               if any(word in sentence.lower() for word in ['great', 'good', 'excellent'])]
+    reviews = []
+    for text in soup.find_all(string=True):
+        collect_reviews(text, reviews)
+
+    return body_content, image_urls, reviews, blocks
 
-    return body_content, image_urls, reviews
 
+def walk_bs4(root, builder):
+    from bs4 import Comment, NavigableString
 
+    # Iterative, deeply nested pages would hit the recursion limit
+    stack = [iter(root.children)]
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+            if stack:
+                builder.end()
+        elif isinstance(child, NavigableString):
+            if not isinstance(child, Comment):
+                builder.text(str(child))
+        else:
+            builder.start(child.name, ' '.join([*child.get('class', []), child.get('id', '')]).strip())
+            stack.append(iter(child.children))
+
+
+def collect_reviews(text, reviews):
+    if not REVIEW_PATTERN.search(text):
+        return
+    reviews.extend(sentence.strip() for sentence in SENTENCE_PATTERN.split(text) if REVIEW_PATTERN.search(sentence))
+
+
+def get_name_terms(blocks):
+    return {word for block in blocks if block["tag"] in ('title', 'h1')
+            for word in WORD_PATTERN.findall(block["text"].lower())}
+
+
+def score_block(block, name_terms, position):
+    text = block["text"]
+    words = WORD_PATTERN.findall(text.lower())
+    score = HEADING_WEIGHTS.get(block["tag"], 0.0)
+    # Blocks naming the product, as its title and main heading do, describe it rather than something next to it
+    if name_terms:
+        score += 2 * len(name_terms.intersection(words)) / len(name_terms)
+    score += 0.5 * min(len(PRODUCT_SIGNAL_PATTERN.findall(text)), 5)
+    score += min(len(words), 60) / 60
+    score -= 2 * block["link_chars"] / len(text)
+    # Product details sit near the top of the page, related products and reviews further down
+    score -= 0.5 * position
+    return score
+
+
+@instrumentation.timed(payload_bytes=len)
+def distill(blocks, body_content, budget=DISTILL_TOKEN_BUDGET):
+    """
+    Keep the text of the page that describes the product, within a token budget
+    Args:
+        blocks: The blocks of the page, from an extractor
+        body_content: The whole body text, cut to the budget when no block is left
+        budget: Maximum number of tokens of the result
+
+    Returns:
+        text: The kept blocks in document order, one per line
+    """
+    candidates, seen = [], set()
+    for block in blocks:
+        text = block["text"]
+        if block["boilerplate"] or block["link_chars"] > MAX_LINK_DENSITY * len(text):
+            continue
+        if block["tag"] not in HEADING_WEIGHTS and len(WORD_PATTERN.findall(text.lower())) < 3:
+            continue
+        # Repeated blocks, e.g. the same badge or disclaimer under every variant, are kept once
+        key = ' '.join(text.lower().split())
+        if key not in seen:
+            seen.add(key)
+            candidates.append(block)
+    if not candidates:
+        return tokens.truncate(body_content, budget)
+
+    name_terms = get_name_terms(candidates)
+    scores = [score_block(block, name_terms, index / len(candidates)) for index, block in enumerate(candidates)]
+    kept, used = {}, 0
+    for index in sorted(range(len(candidates)), key=lambda index: scores[index], reverse=True):
+        text = candidates[index]["text"]
+        # One more token for the line break joining the blocks
+        count = tokens.count_tokens(text) + 1
+        if used + count > budget:
+            if budget - used >= MIN_TRUNCATED_TOKENS:
+                kept[index] = tokens.truncate(text, budget - used - 1)
+            break
+        kept[index] = text
+        used += count
+    return '\n'.join(kept[index] for index in sorted(kept))
+
+
+@instrumentation.timed(records=lambda result: len(result[0][2]) if result[0] else 0)
+def scrape_product_page(url, conditional_headers=None):
+    response = download_webpage(url, conditional_headers)
+    if response.status_code == 304:
+        return None, response
+    return get_extractor()(response.content), response
+
+
+# Parsers are imported on first use, lxml when it is installed and BeautifulSoup otherwise
+def get_extractor():
+    try:
+        import lxml.html  # noqa: F401
+    except ImportError:
+        return extract_with_bs4
+    return extract_with_lxml
+
+
+def get_cached_response(url, entry):
+    return {
+        "url": url,
+        "fingerprint": entry["fingerprint"],
+        "unchanged": True,
+        **entry["results"],
+        "message": "Product page unchanged, reused the previous summary and keywords"
+    }
+
+
+@instrumentation.handler
 def lambda_handler(event, context):
-    logger.info('Received event: %s', json.dumps(event))
+    instrumentation.log_event(event)
 
     if "url" not in event:
         logger.error(f"URL not provided: {json.dumps(event)}")
         raise Exception("URL not provided")
 
     url = event.get("url")
-    body_content, image_urls, reviews = scrape_product_page(url)
+
+    # Only revalidate when there are results to reuse, a 304 is useless otherwise
+    entry = page_cache.get_entry(url)
+    reusable = entry if entry and entry.get("results") else None
+    extracted, response = scrape_product_page(url, page_cache.get_conditional_headers(reusable))
+    if extracted is None:
+        logger.info('Product page not modified since %s', reusable["fetched_at"])
+        return get_cached_response(url, reusable)
+
+    body_content, image_urls, reviews, blocks = extracted
+    fingerprint = page_cache.get_fingerprint(body_content, image_urls, reviews)
+    page_cache.save_fetch(url, response.headers.get('ETag'), response.headers.get('Last-Modified'), fingerprint,
+                          previous=entry)
+    if reusable and reusable["fingerprint"] == fingerprint:
+        logger.info('Product page content unchanged, fingerprint %s', fingerprint)
+        return get_cached_response(url, reusable)
     # TODO: save the product details to the Database
 
+    # The fingerprint covers the whole page, only the summarizer gets the distilled text
+    tokens_in = tokens.count_tokens(body_content)
+    if DISTILL_ENABLED:
+        body_content = distill(blocks, body_content)
+    tokens_out = tokens.count_tokens(body_content)
+    instrumentation.record("distill", TokensIn=tokens_in, TokensOut=tokens_out)
+    logger.info('Distilled the page text from %d to %d token(s)', tokens_in, tokens_out)
+
     logger.info('Time remaining: %d second(s)', (context.get_remaining_time_in_millis() / 1000))
     return {
+        "url": url,
+        "fingerprint": fingerprint,
+        "unchanged": False,
         "body_content": body_content,
         "reviews": reviews,
+        "tokens": {
+            "in": tokens_in,
+            "out": tokens_out,
+            "budget": DISTILL_TOKEN_BUDGET if DISTILL_ENABLED else None
+        },
         "message": "Processed input successfully"
     }
@@ -1,52 +1,57 @@
-import json
 import logging
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-import openai
-from openai import OpenAI
+from common import instrumentation, llm, rate_limiter, tokens
+from common.lazy import lazy_import
+
+openai = lazy_import("openai")
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-client = OpenAI(
-    api_key=os.environ.get("API_KEY"),
-)
-
-
-# Function to get OpenAI completion with retry logic
-def get_openai_completion(prompt):
-    while True:
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4o",  # Or 'gpt-4' if you have access to it
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=200,
-                n=1,
-                stop=None,
-                temperature=0.7,
-            )
-            return response.choices[0].message.content
-        except openai.RateLimitError as e:
-            logger.warning("Rate limit exceeded. Retrying in 5 seconds...", e)
-            time.sleep(5)
-        except openai.OpenAIError as e:
-            logger.error("Error in fetching response: %s", str(e), exc_info=True)
-            return ""
+# Keep a margin to return before the Lambda, and the 30s state timeout, cut the step off
+SAFETY_MARGIN_MS = int(os.getenv("SAFETY_MARGIN_MS", 2000))
+STEP_TIMEOUT_SECONDS = float(os.getenv("STEP_TIMEOUT_SECONDS", 28))
+# The scraper distills the page to its own budget, this bound only catches text that skipped it
+SUMMARY_MAX_INPUT_TOKENS = int(os.getenv("SUMMARY_MAX_INPUT_TOKENS", 4000))
+
+# Both summaries are requested at the same time, the pool is reused across warm invocations
+executor = ThreadPoolExecutor(max_workers=2)
+
+
+# Function to get OpenAI completion, errors fall back to an empty summary
+def get_openai_completion(prompt, deadline=None):
+    try:
+        return llm.get_openai_completion(prompt, deadline=deadline)
+    except (openai.OpenAIError, rate_limiter.DeadlineExceeded) as e:
+        logger.warning("Falling back to an empty summary: %s", str(e))
+        return ""
+
+
+# Function to wait for a completion until the deadline, falling back to an empty summary
+def wait_for(future, deadline, name):
+    try:
+        return future.result(timeout=max(deadline - time.monotonic(), 0))
+    except FutureTimeoutError:
+        logger.warning("Deadline reached before the %s completed", name)
+        return ""
 
 
 # Function to summarize the product
-def summarize_product(text):
+@instrumentation.timed()
+def summarize_product(text, deadline=None):
+    text = tokens.truncate(text, SUMMARY_MAX_INPUT_TOKENS)
     prompt = (f"Summarize the following text into 2-3 lines, including who the product is for, the promise or impact "
               f"of the product on the end user:\n\n{text}\n\nSummary:")
-    return get_openai_completion(prompt)
+    return get_openai_completion(prompt, deadline)
 
 
 # Function to summarize the product reviews
-def summarize_reviews(reviews):
+@instrumentation.timed()
+def summarize_reviews(reviews, deadline=None):
     if not reviews:
         return "No reviews found."
 
@@ -57,24 +62,30 @@ def summarize_reviews(reviews):
     # Concatenate reviews for summarization
     reviews_text = "\n".join(reviews_to_summarize)
     prompt = f"Summarize the top {num_reviews_to_summarize} reviews:\n\n{reviews_text}\n\nSummary:"
-    return get_openai_completion(prompt)
+    return get_openai_completion(prompt, deadline)
 
 
+@instrumentation.handler
 def lambda_handler(event, context):
-    logger.info('Received event: %s', json.dumps(event))
+    instrumentation.log_event(event)
 
     body_content = event.get("body_content", "")
     image_urls = event.get("image_urls", [])
     reviews = event.get("reviews", [])
 
-    # Summarize the product
-    summary = summarize_product(body_content)
+    # Summarize the product and the reviews concurrently, so the step takes as long as the slower call
+    deadline = rate_limiter.deadline_from_context(context, SAFETY_MARGIN_MS, STEP_TIMEOUT_SECONDS)
+    summary_future = executor.submit(summarize_product, body_content, deadline)
+    reviews_future = executor.submit(summarize_reviews, reviews, deadline)
 
-    # Summarize the reviews
-    reviews_summary = summarize_reviews(reviews)
+    summary = wait_for(summary_future, deadline, "product summary")
+    reviews_summary = wait_for(reviews_future, deadline, "reviews summary")
 
+    llm.log_stats()
     logger.info('Time remaining: %d second(s)', (context.get_remaining_time_in_millis() / 1000))
     return {
+        "url": event.get("url"),
+        "fingerprint": event.get("fingerprint"),
         "product_summary": summary,
         "image_urls": image_urls,
         "reviews_summary": reviews_summary,
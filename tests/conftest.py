@@ -0,0 +1,94 @@
+import gzip
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT), str(ROOT / "src" / "layers" / "common")]
+# The instrumented functions would print their metric documents between the test output
+os.environ.setdefault("METRICS_ENABLED", "false")
+
+
+class StubAPI:
+    """
+    A local HTTP server recording every request. Responses are taken from `responses` in order, a (status, headers,
+    body) tuple each, then `default` once they run out. `respond`, when set, picks the response from the request.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+        self.default = (200, {}, {"request_id": "stub"})
+        self.respond = None
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                body = gzip.decompress(raw) if self.headers.get("Content-Encoding") == "gzip" else raw
+                request = {"path": self.path, "headers": dict(self.headers), "raw": raw, "body": json.loads(body)}
+                with stub.lock:
+                    stub.requests.append(request)
+                    if stub.respond:
+                        status, headers, payload = stub.respond(request)
+                    else:
+                        status, headers, payload = stub.responses.pop(0) if stub.responses else stub.default
+                content = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                for key, value in {**headers, "Content-Type": "application/json"}.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_api():
+    stub = StubAPI().start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """Mocked AWS services, with credentials that cannot reach a real account"""
+    mock_aws = pytest.importorskip("moto").mock_aws
+    for key, value in {"AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing",
+                       "AWS_SESSION_TOKEN": "testing", "AWS_DEFAULT_REGION": "us-east-1"}.items():
+        monkeypatch.setenv(key, value)
+    with mock_aws():
+        yield
+
+
+@pytest.fixture
+def s3_bucket(aws, monkeypatch):
+    """A moto S3 bucket, the claim check client is recreated inside the mock"""
+    from common import claim_check
+
+    monkeypatch.setattr(claim_check, "S3_ENDPOINT_URL", None)
+    monkeypatch.setattr(claim_check, "_s3_client", None)
+    claim_check.get_s3_client().create_bucket(Bucket="payloads")
+    return "payloads"
@@ -0,0 +1,106 @@
+import time
+import urllib.parse
+from types import SimpleNamespace
+
+import pytest
+
+from common import coalescing
+from local_runner.handlers import load_app
+
+
+@pytest.fixture(scope="module")
+def brightdata_callback():
+    return load_app("brightdata_callback")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Moves time.time forward without waiting"""
+    now = [time.time()]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def coalesced(brightdata_callback, stub_api, monkeypatch):
+    store = coalescing.MemoryBatchStore()
+    monkeypatch.setattr(coalescing, "_store", store)
+    monkeypatch.setattr(coalescing, "COALESCE_WINDOW_SECONDS", 5)
+    monkeypatch.setattr(coalescing, "COALESCE_TAKEOVER_SECONDS", 60)
+    monkeypatch.setattr(brightdata_callback, "BRIGHTDATA_API_URL", stub_api.url)
+    return store
+
+
+def make_context(remaining_seconds):
+    return SimpleNamespace(get_remaining_time_in_millis=lambda: remaining_seconds * 1000)
+
+
+def get_notified_batch(request):
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(request["path"]).query)
+    return urllib.parse.parse_qs(urllib.parse.urlsplit(query["notify"][0]).query)["batchId"][0]
+
+
+def test_abandoned_batch_is_taken_over(brightdata_callback, coalesced, stub_api, clock):
+    def time_out():
+        raise TimeoutError("Task timed out")
+
+    # The leader joins its batch and dies before closing it
+    with pytest.raises(TimeoutError):
+        brightdata_callback.lambda_handler({"taskToken": "leader", "input": {"search_terms": ["Vitamin D3"]}},
+                                           SimpleNamespace(get_remaining_time_in_millis=time_out))
+    [abandoned] = coalesced.list_open("limit10")
+
+    # Several windows later, within the takeover time, the batch is left to its leader
+    clock[0] += 30
+    brightdata_callback.lambda_handler({"taskToken": "early", "input": {"search_terms": ["Zinc"]}},
+                                       make_context(brightdata_callback.TRIGGER_MARGIN_SECONDS))
+    assert [request["body"] for request in stub_api.requests] == [[{"search_keyword": "Zinc"}]]
+    assert coalesced.list_open("limit10") == [abandoned]
+
+    clock[0] += 60
+    result = brightdata_callback.lambda_handler({"taskToken": "late", "input": {"search_terms": ["Collagen"]}},
+                                                make_context(brightdata_callback.TRIGGER_MARGIN_SECONDS))
+
+    takeover, own = stub_api.requests[1:]
+    assert get_notified_batch(takeover) == abandoned
+    assert takeover["body"] == [{"search_keyword": "Vitamin D3"}]
+    assert own["body"] == [{"search_keyword": "Collagen"}]
+    assert result["batch"]["waiters"] == 1
+    assert coalesced.get(abandoned)["closed_at"]
+    assert coalesced.list_open("limit10") == []
+
+
+def test_batch_closed_by_its_leader_is_not_taken_over(brightdata_callback, coalesced, stub_api, clock):
+    context = make_context(brightdata_callback.TRIGGER_MARGIN_SECONDS)
+    brightdata_callback.lambda_handler({"taskToken": "leader", "input": {"search_terms": ["Vitamin D3"]}}, context)
+
+    clock[0] += 120
+    brightdata_callback.lambda_handler({"taskToken": "late", "input": {"search_terms": ["Collagen"]}}, context)
+
+    assert [request["body"] for request in stub_api.requests] == [[{"search_keyword": "Vitamin D3"}],
+                                                                   [{"search_keyword": "Collagen"}]]
+
+
+def test_plan_shards_splits_unique_terms_in_order(brightdata_callback):
+    event = {"action": "plan_shards", "shard_size": 2,
+             "input": {"search_terms": ["Zinc", "Collagen", "Zinc", "Vitamin D3", "Magnesium", "Iron"]}}
+
+    plan = brightdata_callback.lambda_handler(event, None)
+
+    assert plan == {"count": 3, "shards": [{"search_terms": ["Zinc", "Collagen"]},
+                                           {"search_terms": ["Vitamin D3", "Magnesium"]},
+                                           {"search_terms": ["Iron"]}]}
+
+
+def test_plan_shards_reads_the_keywords_of_a_scrape(brightdata_callback):
+    event_input = {"keywords": {"descriptor": "Vitamin D3", "features": ["K2", "Coconut Oil"]}}
+
+    assert brightdata_callback.plan_shards(event_input, 5) == [
+        {"search_terms": ["Vitamin D3", "Vitamin D3 K2", "Vitamin D3 Coconut Oil"]}]
+    assert brightdata_callback.plan_shards({"search_terms": []}, 5) == []
+
+
+def test_plan_shards_rejects_an_empty_shard(brightdata_callback):
+    with pytest.raises(ValueError, match="shard_size"):
+        brightdata_callback.lambda_handler({"action": "plan_shards", "shard_size": 0,
+                                            "input": {"search_terms": ["Zinc"]}}, None)
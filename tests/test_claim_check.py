@@ -0,0 +1,101 @@
+import gzip
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from common import claim_check
+
+POSTS = [
+    {"post_id": "1", "digg_count": 10, "hashtags": ["health", "fyp"],
+     "music": {"id": "m1", "title": "original sound", "original": True}},
+    {"post_id": "2", "digg_count": 0, "hashtags": [], "music": {"id": "m2", "title": "", "original": False}},
+    {"post_id": "3", "digg_count": 7, "hashtags": None, "music": None}
+]
+
+
+def test_ndjson_round_trip(s3_bucket):
+    ndjson = "\n".join(json.dumps(post) for post in POSTS) + "\n"
+
+    result = claim_check.put_ndjson(ndjson, key="cleaned/posts.ndjson.gz", count=len(POSTS), bucket=s3_bucket)
+
+    assert result == {"claim_check": {"bucket": s3_bucket, "key": "cleaned/posts.ndjson.gz",
+                                      "format": claim_check.NDJSON_GZIP}, "count": 3}
+    assert claim_check.is_claim_check(result)
+    stored = claim_check.get_s3_client().get_object(Bucket=s3_bucket, Key="cleaned/posts.ndjson.gz")
+    assert stored["ContentEncoding"] == "gzip"
+    assert gzip.decompress(stored["Body"].read()).decode("utf-8") == ndjson
+    assert list(claim_check.iter_records(result)) == POSTS
+
+
+def test_empty_ndjson_round_trip(s3_bucket):
+    result = claim_check.put_ndjson("", key="cleaned/empty.ndjson.gz", count=0, bucket=s3_bucket)
+
+    assert result["count"] == 0
+    assert list(claim_check.iter_records(result)) == []
+
+
+@pytest.mark.parametrize("output_format", [claim_check.PARQUET, claim_check.ARROW_IPC])
+def test_table_round_trip(s3_bucket, output_format):
+    pa = pytest.importorskip("pyarrow")
+    table = pa.Table.from_pylist(POSTS)
+    key = f"cleaned/posts.{output_format}"
+
+    result = claim_check.put_table(table, key=key, output_format=output_format, bucket=s3_bucket)
+
+    assert result == {"claim_check": {"bucket": s3_bucket, "key": key, "format": output_format}, "count": 3}
+    stored = claim_check.get_s3_client().head_object(Bucket=s3_bucket, Key=key)
+    assert stored["ContentType"] == claim_check.CONTENT_TYPES[output_format]
+    records = list(claim_check.iter_records(result))
+    assert [record["post_id"] for record in records] == ["1", "2", "3"]
+    assert [record["hashtags"] for record in records] == [["health", "fyp"], [], None]
+    assert records[0]["music"] == {"id": "m1", "title": "original sound", "original": True}
+    assert records[2]["music"] is None
+
+
+@pytest.mark.parametrize("output_format", [claim_check.PARQUET, claim_check.ARROW_IPC])
+def test_table_round_trip_across_record_batches(s3_bucket, monkeypatch, output_format):
+    pa = pytest.importorskip("pyarrow")
+    monkeypatch.setattr(claim_check, "READ_BATCH_SIZE", 2)
+    posts = [{"post_id": str(index), "digg_count": index} for index in range(5)]
+    table = pa.concat_tables([pa.Table.from_pylist(posts[:2]), pa.Table.from_pylist(posts[2:])])
+
+    result = claim_check.put_table(table, key=f"cleaned/many.{output_format}", output_format=output_format,
+                                   bucket=s3_bucket)
+
+    assert list(claim_check.iter_records(result)) == posts
+
+
+def test_unsupported_format_is_rejected(s3_bucket):
+    event = {"claim_check": {"bucket": s3_bucket, "key": "cleaned/posts.csv", "format": "csv"}}
+
+    with pytest.raises(ValueError, match="Unsupported claim check format"):
+        list(claim_check.iter_records(event))
+    with pytest.raises(ValueError, match="Unsupported columnar format"):
+        claim_check.serialize_table(None, "csv")
+
+
+def test_missing_bucket_is_rejected():
+    with pytest.raises(ValueError, match="Payload bucket is missing"):
+        claim_check.put_ndjson("{}\n", key="cleaned/posts.ndjson.gz", count=1, bucket="")
+
+
+def test_records_are_not_claim_checks():
+    assert not claim_check.is_claim_check(POSTS)
+    assert not claim_check.is_claim_check({"records": POSTS})
+
+
+@pytest.mark.parametrize("output_format", [claim_check.PARQUET, claim_check.ARROW_IPC])
+def test_table_timestamps_are_read_as_iso_strings(s3_bucket, output_format):
+    pa = pytest.importorskip("pyarrow")
+    create_time = pa.array([datetime(2024, 6, 1, 10, 30, tzinfo=timezone.utc), None], pa.timestamp("us", tz="UTC"))
+    table = pa.table({"post_id": ["1", "2"], "create_time": create_time})
+
+    result = claim_check.put_table(table, key=f"cleaned/times.{output_format}", output_format=output_format,
+                                   bucket=s3_bucket)
+
+    records = list(claim_check.iter_records(result))
+    assert records == [{"post_id": "1", "create_time": "2024-06-01T10:30:00+00:00"},
+                       {"post_id": "2", "create_time": None}]
+    # Sent to the ingestion API as is, like the newline-delimited JSON payloads
+    assert json.loads(json.dumps(records, default=str))[0]["create_time"] == "2024-06-01T10:30:00+00:00"
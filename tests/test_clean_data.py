@@ -0,0 +1,306 @@
+import json
+import os
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+from local_runner.handlers import load_app  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def clean_data():
+    return load_app("clean_data")
+
+
+def make_record(post_id, create_time, play_count=100_000, region="US", search_term="Vitamin D3"):
+    return {"post_id": post_id, "url": f"https://www.tiktok.com/@creator/video/{post_id}", "description": "",
+            "create_time": create_time, "play_count": f"{play_count:,}", "region": region, "profile_followers": 10,
+            "discovery_input": {"search_keyword": search_term}}
+
+
+def test_new_watermarks_include_filtered_posts(clean_data):
+    records = [
+        make_record("1", "2024-07-01T00:00:00.000Z"),
+        # Read but skipped for its plays, it may gain them by the next run
+        make_record("2", "2024-07-05T00:00:00.000Z", play_count=10),
+        make_record("3", "2024-07-03T00:00:00.000Z", search_term="Collagen", region="GB"),
+        make_record("4", "2024-05-01T00:00:00.000Z", search_term="Collagen")
+    ]
+    new_watermarks = {"Vitamin D3": "2024-07-02T00:00:00+00:00"}
+
+    df = clean_data.clean_records(clean_data.to_dataframe(records), None, None, new_watermarks)
+
+    assert df["post_id"].tolist() == ["1"]
+    assert new_watermarks == {"Vitamin D3": "2024-07-05T00:00:00+00:00", "Collagen": "2024-07-03T00:00:00+00:00"}
+    # The watermarks of the cleaned posts alone would leave the skipped post behind the cutoff
+    assert clean_data.get_new_watermarks(df) == {"Vitamin D3": "2024-07-01T00:00:00+00:00"}
+
+
+def test_new_watermarks_keep_the_newest(clean_data):
+    new_watermarks = {"a": "2024-07-05T00:00:00+00:00", "b": "2024-07-01T00:00:00.500000+00:00"}
+
+    clean_data.update_watermarks(new_watermarks, {"a": "2024-07-04T00:00:00+00:00",
+                                                  "b": "2024-07-01T00:00:01+00:00", "c": "2024-06-01T00:00:00+00:00"})
+
+    assert new_watermarks == {"a": "2024-07-05T00:00:00+00:00", "b": "2024-07-01T00:00:01+00:00",
+                              "c": "2024-06-01T00:00:00+00:00"}
+
+
+def test_lookback_window_is_read_again(clean_data, monkeypatch):
+    monkeypatch.setattr(clean_data, "WATERMARK_LOOKBACK_HOURS", 24)
+    records = [make_record("1", "2024-07-03T00:00:00.000Z"), make_record("2", "2024-07-04T12:00:00.000Z"),
+               make_record("3", "2024-07-06T00:00:00.000Z")]
+
+    df = clean_data.clean_records(clean_data.to_dataframe(records), {"Vitamin D3": "2024-07-05T00:00:00+00:00"})
+
+    assert df["post_id"].tolist() == ["2", "3"]
+
+
+@pytest.mark.parametrize("claim_check_mode, expected", [(True, {}), (False, None)])
+def test_watermarks_need_a_claim_check(clean_data, monkeypatch, claim_check_mode, expected):
+    calls = []
+
+    def fake_clean_data(snapshot_id, term_watermarks=None, search_terms=None, new_watermarks=None):
+        calls.append(term_watermarks)
+        return pd.DataFrame()
+
+    monkeypatch.setattr(clean_data, "clean_data", fake_clean_data)
+    monkeypatch.setattr(clean_data, "CLAIM_CHECK_MODE", claim_check_mode)
+    monkeypatch.setattr(clean_data, "OUTPUT_FORMAT", "json")
+    monkeypatch.setattr(clean_data, "store_posts", lambda df, snapshot_id, search_terms=None: {"count": len(df)})
+    monkeypatch.setattr(clean_data.watermarks, "is_enabled", lambda: True)
+    monkeypatch.setattr(clean_data.snapshot_cache, "is_enabled", lambda: False)
+
+    clean_data.lambda_handler({"snapshot_id": "s1", "status": "ready", "streaming": False, "fused": False,
+                               "backfill": False}, None)
+
+    # In list mode nothing would advance the watermarks, so they are not applied either
+    assert calls == [expected]
+
+
+# The per-row classification replaced by the level tables, as it was written
+def legacy_play_level(play_count):
+    if play_count < 10_000:
+        return "low"
+    elif play_count < 50_000:
+        return "medium"
+    else:
+        return "high"
+
+
+def legacy_influencer_type(profile_followers):
+    if profile_followers > 1_000_000:
+        return "celebrity"
+    elif profile_followers > 100_000:
+        return "major"
+    elif profile_followers > 10_000:
+        return "micro"
+    else:
+        return "nano"
+
+
+def legacy_biography(biography):
+    if pd.isna(biography):
+        return ""
+    return biography.replace("\n", " ").replace("\r", " ")
+
+
+def test_levels_match_the_per_row_classification(clean_data):
+    play_counts = [None, "", "n/a", "-5", "0", "9,999", "10,000", "49,999", "50,000", "1,234,567", "12.5"]
+    followers = [None, "", "n/a", -5, 0, "10000", 10_000, 10_001, 100_000, 100_001, 1_000_000, 1_000_001]
+    biographies = [None, pd.NA, "", "Mom of 2\nNurse", "Fitness\r\ncoach", "\n", "plain"]
+    df = pd.DataFrame({"play_count": pd.Series(play_counts, dtype="string")})
+    followers_df = pd.DataFrame({"profile_followers": pd.Series(followers, dtype="object")})
+    bio_df = pd.DataFrame({"profile_biography": pd.Series(biographies, dtype="object")})
+
+    play_count = pd.to_numeric(df["play_count"].str.replace(",", ""), errors="coerce").fillna(0).astype(int)
+    plays = clean_data.get_levels(clean_data.to_integers(df["play_count"].str.replace(",", "")),
+                                  clean_data.play_levels)
+    profile_followers = pd.to_numeric(followers_df["profile_followers"], errors="coerce").fillna(0).astype(int)
+    influencer_types = clean_data.get_levels(clean_data.to_integers(followers_df["profile_followers"]),
+                                             clean_data.influencer_types)
+
+    assert plays.astype(str).tolist() == play_count.map(legacy_play_level).tolist()
+    assert influencer_types.astype(str).tolist() == profile_followers.map(legacy_influencer_type).tolist()
+    assert (clean_data.fix_biography(bio_df["profile_biography"]).tolist()
+            == bio_df["profile_biography"].map(legacy_biography).tolist())
+
+
+def test_nested_columns_match_the_per_row_restructure(clean_data):
+    df = pd.DataFrame({"hashtags": [["fyp", "movie"], None, "fyp", {}, []],
+                       "music": [{"id": "1"}, None, "sound", [], {}]})
+
+    df = clean_data.restructure_records(df, ["hashtags", "extra"], replace_with=list)
+    df = clean_data.restructure_records(df, ["music"], replace_with=dict)
+
+    assert df["hashtags"].tolist() == ["['fyp', 'movie']", "[]", "[]", "[]", "[]"]
+    assert df["music"].tolist() == ["{'id': '1'}", "{}", "{}", "{}", "{}"]
+    assert df["extra"].tolist() == [[]] * 5
+
+
+def test_search_terms_survive_malformed_discovery_input(clean_data):
+    discovery = pd.Series([{"search_keyword": "Zinc"}, {}, None, "Zinc", {"search_keyword": None}])
+
+    assert clean_data.get_search_terms(discovery).tolist() == ["Zinc", "", "", "", ""]
+
+
+# The cleaning stages as they were before the records were projected and the counts downcast
+def legacy_clean(clean_data, records):
+    df = pd.DataFrame(records)
+    df = df.astype({'post_id': 'string', 'create_time': 'string', 'play_count': 'string'})
+    df = clean_data.fix_create_time(df)
+    df = df[df["region"].isin(clean_data.filters["region"])]
+    df = df[df["create_time"] > pd.to_datetime(clean_data.filters["create_time"], utc=True)]
+
+    df[clean_data.string_columns] = df[clean_data.string_columns].astype('string')
+    df[clean_data.numeric_columns] = df[clean_data.numeric_columns].apply(pd.to_numeric, errors='coerce') \
+        .fillna(0).astype(int)
+    df['play_count'] = pd.to_numeric(df['play_count'].str.replace(',', ''), errors='coerce').fillna(0).astype(int)
+    df['plays'] = df['play_count'].map(legacy_play_level)
+    df['influencer_type'] = df['profile_followers'].map(legacy_influencer_type)
+    df['profile_biography'] = df['profile_biography'].map(legacy_biography)
+    df['search_term'] = pd.json_normalize(df['discovery_input'].tolist())["search_keyword"].fillna("") \
+        .set_axis(df.index)
+    df['product_promo'] = False
+    df = clean_data.restructure_records(df, clean_data.array_columns, replace_with=list)
+    df = clean_data.restructure_records(df, clean_data.object_columns, replace_with=dict)
+
+    df = df[clean_data.string_columns + clean_data.numeric_columns + clean_data.array_columns +
+            clean_data.object_columns + clean_data.new_columns]
+    return df[df['plays'] != 'low']
+
+
+def test_projected_frame_gives_the_same_json(clean_data, monkeypatch):
+    monkeypatch.setattr(clean_data, "OUTPUT_FORMAT", "json")
+    # Counts past int8, int16 and int32 in a column of otherwise small values, negative, fractional and malformed
+    counts = [0, 127, 128, 32_768, -40_000, 3_000_000_000, 2 ** 40, 9_000_000_000_000_000_000, "12", "1,234", "n/a",
+              12.7, None]
+    records = []
+    for index, count in enumerate(counts):
+        records.append({
+            "url": f"https://www.tiktok.com/@creator/video/{index}", "post_id": str(7_300_000_000_000_000_000 + index),
+            "description": f"post {index}", "create_time": f"2024-07-{index + 1:02d}T00:00:00.000Z",
+            "region": "GB" if index == 1 else ["US", "CA"][index % 2], "commerce_info": None,
+            "profile_url": "https://www.tiktok.com/@creator",
+            "preview_image": f"https://p16-sign-va.tiktokcdn.com/{index}.jpeg?x-expires=1",
+            "digg_count": count, "share_count": 5, "collect_count": count, "comment_count": 1,
+            "profile_followers": count, "video_duration": count,
+            "play_count": "9,999" if index == 2 else ["10,000", "3,000,000,000", "1,234,567"][index % 3],
+            "hashtags": [["fyp"], None, "fyp"][index % 3], "music": [{"id": str(index)}, None][index % 2],
+            "profile_biography": [None, "Mom of 2\nNurse"][index % 2],
+            "discovery_input": {"search_keyword": "Zinc", "country": "US"},
+            # Dropped by the projection
+            "profile_avatar": "https://p16-sign-va.tiktokcdn.com/avatar.jpeg?x-signature=" + "a" * 500,
+            "top_comments": [{"text": "x" * 200}] * 5
+        })
+
+    df = clean_data.clean_records(clean_data.to_dataframe([clean_data.project_record(record) for record in records]))
+    expected = legacy_clean(clean_data, records)
+
+    assert len(df) == len(counts) - 2
+    assert df["digg_count"].max() == 9_000_000_000_000_000_000
+    assert ([json.loads(line) for line in df.to_json(orient='records', lines=True, date_format='iso').splitlines()]
+            == [json.loads(line) for line in expected.to_json(orient='records', lines=True,
+                                                              date_format='iso').splitlines()])
+
+
+def test_forked_cleaning_matches_a_single_process(clean_data, monkeypatch):
+    terms = ["Vitamin D3", "Collagen", "Zinc"]
+    snapshots = {
+        snapshot_id: [make_record(str(post % 150), f"2024-{6 + post % 3:02d}-{1 + post % 28:02d}T00:00:00.000Z",
+                                  play_count=(post * 7919) % 90_000, region=["US", "CA", "GB"][post % 3],
+                                  search_term=terms[(post + offset) % 3])
+                      for post in range(offset, offset + 300)]
+        for offset, snapshot_id in enumerate(["s_a", "s_b", "s_c"])
+    }
+
+    def download_snapshot(snapshot_id, path):
+        with open(path, "w") as file:
+            file.writelines(json.dumps(record) + "\n" for record in snapshots[snapshot_id])
+        return {"snapshot_id": snapshot_id, "path": path, "bytes": os.path.getsize(path)}
+
+    get_partitions = clean_data.get_partitions
+    partitions = []
+
+    def split(paths, count):
+        partitions.append(get_partitions(paths, count, min_bytes=1))
+        return partitions[-1]
+
+    monkeypatch.setattr(clean_data, "download_snapshot", download_snapshot)
+    monkeypatch.setattr(clean_data, "get_partitions", split)
+    monkeypatch.setattr(clean_data, "get_memory_mb", lambda: 16 * 1024)
+    monkeypatch.setattr(clean_data.watermarks, "get_watermarks", lambda terms: {})
+
+    def clean(workers):
+        new_watermarks = {}
+        frames = clean_data.clean_snapshots(list(snapshots), {"Zinc": "2024-07-10T00:00:00+00:00"},
+                                            clean_workers=workers, new_watermarks=new_watermarks)
+        return frames, new_watermarks
+
+    single, single_watermarks = clean(1)
+    forked, forked_watermarks = clean(2)
+
+    # Every snapshot is split, so partitions of one snapshot are cleaned in different processes
+    assert len(partitions[1]) == 2 * len(snapshots)
+    assert list(forked) == list(single) == list(snapshots)
+    assert forked_watermarks == single_watermarks
+    for snapshot_id in snapshots:
+        assert len(single[snapshot_id]) > 0
+        pd.testing.assert_frame_equal(forked[snapshot_id].reset_index(drop=True),
+                                      single[snapshot_id].reset_index(drop=True))
+
+
+@pytest.fixture
+def seen_store(clean_data, monkeypatch):
+    from common import kv_store
+
+    store = kv_store.create_store("memory")
+    monkeypatch.setattr(clean_data.seen_posts, "_store", store)
+    return store
+
+
+def test_duplicate_posts_keep_every_search_term(clean_data, monkeypatch):
+    monkeypatch.setattr(clean_data, "OUTPUT_FORMAT", "json")
+    df = pd.DataFrame({"post_id": ["1", "2", "1", "1", pd.NA, pd.NA],
+                       "search_term": ["Zinc", "Zinc", "Collagen", "Zinc", "Zinc", "Zinc"],
+                       "description": ["a", "b", "c", "d", "e", "f"]}).astype({"post_id": "string"})
+
+    df = clean_data.drop_duplicate_posts(df)
+
+    # The first row of a post is kept, posts without an ID cannot be compared and are all kept
+    assert df["description"].tolist() == ["a", "b", "e", "f"]
+    assert df["search_terms"].tolist() == ["['Zinc', 'Collagen']", "['Zinc']", "['Zinc']", "['Zinc']"]
+
+
+@pytest.mark.parametrize("mode, expected", [("skip", ["2", "3"]), ("mark", ["1", "2", "3"])])
+def test_seen_posts_are_skipped_or_marked(clean_data, seen_store, monkeypatch, mode, expected):
+    monkeypatch.setattr(clean_data, "SEEN_POSTS_MODE", mode)
+    clean_data.seen_posts.mark_seen(["1", "4"])
+    df = pd.DataFrame({"post_id": ["1", "2", "3", "2"], "search_term": ["Zinc", "Zinc", "Zinc", "Collagen"]})
+
+    df, stats = clean_data.dedupe_posts(df)
+
+    assert df["post_id"].tolist() == expected
+    assert stats == {"records": 4, "in_snapshot_duplicates": 1, "previously_ingested": 1, "duplicate_ratio": 0.5,
+                     "seen_posts_mode": mode}
+    if mode == "mark":
+        assert df["previously_ingested"].tolist() == [True, False, False]
+
+
+def test_chunked_cleaning_matches_the_whole_frame(clean_data, monkeypatch):
+    monkeypatch.setattr(clean_data, "OUTPUT_FORMAT", "json")
+    records = [make_record(str(index), f"2024-07-{index % 28 + 1:02d}T00:00:00.000Z",
+                           play_count=[100_000, 20_000, 10][index % 3], region=["US", "CA", "GB"][index % 4 % 3],
+                           search_term=["Vitamin D3", "Collagen"][index % 2]) for index in range(40)]
+    monkeypatch.setattr(clean_data, "iter_records", lambda snapshot_id: map(clean_data.project_record, records))
+    term_watermarks = {"Vitamin D3": "2024-07-10T00:00:00+00:00"}
+
+    whole_watermarks, chunked_watermarks = {}, {}
+    whole = clean_data.clean_data("s1", term_watermarks, None, whole_watermarks)
+    chunked = clean_data.clean_data_streaming("s1", 3, term_watermarks, None, chunked_watermarks)
+
+    assert clean_data.CHUNK_SIZE > 3
+    assert 0 < len(whole) < len(records)
+    assert chunked.to_json(orient='records', lines=True) == whole.to_json(orient='records', lines=True)
+    assert chunked_watermarks == whole_watermarks
@@ -0,0 +1,95 @@
+import pytest
+
+from common import coalescing
+
+
+@pytest.fixture
+def dynamodb_table(aws, monkeypatch):
+    import boto3
+
+    monkeypatch.setattr(coalescing, "DYNAMODB_ENDPOINT_URL", None)
+    boto3.client("dynamodb").create_table(TableName="batches", BillingMode="PAY_PER_REQUEST",
+                                          KeySchema=[{"AttributeName": "pk", "KeyType": "HASH"}],
+                                          AttributeDefinitions=[{"AttributeName": "pk", "AttributeType": "S"}])
+    return "batches"
+
+
+@pytest.fixture(params=["memory", "dynamodb"])
+def store(request):
+    if request.param == "memory":
+        return coalescing.MemoryBatchStore()
+    return coalescing.DynamoDBBatchStore(request.getfixturevalue("dynamodb_table"))
+
+
+def waiter(token):
+    return {"task_token": token, "search_terms": [f"term {token}"]}
+
+
+def test_batch_is_closed_once(store):
+    assert store.join("batch#1", waiter("a"), ttl=60, closes_at=100) == 1
+    assert store.join("batch#1", waiter("b"), ttl=60, closes_at=100) == 2
+
+    assert store.close("batch#1") == [waiter("a"), waiter("b")]
+    assert store.close("batch#1") is None
+    assert store.join("batch#1", waiter("c"), ttl=60, closes_at=100) is None
+
+
+def test_full_batch_is_not_joined(store, monkeypatch):
+    monkeypatch.setattr(coalescing, "COALESCE_MAX_WAITERS", 2)
+    store.join("batch#1", waiter("a"), ttl=60, closes_at=100)
+    store.join("batch#1", waiter("b"), ttl=60, closes_at=100)
+
+    assert store.join("batch#1", waiter("c"), ttl=60, closes_at=100) is None
+
+
+def test_missing_batch_is_not_closed(store):
+    assert store.close("batch#missing") is None
+    assert store.get("batch#missing") is None
+
+
+def test_expired_batch_is_not_closed(monkeypatch):
+    store = coalescing.MemoryBatchStore()
+    store.join("batch#1", waiter("a"), ttl=60, closes_at=100)
+    now = coalescing.time.time()
+    monkeypatch.setattr(coalescing.time, "time", lambda: now + 61)
+
+    assert store.get("batch#1") is None
+    assert store.close("batch#1") is None
+
+
+def test_abandoned_batch(store):
+    store.join("batch#1", waiter("a"), ttl=60, closes_at=100)
+
+    assert not coalescing.is_abandoned(store.get("batch#1"), now=150, takeover_seconds=60)
+    assert coalescing.is_abandoned(store.get("batch#1"), now=160, takeover_seconds=60)
+    store.close("batch#1")
+    assert not coalescing.is_abandoned(store.get("batch#1"), now=160, takeover_seconds=60)
+    assert not coalescing.is_abandoned(None)
+
+
+def test_open_batches_are_listed_until_closed(store):
+    store.join("batch#limit10#1", waiter("a"), ttl=60, closes_at=100)
+    store.join("batch#limit10#1", waiter("b"), ttl=60, closes_at=100)
+    store.join("batch#limit10#2", waiter("c"), ttl=60, closes_at=105)
+    store.join("batch#limit20#1", waiter("d"), ttl=60, closes_at=100)
+
+    assert store.list_open("limit10") == ["batch#limit10#1", "batch#limit10#2"]
+    store.close("batch#limit10#1")
+    assert store.list_open("limit10") == ["batch#limit10#2"]
+    assert store.list_open("limit20") == ["batch#limit20#1"]
+    assert store.list_open("limit30") == []
+
+
+def test_merge_terms():
+    waiters = [{"search_terms": ["Vitamin D3", "Collagen"]}, {"search_terms": ["vitamin  d3", "Zinc"]}]
+
+    assert coalescing.merge_terms(waiters) == ["Vitamin D3", "Collagen", "Zinc"]
+
+
+def test_incomplete_backend_fails_at_construction():
+    class JoinOnlyStore(coalescing.BatchStore):
+        def join(self, batch_id, waiter, ttl, closes_at):
+            return 1
+
+    with pytest.raises(TypeError, match="abstract"):
+        JoinOnlyStore()
@@ -0,0 +1,64 @@
+import json
+import os
+
+import pytest
+
+from local_runner.handlers import load_app
+
+
+@pytest.fixture(scope="module")
+def collection():
+    # The Step Functions client is created at import
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+    return load_app("collection")
+
+
+class StepFunctions:
+    def __init__(self):
+        self.inputs = []
+
+    def start_execution(self, stateMachineArn, input):
+        self.inputs.append(json.loads(input))
+        return {"executionArn": f"{stateMachineArn}:execution", "ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+@pytest.fixture
+def client(collection, monkeypatch):
+    client = StepFunctions()
+    monkeypatch.setattr(collection, "client", client)
+    monkeypatch.setenv("STATE_MACHINE_ARN", "arn:aws:states:us-east-2:000000000000:stateMachine:Collection")
+    return client
+
+
+def invoke(collection, body):
+    return collection.lambda_handler({"body": json.dumps(body)}, None)
+
+
+@pytest.mark.parametrize("fan_out", [
+    "yes",
+    {"enabled": "true"},
+    {"enabled": True, "max_concurrency": 0},
+    {"enabled": True, "max_concurrency": 41},
+    {"enabled": True, "max_concurrency": 2.5},
+    {"enabled": True, "shard_size": 0},
+    {"enabled": True, "shard_size": "2"},
+])
+def test_invalid_fan_out_is_rejected(collection, client, fan_out):
+    response = invoke(collection, {"search_terms": ["Zinc"], "fan_out": fan_out})
+
+    assert response["statusCode"] == 400
+    assert "fan_out" in json.loads(response["body"])["error"]
+    assert client.inputs == []
+
+
+def test_fan_out_is_passed_to_the_execution(collection, client, monkeypatch):
+    monkeypatch.setattr(collection, "FAN_OUT_SHARD_SIZE", 2)
+
+    assert invoke(collection, {"search_terms": ["Zinc"], "fan_out": True})["statusCode"] == 200
+    assert invoke(collection, {"search_terms": ["Zinc"], "fan_out": {"max_concurrency": 8, "shard_size": 3}}
+                  )["statusCode"] == 200
+
+    assert [input["fan_out"] for input in client.inputs] == [
+        {"enabled": True, "max_concurrency": collection.FAN_OUT_MAX_CONCURRENCY, "shard_size": 2},
+        {"enabled": collection.FAN_OUT_ENABLED, "max_concurrency": 8, "shard_size": 3}
+    ]
@@ -0,0 +1,105 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from common import executions
+from local_runner.__main__ import make_intake_batch
+from local_runner.handlers import load_app
+
+CONTEXT = SimpleNamespace(get_remaining_time_in_millis=lambda: 30_000)
+
+
+@pytest.fixture(scope="module")
+def collection_intake():
+    # The Step Functions client is created at import
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+    return load_app("collection_intake")
+
+
+class ClientError(Exception):
+    def __init__(self, code):
+        super().__init__(f"An error occurred ({code})")
+        self.response = {"Error": {"Code": code, "Message": code}}
+
+
+class StepFunctions:
+    """Fails the executions whose search terms include a term of `failing`, remembers the started names"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.started = {}
+
+    def start_execution(self, stateMachineArn, name, input):
+        input = json.loads(input)
+        if self.failing & set(input["search_terms"]):
+            raise ClientError("ValidationException")
+        if name in self.started:
+            raise ClientError("ExecutionAlreadyExists")
+        self.started[name] = input["search_terms"]
+        return {"executionArn": executions.get_execution_arn(stateMachineArn, name)}
+
+
+@pytest.fixture
+def intake(collection_intake, monkeypatch):
+    monkeypatch.setenv("STATE_MACHINE_ARN", "arn:aws:states:us-east-2:000000000000:stateMachine:Collection")
+    monkeypatch.setattr(collection_intake, "INTAKE_MAX_TERMS", 3)
+    return collection_intake
+
+
+def make_batch(*search_terms):
+    event = make_intake_batch([{"search_terms": terms} for terms in search_terms])
+    for index, record in enumerate(event["Records"]):
+        record["messageId"] = f"m{index}"
+    return event
+
+
+def test_terms_are_merged_across_messages(intake):
+    records = make_batch(["Zinc", "Collagen"], ["zinc ", "Iron"])["Records"]
+    records.append({"messageId": "bad", "body": "not json"})
+
+    terms, dropped = intake.merge_search_terms(records)
+
+    assert dropped == 1
+    assert terms == [{"term": "Zinc", "message_ids": ["m0", "m1"]}, {"term": "Collagen", "message_ids": ["m0"]},
+                     {"term": "Iron", "message_ids": ["m1"]}]
+
+
+def test_chunks_keep_the_terms_of_a_message_together(intake, monkeypatch):
+    client = StepFunctions()
+    monkeypatch.setattr(intake, "client", client)
+
+    result = intake.lambda_handler(make_batch(["a", "b"], ["c", "d"], ["e"], ["f", "g", "h", "i", "j", "k", "l"]),
+                                   CONTEXT)
+
+    assert result == {"batchItemFailures": []}
+    assert sorted(client.started.values()) == [["a", "b"], ["c", "d", "e"], ["f", "g", "h"], ["i", "j", "k"], ["l"]]
+    assert all(len(terms) <= intake.INTAKE_MAX_TERMS for terms in client.started.values())
+
+
+def test_only_the_messages_of_failed_chunks_are_retried(intake, monkeypatch):
+    client = StepFunctions(failing={"c"})
+    monkeypatch.setattr(intake, "client", client)
+    # m3 also asks for c, which is collected by the chunk of m1
+    event = make_batch(["a", "b"], ["c", "d"], ["e"], ["f", "C"])
+
+    result = intake.lambda_handler(event, CONTEXT)
+
+    assert result == {"batchItemFailures": [{"itemIdentifier": "m1"}, {"itemIdentifier": "m2"},
+                                            {"itemIdentifier": "m3"}]}
+    assert sorted(client.started.values()) == [["a", "b"], ["f"]]
+
+
+def test_redelivered_messages_start_nothing_twice(intake, monkeypatch):
+    client = StepFunctions()
+    monkeypatch.setattr(intake, "client", client)
+    event = make_batch(["a", "b"], ["c"], ["d", "e", "f", "g", "h"])
+    intake.lambda_handler(event, CONTEXT)
+    started = dict(client.started)
+
+    # The whole batch again, e.g. after the function timed out, then the large message alone
+    assert intake.lambda_handler(event, CONTEXT) == {"batchItemFailures": []}
+    assert intake.lambda_handler({"Records": event["Records"][2:]}, CONTEXT) == {"batchItemFailures": []}
+
+    assert client.started == started
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from common import executions
+
+STATE_MACHINE_ARN = "arn:aws:states:us-east-2:000000000000:stateMachine:Collection"
+
+
+class ClientError(Exception):
+    def __init__(self, code):
+        super().__init__(f"An error occurred ({code})")
+        self.response = {"Error": {"Code": code, "Message": code}}
+
+
+class StepFunctions:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    def start_execution(self, stateMachineArn, name, input):
+        self.calls.append((name, json.loads(input)))
+        if self.errors:
+            raise ClientError(self.errors.pop(0))
+        return {"executionArn": executions.get_execution_arn(stateMachineArn, name)}
+
+
+@pytest.fixture(autouse=True)
+def fast_dispatch(monkeypatch):
+    monkeypatch.setattr(executions.rate_limiter, "get_backoff_delay", lambda attempt, retry_after=None, **kwargs: 0)
+
+
+def test_start_execution():
+    client = StepFunctions()
+
+    result = executions.start_execution(client, STATE_MACHINE_ARN, "request-1", {"search_terms": ["a"]})
+
+    assert result == {"name": "request-1",
+                      "execution_arn": "arn:aws:states:us-east-2:000000000000:execution:Collection:request-1"}
+    assert client.calls == [("request-1", {"search_terms": ["a"]})]
+
+
+def test_existing_execution_counts_as_started():
+    client = StepFunctions("ExecutionAlreadyExists")
+
+    result = executions.start_execution(client, STATE_MACHINE_ARN, "request-1", {"search_terms": ["a"]})
+
+    assert result == {"name": "request-1", "already_started": True,
+                      "execution_arn": executions.get_execution_arn(STATE_MACHINE_ARN, "request-1")}
+    assert len(client.calls) == 1
+
+
+def test_throttled_start_is_retried():
+    client = StepFunctions("ThrottlingException", "ThrottlingException")
+
+    result = executions.start_execution(client, STATE_MACHINE_ARN, "request-1", {})
+
+    assert "error" not in result
+    assert len(client.calls) == 3
+
+
+def test_other_errors_are_reported():
+    client = StepFunctions("InvalidExecutionInput")
+
+    results = executions.start_executions(client, STATE_MACHINE_ARN, [
+        {"name": "request-1", "input": {}},
+        {"name": "request-2", "input": {}}
+    ], max_workers=1)
+
+    assert results[0]["error"] == "InvalidExecutionInput"
+    assert "execution_arn" in results[1]
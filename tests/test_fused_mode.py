@@ -0,0 +1,101 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+from common import claim_check, ingestion, kv_store, seen_posts, watermarks  # noqa: E402
+from local_runner.handlers import load_app  # noqa: E402
+
+TERMS = ["Vitamin D3", "Collagen", "Zinc"]
+
+
+@pytest.fixture(scope="module")
+def clean_data():
+    return load_app("clean_data")
+
+
+@pytest.fixture(scope="module")
+def ingest_data():
+    return load_app("ingest_data")
+
+
+def make_records(count):
+    # Some posts are left out by the region, create_time and plays filters
+    return [{"post_id": str(index), "url": f"https://www.tiktok.com/@creator/video/{index}",
+             "description": f"post {index}",
+             "create_time": f"2024-{5 + index % 3:02d}-{1 + index % 28:02d}T00:00:00.000Z",
+             "play_count": f"{(index * 7919) % 90_000:,}", "region": ["US", "CA", "GB"][index % 3],
+             "profile_followers": index * 1000, "discovery_input": {"search_keyword": TERMS[index % 4 % 3]}}
+            for index in range(count)]
+
+
+@pytest.fixture
+def pipeline(clean_data, s3_bucket, stub_api, monkeypatch):
+    """clean_data and ingest_data against the stub ingestion API, with in-memory seen posts and watermarks"""
+    records = make_records(2000)
+    monkeypatch.setattr(clean_data, "iter_records", lambda snapshot_id: map(clean_data.project_record, records))
+    monkeypatch.setattr(clean_data, "CLAIM_CHECK_MODE", True)
+    monkeypatch.setattr(clean_data, "OUTPUT_FORMAT", "json")
+    monkeypatch.setattr(claim_check, "PAYLOAD_BUCKET", s3_bucket)
+    monkeypatch.setenv("API_BASE_URL", stub_api.url)
+
+    def reset():
+        monkeypatch.setattr(seen_posts, "_store", kv_store.create_store("memory"))
+        monkeypatch.setattr(watermarks, "_store", kv_store.create_store("memory"))
+        stub_api.requests.clear()
+
+    reset()
+    return reset
+
+
+def get_ingested(stub_api):
+    posts = [post for request in stub_api.requests for post in request["body"]]
+    return sorted(posts, key=lambda post: post["post_id"])
+
+
+def get_stored_watermarks():
+    return watermarks.get_watermarks(TERMS)
+
+
+def test_fused_mode_ingests_what_clean_then_ingest_does(clean_data, ingest_data, pipeline, stub_api):
+    event = {"snapshot_id": "s_1", "status": "ready"}
+
+    claim = clean_data.lambda_handler({**event, "fused": False, "streaming": True}, None)
+    output = ingest_data.lambda_handler(claim, None)
+    two_steps = get_ingested(stub_api)
+    two_steps_watermarks = get_stored_watermarks()
+    two_steps_seen = seen_posts.get_seen(post["post_id"] for post in two_steps)
+
+    pipeline()
+    fused = clean_data.lambda_handler({**event, "fused": True}, None)
+
+    assert fused["fused"] is True
+    assert len(two_steps) > 500
+    assert get_ingested(stub_api) == two_steps
+    assert get_stored_watermarks() == two_steps_watermarks != {}
+    assert seen_posts.get_seen(post["post_id"] for post in two_steps) == two_steps_seen
+    assert fused["summary"]["indexed_posts"] == output["summary"]["indexed_posts"] == len(two_steps)
+    assert fused["summary"]["watermarks"] == output["summary"]["watermarks"]
+    assert {key: fused["summary"]["dedup"][key] for key in ("records", "in_snapshot_duplicates")} == \
+        {key: claim["dedup"][key] for key in ("records", "in_snapshot_duplicates")}
+
+
+def test_failed_batch_keeps_the_watermarks(clean_data, pipeline, stub_api):
+    # The last batch is the only one under the batch size
+    def respond(request):
+        if len(request["body"]) < ingestion.MAX_BATCH_RECORDS:
+            return 400, {}, {"error": "bad request"}
+        return 200, {}, {"request_id": "stub"}
+
+    stub_api.respond = respond
+
+    output = clean_data.lambda_handler({"snapshot_id": "s_1", "status": "ready", "fused": True}, None)
+
+    [failed] = [request["body"] for request in stub_api.requests if len(request["body"]) < ingestion.MAX_BATCH_RECORDS]
+    posts = get_ingested(stub_api)
+    assert output["response"]["status"] == "partial"
+    assert "watermarks" not in output["summary"]
+    assert get_stored_watermarks() == {}
+    # The posts of the accepted batches are indexed, the rejected ones are picked up again by the next run
+    assert seen_posts.get_seen(post["post_id"] for post in posts) == \
+        {post["post_id"] for post in posts} - {post["post_id"] for post in failed}
+    assert output["summary"]["indexed_posts"] == len(posts) - len(failed)
@@ -0,0 +1,48 @@
+import pytest
+
+from common import ingestion, kv_store, seen_posts
+from local_runner.handlers import load_app
+
+
+@pytest.fixture(scope="module")
+def ingest_data():
+    return load_app("ingest_data")
+
+
+@pytest.fixture
+def seen_store(monkeypatch):
+    store = kv_store.create_store("memory")
+    monkeypatch.setattr(seen_posts, "_store", store)
+    return store
+
+
+def test_only_accepted_batches_are_marked_seen(ingest_data, seen_store, stub_api, monkeypatch):
+    monkeypatch.setenv("API_BASE_URL", stub_api.url)
+    posts = [{"post_id": str(index), "description": f"post {index}"}
+             for index in range(ingestion.MAX_BATCH_RECORDS * 3)]
+    rejected = {str(index) for index in range(ingestion.MAX_BATCH_RECORDS, ingestion.MAX_BATCH_RECORDS * 2)}
+
+    def respond(request):
+        if request["body"][0]["post_id"] in rejected:
+            return 400, {}, {"error": "bad request"}
+        return 200, {}, {"request_id": "stub"}
+
+    stub_api.respond = respond
+
+    output = ingest_data.lambda_handler(posts, None)
+
+    summary = output["summary"]
+    assert output["response"]["status"] == "partial"
+    assert summary["failed_batches"] == 1
+    assert summary["indexed_posts"] == len(posts) - len(rejected)
+    assert seen_posts.get_seen(post["post_id"] for post in posts) == {post["post_id"] for post in posts} - rejected
+
+
+def test_all_batches_failing_raises(ingest_data, seen_store, stub_api, monkeypatch):
+    monkeypatch.setenv("API_BASE_URL", stub_api.url)
+    stub_api.default = (400, {}, {"error": "bad request"})
+
+    with pytest.raises(Exception, match="All 1 ingestion batch"):
+        ingest_data.lambda_handler([{"post_id": "1"}], None)
+
+    assert seen_posts.get_seen(["1"]) == set()
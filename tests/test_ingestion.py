@@ -0,0 +1,192 @@
+import gzip
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from common import ingestion
+
+
+def make_posts(count, start=0):
+    return [{"post_id": str(index), "description": f"post {index}"} for index in range(start, start + count)]
+
+
+def test_iter_batches_bounds_records_and_keeps_order():
+    batches = list(ingestion.iter_batches(make_posts(25), max_records=10))
+
+    assert [len(batch["post_ids"]) for batch in batches] == [10, 10, 5]
+    assert [batch["index"] for batch in batches] == [0, 1, 2]
+    assert sum((batch["post_ids"] for batch in batches), []) == [str(index) for index in range(25)]
+
+
+def test_iter_batches_bounds_bytes():
+    posts = make_posts(50)
+    max_bytes = 300
+    batches = list(ingestion.iter_batches(posts, max_bytes=max_bytes, max_records=1000))
+
+    assert len(batches) > 1
+    assert all(batch["bytes"] <= max_bytes for batch in batches)
+    bodies = [gzip.decompress(batch["body"]) if ingestion.COMPRESS_BATCHES else batch["body"] for batch in batches]
+    assert sum((json.loads(body) for body in bodies), []) == posts
+
+
+def test_iter_batches_keeps_an_oversized_post_alone():
+    posts = [{"post_id": "big", "description": "x" * 1000}, *make_posts(2)]
+    batches = list(ingestion.iter_batches(posts, max_bytes=200))
+
+    assert [batch["post_ids"] for batch in batches] == [["big"], ["0", "1"]]
+
+
+def test_post_batch_sends_gzip(stub_api, monkeypatch):
+    monkeypatch.setattr(ingestion, "COMPRESS_BATCHES", True)
+    batch = next(ingestion.iter_batches(make_posts(3)))
+
+    result = ingestion.post_batch(stub_api.url, batch)
+
+    request = stub_api.requests[0]
+    assert result["status"] == "success"
+    assert result["request_id"] == "stub"
+    assert request["headers"]["Content-Encoding"] == "gzip"
+    assert request["body"] == make_posts(3)
+    assert result["sent_bytes"] == len(request["raw"]) < result["bytes"] + 20
+
+
+def test_post_batch_sends_plain_json_when_compression_is_off(stub_api, monkeypatch):
+    monkeypatch.setattr(ingestion, "COMPRESS_BATCHES", False)
+    batch = next(ingestion.iter_batches(make_posts(3)))
+
+    ingestion.post_batch(stub_api.url, batch)
+
+    request = stub_api.requests[0]
+    assert "Content-Encoding" not in request["headers"]
+    assert json.loads(request["raw"]) == make_posts(3)
+
+
+def test_idempotency_key_is_stable_across_retries(stub_api, monkeypatch):
+    monkeypatch.setattr(ingestion.time, "sleep", lambda seconds: None)
+    stub_api.responses = [(503, {}, {"error": "unavailable"})]
+    batches = list(ingestion.iter_batches(make_posts(3)))
+
+    results = ingestion.send_batches(stub_api.url, batches)
+
+    keys = [request["headers"]["Idempotency-Key"] for request in stub_api.requests]
+    assert len(keys) == 2
+    assert keys[0] == keys[1] == batches[0]["idempotency_key"]
+    assert results[0]["status"] == "success"
+    assert results[0]["attempts"] == 2
+
+
+def test_idempotency_key_ignores_post_order():
+    posts = make_posts(5)
+    forward = next(ingestion.iter_batches(posts))
+    backward = next(ingestion.iter_batches(posts[::-1]))
+
+    assert forward["idempotency_key"] == backward["idempotency_key"]
+    assert forward["idempotency_key"] != next(ingestion.iter_batches(make_posts(5, start=1)))["idempotency_key"]
+
+
+def test_post_batch_reads_retry_after(stub_api):
+    stub_api.responses = [(429, {"Retry-After": "7"}, {"error": "slow down"})]
+    batch = next(ingestion.iter_batches(make_posts(1)))
+
+    result = ingestion.post_batch(stub_api.url, batch)
+
+    assert result["status"] == "failed"
+    assert result["retryable"] is True
+    assert result["status_code"] == 429
+    assert result["retry_after"] == 7.0
+
+
+def test_send_batches_waits_for_retry_after(stub_api, monkeypatch):
+    delays = []
+    monkeypatch.setattr(ingestion.time, "sleep", delays.append)
+    stub_api.responses = [(429, {"Retry-After": "5"}, {"error": "slow down"})]
+    batches = list(ingestion.iter_batches(make_posts(1)))
+
+    results = ingestion.send_batches(stub_api.url, batches)
+
+    assert results[0]["status"] == "success"
+    assert len(delays) == 1
+    assert delays[0] >= 5
+
+
+def test_stream_batches_waits_for_retry_after(stub_api):
+    stub_api.responses = [(429, {"Retry-After": "1"}, {"error": "slow down"})]
+    batches = ingestion.iter_batches(make_posts(4), max_records=2)
+
+    start = time.monotonic()
+    results = ingestion.stream_batches(stub_api.url, batches, max_workers=1, max_in_flight=1)
+    elapsed = time.monotonic() - start
+
+    assert [result["status"] for result in results] == ["success", "success"]
+    assert results[0]["attempts"] == 2
+    assert elapsed >= 1
+    assert len(stub_api.requests) == 3
+
+
+def test_client_errors_are_not_retried(stub_api, monkeypatch):
+    monkeypatch.setattr(ingestion.time, "sleep", lambda seconds: None)
+    stub_api.responses = [(400, {}, {"error": "bad request"})]
+    batches = list(ingestion.iter_batches(make_posts(1)))
+
+    results = ingestion.send_batches(stub_api.url, batches)
+
+    assert results[0]["status"] == "failed"
+    assert results[0]["retryable"] is False
+    assert len(stub_api.requests) == 1
+
+
+@pytest.mark.parametrize("send", ["send_batches", "stream_batches"])
+def test_partial_failure_is_reported(stub_api, monkeypatch, send):
+    monkeypatch.setattr(ingestion, "MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(ingestion.rate_limiter, "get_backoff_delay", lambda attempt, retry_after=None: 0)
+    failing = next(ingestion.iter_batches(make_posts(3, start=100)))["idempotency_key"]
+
+    def respond(request):
+        if request["headers"]["Idempotency-Key"] == failing:
+            return 500, {}, {"error": "boom"}
+        return 200, {}, {"request_id": "stub"}
+
+    stub_api.respond = respond
+    posts = make_posts(6) + make_posts(3, start=100)
+
+    start = time.perf_counter()
+    results = getattr(ingestion, send)(stub_api.url, list(ingestion.iter_batches(posts, max_records=3)))
+    summary = ingestion.summarize(results, time.perf_counter() - start)
+    response = ingestion.make_response(results, summary)
+
+    assert summary["records"] == 9
+    assert summary["batches"] == 3
+    assert summary["failed_batches"] == 1
+    assert summary["failed_records"] == 3
+    assert response["response"]["status"] == "partial"
+    assert response["response"]["request_ids"] == ["stub", "stub"]
+    assert [(result["index"], result["records"], result["attempts"], result["status_code"])
+            for result in summary["failed_batch_results"]] == [(2, 3, 2, 500)]
+
+
+def test_summary_does_not_grow_with_the_batches():
+    results = [{"index": index, "status": "failed" if index % 2 else "success", "records": 500, "bytes": 1000,
+                "sent_bytes": 100, "attempts": 3, "status_code": 503 if index % 2 else 200, "request_id": str(index),
+                "idempotency_key": "key", "duration_ms": 10} for index in range(1000)]
+
+    summary = ingestion.summarize(results, 2.0, max_reported=5)
+    response = ingestion.make_response(results, summary)
+
+    assert summary["batches"] == 1000
+    assert summary["failed_batches"] == 500
+    assert summary["failed_records"] == 250_000
+    assert [result["index"] for result in summary["failed_batch_results"]] == [1, 3, 5, 7, 9]
+    assert "batch_results" not in summary
+    assert len(response["response"]["request_ids"]) == ingestion.MAX_REPORTED_BATCHES
+    assert len(json.dumps(response)) < 8 * 1024
+
+
+def test_requests_is_imported_on_the_first_send():
+    # In a fresh interpreter, the test session has imported requests already
+    code = ("import sys; from common import ingestion; assert 'requests' not in sys.modules; "
+            "ingestion.requests.exceptions; assert 'requests' in sys.modules")
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=Path(ingestion.__file__).parents[1])
@@ -0,0 +1,97 @@
+import pytest
+
+from common import kv_store
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    return kv_store.create_store(request.param, path=str(tmp_path / "store.sqlite3"))
+
+
+def test_round_trip(store):
+    store.put("a", {"value": 1})
+    store.put_many({"b": {"value": 2}, "c": {"value": 3}})
+    store.delete("c")
+
+    assert store.get("a") == {"value": 1}
+    assert store.get("c") is None
+    assert store.get_many(["a", "b", "c"]) == {"a": {"value": 1}, "b": {"value": 2}}
+
+
+def test_expired_entries_are_gone(store, monkeypatch):
+    store.put("a", {"value": 1}, ttl=60)
+    now = kv_store.time.time()
+    monkeypatch.setattr(kv_store.time, "time", lambda: now + 61)
+
+    assert store.get("a") is None
+
+
+def test_disabled_backend():
+    assert kv_store.create_store("none") is None
+    with pytest.raises(ValueError, match="Unsupported store backend"):
+        kv_store.create_store("redis")
+
+
+def test_incomplete_backend_fails_at_construction():
+    class GetOnlyStore(kv_store.KeyValueStore):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError, match="abstract"):
+        GetOnlyStore()
+
+
+@pytest.fixture
+def dynamodb_store(aws, monkeypatch):
+    import boto3
+
+    monkeypatch.setattr(kv_store, "DYNAMODB_ENDPOINT_URL", None)
+    boto3.client("dynamodb").create_table(TableName="store", BillingMode="PAY_PER_REQUEST",
+                                          KeySchema=[{"AttributeName": "pk", "KeyType": "HASH"}],
+                                          AttributeDefinitions=[{"AttributeName": "pk", "AttributeType": "S"}])
+    return kv_store.DynamoDBStore("store")
+
+
+def throttle(store, monkeypatch, times):
+    """Leave the second half of the keys unprocessed on the first `times` BatchGetItem calls"""
+    client = store.table.meta.client
+    batch_get_item = client.batch_get_item
+    calls = []
+
+    def throttled(RequestItems):
+        calls.append(RequestItems)
+        if len(calls) > times:
+            return batch_get_item(RequestItems=RequestItems)
+        keys = RequestItems["store"]["Keys"]
+        response = batch_get_item(RequestItems={"store": {"Keys": keys[:len(keys) // 2]}})
+        return {**response, "UnprocessedKeys": {"store": {"Keys": keys[len(keys) // 2:]}}}
+
+    monkeypatch.setattr(client, "batch_get_item", throttled)
+    return calls
+
+
+def test_unprocessed_keys_are_retried_with_backoff(dynamodb_store, monkeypatch):
+    delays = []
+    monkeypatch.setattr(kv_store.time, "sleep", delays.append)
+    dynamodb_store.put_many({str(index): {"value": index} for index in range(8)})
+    calls = throttle(dynamodb_store, monkeypatch, times=2)
+
+    values = dynamodb_store.get_many([str(index) for index in range(8)])
+
+    assert values == {str(index): {"value": index} for index in range(8)}
+    assert [len(call["store"]["Keys"]) for call in calls] == [8, 4, 2]
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= kv_store.DYNAMODB_BACKOFF_BASE
+    assert 0 <= delays[1] <= 2 * kv_store.DYNAMODB_BACKOFF_BASE
+
+
+def test_unprocessed_keys_give_up_after_the_last_attempt(dynamodb_store, monkeypatch):
+    monkeypatch.setattr(kv_store.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(kv_store, "DYNAMODB_MAX_BATCH_ATTEMPTS", 3)
+    dynamodb_store.put_many({str(index): {"value": index} for index in range(16)})
+    calls = throttle(dynamodb_store, monkeypatch, times=100)
+
+    values = dynamodb_store.get_many([str(index) for index in range(16)])
+
+    assert len(calls) == 3
+    assert len(values) == 14
@@ -0,0 +1,76 @@
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+openai = pytest.importorskip("openai")
+httpx = pytest.importorskip("httpx")
+
+from common import llm  # noqa: E402
+
+
+class Completions:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=outcome))])
+
+
+def rate_limit_error(retry_after="0"):
+    response = httpx.Response(429, headers={"retry-after": retry_after},
+                              request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    def use(*outcomes):
+        completions = Completions(*outcomes)
+        monkeypatch.setattr(llm, "_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        return completions
+
+    monkeypatch.setattr(llm.llm_cache, "get_cache", lambda: None)
+    monkeypatch.setattr(llm.limiter, "pause", lambda seconds: None)
+    return use
+
+
+def test_completion(completions):
+    client = completions("keywords")
+
+    assert llm.get_openai_completion("prompt") == "keywords"
+    assert client.calls == 1
+
+
+def test_rate_limited_completion_is_retried(completions):
+    client = completions(rate_limit_error(), "keywords")
+
+    assert llm.get_openai_completion("prompt") == "keywords"
+    assert client.calls == 2
+
+
+def test_rate_limit_is_raised_after_the_last_attempt(completions, monkeypatch):
+    monkeypatch.setattr(llm, "OPENAI_MAX_ATTEMPTS", 2)
+    client = completions(rate_limit_error(), rate_limit_error())
+
+    with pytest.raises(openai.RateLimitError):
+        llm.get_openai_completion("prompt")
+    assert client.calls == 2
+
+
+def test_zero_attempts_still_calls_once(monkeypatch):
+    monkeypatch.setenv("OPENAI_MAX_ATTEMPTS", "0")
+    try:
+        assert importlib.reload(llm).OPENAI_MAX_ATTEMPTS == 1
+        client = Completions("keywords")
+        monkeypatch.setattr(llm, "_client", SimpleNamespace(chat=SimpleNamespace(completions=client)))
+        assert llm.get_openai_completion("prompt") == "keywords"
+        assert client.calls == 1
+    finally:
+        monkeypatch.delenv("OPENAI_MAX_ATTEMPTS")
+        importlib.reload(llm)
@@ -0,0 +1,73 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+import pytest
+
+from conftest import ROOT
+
+pytest.importorskip("pandas")
+
+
+def run_local(tmp_path, *options):
+    emf_output = tmp_path / "emf.jsonl"
+    completed = subprocess.run([sys.executable, "-m", "local_runner", "--records-per-term", "10", "--snapshot-delay",
+                                "0", "--time-scale", "0", "--json", "--emf-output", str(emf_output), *options],
+                               cwd=ROOT, env={**os.environ, "METRICS_ENABLED": "true"}, capture_output=True,
+                               text=True, timeout=120)
+    assert completed.returncode == 0, completed.stderr
+    documents = [json.loads(line) for line in emf_output.read_text().splitlines()]
+    return json.loads(completed.stdout), documents
+
+
+def get_metric_values(documents):
+    """Values of every metric by stage, a document holds one value or the list of values it aggregated"""
+    values = defaultdict(list)
+    for document in documents:
+        for directive in document["_aws"]["CloudWatchMetrics"]:
+            for metric in directive["Metrics"]:
+                value = document[metric["Name"]]
+                values[(document["Stage"], metric["Name"])].extend(value if isinstance(value, list) else [value])
+    return values
+
+
+def test_collection_end_to_end(tmp_path):
+    report, documents = run_local(tmp_path, "--executions", "3", "--terms", "2")
+
+    assert report["executions"] == report["succeeded"] == 3
+    assert report["final_states"] == {"Notify Success": 3}
+    for state in ("Check Snapshot Cache", "Brightdata Callback", "Clean Data", "Ingest Data", "Notify Success"):
+        assert report["states"][state]["calls"] == 3
+        assert report["states"][state]["errors"] == 0
+    assert "Notify Failure" not in report["states"]
+    assert report["brightdata_triggers"] == 3
+
+    for document in documents:
+        directive = document["_aws"]["CloudWatchMetrics"][0]
+        assert directive["Namespace"] == "Tapestry/Collection"
+        assert directive["Dimensions"] == [["Function", "Stage"]]
+    values = get_metric_values(documents)
+    # Every cleaned post is sent to the ingestion API once
+    cleaned = values[("clean_data", "Records")]
+    assert len(cleaned) == 3 and sum(cleaned) > 0
+    assert sum(values[("post_batch", "Records")]) == sum(cleaned)
+    assert len(values[("stream_batches", "Duration")]) == 3
+
+
+def test_failed_ingestion_ends_in_notify_failure(tmp_path):
+    report, documents = run_local(tmp_path, "--executions", "2", "--error-rate", "ingest=1", "--error-status",
+                                  "ingest=400")
+
+    assert report["executions"] == 2
+    assert report["failed"] == 2
+    assert report["final_states"] == {"Notify Failure": 2}
+    # The state machine retries the task, the handler does not retry a 400
+    ingest = report["states"]["Ingest Data"]
+    assert ingest["errors"] == ingest["calls"] == ingest["retries"] + 2
+    assert "Notify Success" not in report["states"]
+
+    values = get_metric_values(documents)
+    assert len(values[("clean_data", "Records")]) == 2
+    assert len(values[("post_batch", "Duration")]) == ingest["calls"]
@@ -0,0 +1,61 @@
+import pytest
+
+from local_runner.handlers import load_app
+
+
+@pytest.fixture(scope="module")
+def notify_slack():
+    return load_app("notify_slack")
+
+
+def make_shard(shard, records, request_id, failed_batches=0):
+    return {"shard": shard, "status": "success", "search_terms": [f"term {shard}"],
+            "response": {"request_ids": [request_id]},
+            "summary": {"records": records, "batches": 2, "failed_batches": failed_batches,
+                        "failed_records": 10 * failed_batches, "bytes": 1000, "sent_bytes": 100,
+                        "duration_ms": 100 * (shard + 1), "records_per_second": 50.0,
+                        "failed_batch_results": [{"index": 1, "records": 10}] if failed_batches else [],
+                        "dedup": {"records": records, "in_snapshot_duplicates": 1, "previously_ingested": 1}}}
+
+
+def make_failed_shard(shard):
+    return {"shard": shard, "status": "failed", "search_terms": [f"term {shard}"],
+            "error": {"Error": "States.TaskFailed", "Cause": "boom"}}
+
+
+def test_merge_with_a_failed_shard(notify_slack):
+    merged = notify_slack.merge_shard_results([make_shard(0, 20, "a"), make_failed_shard(1),
+                                               make_shard(2, 30, "b", failed_batches=1)])
+
+    summary = merged["summary"]
+    assert merged["response"] == {"request_id": "a", "request_ids": ["a", "b"]}
+    assert (summary["records"], summary["batches"], summary["failed_batches"], summary["failed_records"]) == \
+        (50, 4, 1, 10)
+    assert summary["duration_ms"] == 300
+    assert summary["records_per_second"] == 100.0
+    assert summary["failed_batch_results"] == [{"index": "2.1", "records": 10}]
+    assert summary["dedup"] == {"records": 50, "in_snapshot_duplicates": 2, "previously_ingested": 2,
+                                "duplicate_ratio": 0.08}
+    assert merged["shard_summary"] == {"shards": 3, "succeeded": 2, "failed": [
+        {"shard": 1, "search_terms": ["term 1"], "error": "States.TaskFailed"}]}
+
+
+def test_merge_with_every_shard_failed(notify_slack):
+    merged = notify_slack.merge_shard_results([make_failed_shard(0), {"shard": 1, "status": "failed"}])
+
+    assert merged["response"] == {"request_id": None, "request_ids": []}
+    assert merged["summary"]["records"] == 0
+    assert "dedup" not in merged["summary"]
+    assert merged["shard_summary"] == {"shards": 2, "succeeded": 0, "failed": [
+        {"shard": 0, "search_terms": ["term 0"], "error": "States.TaskFailed"},
+        {"shard": 1, "search_terms": [], "error": "Unknown"}]}
+
+
+def test_every_shard_failed_is_reported_as_a_failure(notify_slack):
+    context = type("Context", (), {"invoked_function_arn": "arn:aws:lambda:us-east-2:000000000000:function:notify"})
+    event = {"status": "success", "message": "Collection finished", "executionId": "arn:aws:states:execution:1",
+             "details": {"shards": [make_failed_shard(0)]}}
+
+    message = notify_slack.generate_slack_message(event, context)
+
+    assert message["blocks"][0]["text"]["text"] == "❌ Collection finished, but every shard failed"
@@ -0,0 +1,38 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+from common import rate_limiter
+
+
+@pytest.mark.parametrize("headers, expected", [
+    (None, None),
+    ({}, None),
+    ({"retry-after": "7"}, 7.0),
+    ({"retry-after": "1.5"}, 1.5),
+    ({"retry-after-ms": "250", "retry-after": "7"}, 0.25),
+    ({"x-ratelimit-reset-requests": "1m30s", "x-ratelimit-reset-tokens": "20ms"}, 90.0),
+])
+def test_get_retry_after(headers, expected):
+    assert rate_limiter.get_retry_after(headers) == expected
+
+
+def test_get_retry_after_reads_http_dates():
+    retry_after = rate_limiter.get_retry_after({"retry-after": formatdate(time.time() + 30, usegmt=True)})
+
+    assert 28 <= retry_after <= 30
+    assert rate_limiter.get_retry_after({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}) == 0.0
+
+
+@pytest.mark.parametrize("value", ["soon", "Wed, 99 Foo 2015 07:28:00 GMT", "-", "Mon, 32 Jan 2024 00:00:00 GMT"])
+def test_malformed_retry_after_falls_back(value):
+    assert rate_limiter.get_retry_after({"retry-after": value}) is None
+    assert rate_limiter.get_retry_after({"retry-after": value, "x-ratelimit-reset-requests": "2s"}) == 2.0
+    assert rate_limiter.get_backoff_delay(0, rate_limiter.get_retry_after({"retry-after": value})) <= 1.0
+
+
+def test_backoff_is_never_shorter_than_retry_after():
+    for attempt in range(5):
+        assert rate_limiter.get_backoff_delay(attempt, 3.0) >= 3.0
+        assert 0 <= rate_limiter.get_backoff_delay(attempt, cap=2.0) <= 2.0
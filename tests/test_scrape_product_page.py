@@ -0,0 +1,88 @@
+import pytest
+
+from common import tokens
+from local_runner.handlers import load_app
+
+DESCRIPTION = ("Sunny Vitamin D3 softgels support healthy bones and teeth. Each serving provides 5000 IU of "
+               "cholecalciferol in extra virgin olive oil. Ingredients: vitamin D3, olive oil, gelatin. "
+               "Suggested use: take one softgel daily with a meal.")
+
+PAGE = f"""<html><head><title>Sunny Vitamin D3 5000 IU Softgels</title><script>var x = 1;</script></head>
+<body>
+  <header class="site-header"><nav><a href="/">Home</a> <a href="/shop">Shop all supplements</a></nav></header>
+  <div id="cookie-banner"><p>We use cookies to improve your experience on this website, accept them all.</p></div>
+  <main>
+    <h1>Sunny Vitamin D3 5000 IU Softgels</h1>
+    <p>{DESCRIPTION}</p>
+    <ul><li>Made in the USA from certified organic olive oil</li><li>Free of gluten, soy and dairy</li></ul>
+    <img src="https://cdn.example.com/d3.jpg">
+    <div class="related">
+      <p>Customers also bought <a href="/p/1">Sunny Magnesium Glycinate 400 mg capsules</a>,
+         <a href="/p/2">Sunny Omega 3 Fish Oil softgels</a> and <a href="/p/3">Sunny Zinc Picolinate tablets</a></p>
+    </div>
+    <p>Great value, my levels improved after two months!</p>
+  </main>
+  <footer><p>Copyright 2024 Sunny Supplements. All rights reserved. Terms of service and privacy policy.</p></footer>
+</body></html>"""
+
+
+@pytest.fixture(scope="module")
+def scrape_product_page():
+    return load_app("scrape_product_page")
+
+
+@pytest.fixture(params=["lxml", "bs4"])
+def extract(request, scrape_product_page):
+    pytest.importorskip(request.param)
+    return getattr(scrape_product_page, f"extract_with_{request.param}")
+
+
+def test_distill_drops_boilerplate_and_link_lists(scrape_product_page, extract):
+    body_content, image_urls, reviews, blocks = extract(PAGE)
+
+    distilled = scrape_product_page.distill(blocks, body_content)
+
+    assert distilled.splitlines() == [
+        "Sunny Vitamin D3 5000 IU Softgels",
+        DESCRIPTION,
+        "Made in the USA from certified organic olive oil",
+        "Free of gluten, soy and dairy",
+        "Great value, my levels improved after two months!"
+    ]
+    assert image_urls == ["https://cdn.example.com/d3.jpg"]
+    assert "Great value, my levels improved after two months" in reviews
+    # The whole page is still extracted, the fingerprint is computed on it
+    assert "Customers also bought" in body_content and "cookies" in body_content
+
+
+def test_lxml_and_bs4_distill_the_same_text(scrape_product_page):
+    pytest.importorskip("lxml")
+    pytest.importorskip("bs4")
+
+    lxml_content, _, _, lxml_blocks = scrape_product_page.extract_with_lxml(PAGE)
+    bs4_content, _, _, bs4_blocks = scrape_product_page.extract_with_bs4(PAGE)
+
+    assert [(block["tag"], block["text"]) for block in lxml_blocks] == \
+        [(block["tag"], block["text"]) for block in bs4_blocks]
+    assert scrape_product_page.distill(lxml_blocks, lxml_content) == \
+        scrape_product_page.distill(bs4_blocks, bs4_content)
+
+
+def test_distill_keeps_to_the_budget(scrape_product_page, extract):
+    paragraphs = "".join(f"<p>Batch {index}: {DESCRIPTION}</p>" for index in range(40))
+    body_content, _, _, blocks = extract(f"<html><body><h1>Sunny Vitamin D3</h1>{paragraphs}</body></html>")
+
+    distilled = scrape_product_page.distill(blocks, body_content, budget=200)
+
+    assert tokens.count_tokens(distilled) <= 200
+    assert distilled.startswith("Sunny Vitamin D3\nBatch 0:")
+    assert tokens.count_tokens(body_content) > 2000
+
+
+def test_distill_falls_back_to_the_body_text(scrape_product_page):
+    body_content = " ".join(["filler"] * 500)
+
+    distilled = scrape_product_page.distill([], body_content, budget=20)
+
+    assert body_content.startswith(distilled)
+    assert tokens.count_tokens(distilled) <= 20
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+from common import claim_check, kv_store, snapshot_cache  # noqa: E402
+from local_runner.handlers import load_app  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def clean_data():
+    return load_app("clean_data")
+
+
+@pytest.fixture(scope="module")
+def brightdata_callback():
+    return load_app("brightdata_callback")
+
+
+@pytest.fixture
+def cache(s3_bucket, monkeypatch):
+    """The snapshot cache on a moto DynamoDB table, its claim checks in the moto payload bucket"""
+    import boto3
+
+    monkeypatch.setattr(kv_store, "DYNAMODB_ENDPOINT_URL", None)
+    monkeypatch.setattr(claim_check, "PAYLOAD_BUCKET", s3_bucket)
+    boto3.client("dynamodb").create_table(TableName="snapshot-cache", BillingMode="PAY_PER_REQUEST",
+                                          KeySchema=[{"AttributeName": "pk", "KeyType": "HASH"}],
+                                          AttributeDefinitions=[{"AttributeName": "pk", "AttributeType": "S"}])
+    monkeypatch.setattr(snapshot_cache, "_store", kv_store.DynamoDBStore("snapshot-cache"))
+    return snapshot_cache.get_store()
+
+
+def make_posts(clean_data, terms):
+    records = [{"post_id": f"{term}-{index}", "url": f"https://www.tiktok.com/@creator/video/{index}",
+                "description": "", "create_time": f"2024-07-0{index + 1}T00:00:00.000Z", "play_count": "100,000",
+                "region": "US", "profile_followers": 10, "discovery_input": {"search_keyword": term}}
+               for term in terms for index in range(3)]
+    return clean_data.clean_records(clean_data.to_dataframe(records))
+
+
+def test_term_results_round_trip(clean_data, cache, monkeypatch):
+    monkeypatch.setattr(clean_data, "OUTPUT_FORMAT", "json")
+    df = make_posts(clean_data, ["Zinc", "Collagen"])
+
+    cached = clean_data.cache_term_results(df, "s_1", search_terms=["Zinc", "Collagen", "Vitamin D3"])
+    results = snapshot_cache.get_results(["Zinc", "Vitamin D3", "collagen "])
+
+    assert cached == 3
+    assert set(results) == {"Zinc", "Vitamin D3", "collagen "}
+    # A term none of whose posts were kept is cached as empty, without a claim check
+    assert results["Vitamin D3"] == {"term": "Vitamin D3", "snapshot_id": "s_1", "count": 0,
+                                     "cached_at": results["Vitamin D3"]["cached_at"]}
+    assert results["Zinc"]["count"] == 3 and results["Zinc"]["claim_check"]["bucket"] == "payloads"
+    loaded = clean_data.load_cached_results(list(results.values()))
+    expected = df.astype({"search_term": str}).sort_values("post_id", ignore_index=True)
+    loaded = loaded.sort_values("post_id", ignore_index=True)
+    assert loaded["post_id"].tolist() == expected["post_id"].tolist()
+    assert loaded["search_term"].tolist() == expected["search_term"].tolist()
+    assert loaded["play_count"].astype(str).tolist() == expected["play_count"].astype(str).tolist()
+
+
+def test_cached_results_expire(clean_data, cache, monkeypatch):
+    monkeypatch.setattr(clean_data, "OUTPUT_FORMAT", "json")
+    clean_data.cache_term_results(make_posts(clean_data, ["Zinc"]), "s_1", search_terms=["Zinc"])
+    now = time.time()
+
+    monkeypatch.setattr(time, "time", lambda: now + snapshot_cache.SNAPSHOT_CACHE_TTL_SECONDS - 5)
+    assert set(snapshot_cache.get_results(["Zinc"])) == {"Zinc"}
+    monkeypatch.setattr(time, "time", lambda: now + snapshot_cache.SNAPSHOT_CACHE_TTL_SECONDS + 5)
+    assert snapshot_cache.get_results(["Zinc"]) == {}
+
+
+def test_check_cache_hits_only_when_every_term_is_fresh(brightdata_callback, cache):
+    snapshot_cache.put_results({"Zinc": {"count": 0}, "Collagen": {"count": 0}}, "s_1")
+
+    hit = brightdata_callback.lambda_handler({"action": "check_cache", "input": {"search_terms": ["Collagen", "Zinc"]}},
+                                             None)
+
+    assert hit["hit"] is True
+    assert [result["term"] for result in hit["results"]] == ["Collagen", "Zinc"]
+
+
+def test_partial_hit_falls_back_to_a_trigger(brightdata_callback, cache, stub_api, monkeypatch):
+    monkeypatch.setattr(brightdata_callback, "BRIGHTDATA_API_URL", stub_api.url)
+    monkeypatch.setattr(brightdata_callback.coalescing, "is_enabled", lambda: False)
+    snapshot_cache.put_results({"Zinc": {"count": 0}}, "s_1")
+    event_input = {"search_terms": ["Zinc", "Collagen"]}
+
+    miss = brightdata_callback.lambda_handler({"action": "check_cache", "input": event_input}, None)
+    triggered = brightdata_callback.lambda_handler({"taskToken": "token", "input": event_input}, None)
+
+    assert miss == {"hit": False, "terms": 2, "cached_terms": 1, "results": []}
+    # Every term is discovered again, the fresh one included
+    assert stub_api.requests[0]["body"] == [{"search_keyword": "Zinc"}, {"search_keyword": "Collagen"}]
+    assert triggered["message"] == "Called brightdata API successfully"
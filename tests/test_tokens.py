@@ -0,0 +1,45 @@
+import sys
+
+import pytest
+
+from common import tokens
+
+PROSE = ("Vitamin D3 softgels support healthy bones and teeth. Each serving provides 5000 IU of cholecalciferol in "
+         "extra virgin olive oil, made without gluten, soy or artificial colors.")
+
+
+@pytest.fixture
+def approximate(monkeypatch):
+    """Token counts as they are when tiktoken is not installed"""
+    monkeypatch.setitem(sys.modules, "tiktoken", None)
+    monkeypatch.setattr(tokens, "TOKENIZER", "tiktoken")
+    monkeypatch.setattr(tokens, "_encoding", None)
+    monkeypatch.setattr(tokens, "_loaded", False)
+
+
+def test_missing_tiktoken_falls_back_to_the_pattern(approximate):
+    assert tokens.get_encoding() is None
+    assert tokens.count_tokens("Hello, world") == 5
+    assert tokens.count_tokens("") == tokens.count_tokens(None) == 0
+
+
+def test_approximate_truncation_keeps_a_prefix_within_budget(approximate):
+    truncated = tokens.truncate(PROSE, 10)
+
+    assert PROSE.startswith(truncated)
+    assert tokens.count_tokens(truncated) == 10
+    assert tokens.truncate(PROSE, 10_000) == PROSE
+    assert tokens.truncate(PROSE, 0) == ""
+
+
+def test_approximation_does_not_undercount(monkeypatch):
+    monkeypatch.setattr(tokens, "_encoding", None)
+    monkeypatch.setattr(tokens, "_loaded", False)
+    encoding = tokens.get_encoding()
+    if encoding is None:
+        pytest.skip("tiktoken or its encoding is unavailable")
+
+    approximated = sum(1 for _ in tokens.APPROXIMATE_TOKEN_PATTERN.finditer(PROSE))
+
+    assert approximated >= tokens.count_tokens(PROSE)
+    assert tokens.count_tokens(tokens.truncate(PROSE, 10)) <= 10